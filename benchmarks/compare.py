@@ -0,0 +1,46 @@
+'''
+Baselines of the benchmarks: results of earlier runs, stored as JSON, that new
+results are compared to.
+'''
+import json
+import os
+import platform
+import logging
+log = logging.getLogger(__name__)
+
+def load_baseline(path):
+    '''
+    Results stored in a baseline, empty if there is none.
+    '''
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        stored = json.load(f)
+    if stored['host'] != platform.node():
+        log.warning(f"The baseline in {path} was measured on {stored['host']}, comparing to it on another machine is not meaningful")
+    return stored['results']
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'host': platform.node(), 'cpus': os.cpu_count(), 'results': results}, f, indent=1, sort_keys=True)
+    log.info(f"Saved the baseline to {path}")
+
+def regressions(result, base, metrics, tolerance):
+    '''
+    Metrics of a result that are worse than in the baseline by more than the
+    tolerance. metrics maps each metric to +1 if higher is better, -1 if lower is.
+    '''
+    if base is None:
+        return []
+    worse = []
+    for metric, direction in metrics.items():
+        new, old = result.get(metric), base.get(metric)
+        # Nothing to compare to, e.g. no workers were used
+        if not new or not old:
+            continue
+        if direction > 0 and new < (1 - tolerance)*old:
+            worse.append(metric)
+        if direction < 0 and new > (1 + tolerance)*old:
+            worse.append(metric)
+    return worse
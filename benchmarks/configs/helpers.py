@@ -0,0 +1,52 @@
+'''
+Helper functions of the benchmark configs. The ntuples they read are written
+by util/synthetic.py, so values are random and only their shapes matter.
+'''
+import awkward as ak
+
+# Number of regions in many_regions.yaml, each one is a window of the bdt
+REGIONS = 24
+
+def mc_weight(weight_mc, weight_pileup):
+    return weight_mc*weight_pileup
+
+def pileup_down(weights, weight_pileup):
+    return weights/weight_pileup
+
+def is_signal(truth):
+    return truth > 0.5
+
+def is_background(truth):
+    return truth <= 0.5
+
+def high_bdt(bdt):
+    return bdt > 0.5
+
+def low_bdt(bdt):
+    return bdt <= 0.5
+
+def flatten(jets):
+    return ak.flatten(jets)
+
+def leading(jets):
+    return ak.fill_none(ak.max(jets, axis=1), -1)
+
+def tagged(jet_btag):
+    return ak.flatten(jet_btag > 0.7)
+
+def all_jets(jet_btag):
+    return ak.flatten(jet_btag == jet_btag)
+
+def passes(lep_pt):
+    return lep_pt > 50
+
+def everything(lep_pt):
+    return lep_pt == lep_pt
+
+def _window(low, high):
+    def window(bdt):
+        return (bdt >= low) & (bdt < high)
+    return window
+
+for _i in range(REGIONS):
+    globals()[f'window{_i}'] = _window(_i/REGIONS, (_i + 1)/REGIONS)
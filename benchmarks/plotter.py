@@ -0,0 +1,344 @@
+'''
+Rendering benchmarks of the plotter, on histograms built in memory.
+
+A config with the requested number of samples, categories, regions, variables
+and bins is made on the fly, and its histograms are filled with smooth shapes:
+falling backgrounds, peaking signals (so that some bins are blinded), data
+fluctuating around the total MC and efficiencies turning on. They go through
+the postprocess of the processor, as real outputs do. Preparing the plots and
+drawing each plot type are timed plot by plot, and their peak memory is
+measured with tracemalloc on the first few plots. Results are compared to a
+stored baseline, like the processor benchmarks.
+
+Run from the top directory of the package:
+
+    python -m benchmarks.plotter
+    python -m benchmarks.plotter --samples 30 --bins 100 --plots DATAMC 2D
+    python -m benchmarks.plotter --save-baseline
+
+Plots are drawn on figures reused from one plot to the next (see FigurePool).
+With --check-figures, the axes of every plot are first compared to those of
+the same plot drawn on a new figure, and the benchmark stops if they differ.
+'''
+# ================ Pythonic Imports ================ #
+import argparse
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from statistics import mean, median
+from time import perf_counter
+
+import hist
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+# ================ CoffeaPlot Imports ================ #
+from coffeaplot import log, setup_logging, parse_config
+from config.reader import validate as validate_config
+from containers.accumulators import Histograms
+from containers.histograms import Histogram
+from histogram.processor import CoffeaPlotProcessor
+from plot.plotter import PLOT_MAKERS, prepare_1d_plots, prepare_2d_plots, plot_job, run_plot_job
+from plot.PlotClasses import figure_pool
+from benchmarks.compare import load_baseline, save_baseline, regressions
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+HELPERS    = os.path.join(BENCHMARKS, 'configs', 'helpers.py')
+BASELINE   = os.path.join(BENCHMARKS, 'baselines', 'plotter.json')
+TREE       = 'nominal'
+# Metrics compared to the baseline, +1 if higher is better and -1 if lower is
+METRICS    = {'mean_seconds': -1, 'peak_bytes': -1}
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Benchmark the plotter on histograms made in memory")
+    parser.add_argument("--samples",    type=int, default=12, help="Number of background samples")
+    parser.add_argument("--signals",    type=int, default=2, help="Number of signal samples")
+    parser.add_argument("--categories", type=int, default=4, help="Number of categories the backgrounds are stacked in")
+    parser.add_argument("--regions",    type=int, default=2, help="Number of regions")
+    parser.add_argument("--variables",  type=int, default=3, help="Number of 1D, efficiency and 2D variables each")
+    parser.add_argument("--bins",       type=int, default=50, help="Bins of each axis")
+    parser.add_argument("--blinding",   type=float, default=0.1, help="Signal over background above which data is blinded")
+    parser.add_argument("--plots",      nargs='+', default=list(PLOT_MAKERS), choices=list(PLOT_MAKERS), help="Plot types to time")
+    parser.add_argument("--memory-plots", type=int, default=3, help="Plots of each type whose memory is measured")
+    parser.add_argument("--seed",       type=int, default=1, help="Seed of the fluctuations of data")
+    parser.add_argument("--workdir",    default=os.path.join(tempfile.gettempdir(), 'coffeaplot_benchmarks', 'plotter'), help="Where plots are written")
+    parser.add_argument("--baseline",   default=BASELINE, help="Baseline to compare to, or to save")
+    parser.add_argument("--tolerance",  type=float, default=0.2, help="Fraction by which a plot can be slower or bigger than the baseline")
+    parser.add_argument("--save-baseline", action='store_true', help="Save the results as the new baseline")
+    parser.add_argument("--check-figures", action='store_true', help="Check that plots drawn on reused figures have the axes of plots drawn on new ones")
+    return parser.parse_args()
+
+# ================ Config ================ #
+def bench_config(args):
+    '''
+    Raw config with the requested number of samples, regions and variables.
+    '''
+    binning = f'0,1,{args.bins}'
+    samples = [{'Name': f'sig{i}', 'Type': 'SIG', 'NtuplesRgxs': ['sig*'], 'Label': f'Signal {i}', 'Color': f'C{i}'}
+               for i in range(args.signals)]
+    samples += [{'Name': f'bkg{i}', 'Type': 'BKG', 'NtuplesRgxs': ['bkg*'], 'Label': f'Background {i}', 'Color': f'C{(args.signals + i)%10}',
+                 'Category': f'Category {i%args.categories}', 'RefMC': i == 0}
+                for i in range(args.samples)]
+    samples += [{'Name': 'data', 'Type': 'DATA', 'NtuplesRgxs': ['data*'], 'Label': 'Data'}]
+
+    return {
+        # No ntuples are read, the directory only has to be set
+        'General': {'DumpDir': args.workdir, 'NtuplesDirs': args.workdir, 'Trees': TREE, 'Helpers': HELPERS, 'RunPlotter': True, 'LogLevel': 1,
+                    'Blinding': args.blinding, 'PlotCache': False, 'MakePlots': args.plots},
+        'Samples': samples,
+        'Regions': [{'Name': f'region{i}', 'Label': f'Region {i}', 'Selection': ['high_bdt', ['bdt']], 'Targets': ['sig.*']}
+                    for i in range(args.regions)],
+        'Variables': {'1D': [{'Name': f'var{i}', 'Label': f'Variable {i}', 'Method': 'bdt', 'Binning': binning} for i in range(args.variables)],
+                      '2D': [{'Name': f'map{i}', 'Label': ['x', 'y'], 'MethodX': 'bdt', 'MethodY': 'bdt', 'Binning': [binning, binning]}
+                             for i in range(args.variables)]},
+        'EFFs': {'1D': [{'Name': f'eff{i}', 'Label': f'Efficiency {i}', 'Method': 'bdt', 'Binning': binning, 'NumSel': 'bdt', 'DenomSel': 'bdt'}
+                        for i in range(args.variables)]},
+        # Fractions of the first background taken by the next ones
+        'PieChart': {'Samples': [f'bkg{i}' for i in range(1, min(args.samples, 4))], 'SumSample': 'bkg0'},
+    }
+
+# ================ Histograms ================ #
+def _shape(sample, index, centers):
+    '''
+    Expected yield in each bin: falling backgrounds of decreasing size, signals peaking at high values
+    '''
+    if sample.type == 'SIG':
+        return 20*np.exp(-0.5*((centers - 0.8 + 0.05*index)/0.05)**2)
+    return 1000/(index + 1)*np.exp(-3*centers)
+
+def _histogram(variable, values):
+    '''
+    Histogram of the variable with the given expected yields, with the variances of unit weights
+    '''
+    if variable.dim == 2:
+        h = hist.Hist.new.Var(variable.binning[0], name='x', label=variable.label[0], flow=True).Var(variable.binning[1], name='y', label=variable.label[1], flow=True).Weight()
+    else:
+        h = hist.Hist.new.Var(variable.binning, name=variable.name, label=variable.label, flow=True).Weight()
+    h[...] = np.stack([values, values], axis=-1)
+    return h
+
+def make_histograms(CoffeaPlotSettings, seed):
+    '''
+    Histograms as the processor returns them, including the total MC, the
+    efficiencies and the pie chart fractions made by its postprocess.
+    '''
+    rng = np.random.default_rng(seed)
+    accumulator = Histograms()
+    samples = CoffeaPlotSettings.samples_list.unpacked()
+    # Position of each sample among the samples of its type
+    indices = {sample.name: i for stype in ['SIG', 'BKG'] for i, sample in enumerate(sample for sample in samples if sample.type == stype)}
+
+    for variable in CoffeaPlotSettings.variables_list:
+        if variable.dim == 2:
+            centers = [0.5*(np.asarray(edges[1:]) + np.asarray(edges[:-1])) for edges in variable.binning]
+        else:
+            centers = [0.5*(np.asarray(variable.binning[1:]) + np.asarray(variable.binning[:-1]))]
+        # Numerators of efficiencies keep the events passing a turn on
+        turn_on = 1/(1 + np.exp(-(centers[0] - 0.3)/0.05)) if ':Num' in variable.name else 1.
+
+        for region in CoffeaPlotSettings.regions_list:
+            for rescale in CoffeaPlotSettings.rescales_list:
+                total = 0
+                for sample in samples:
+                    if sample.type == 'DATA': continue
+                    values = _shape(sample, indices[sample.name], centers[0])*turn_on
+                    if variable.dim == 2:
+                        shape_y = _shape(sample, indices[sample.name], centers[1])
+                        values = np.outer(values, shape_y)/shape_y.sum()
+                    accumulator[(variable.name, sample.name, region.name, rescale.name)] = Histogram(variable.name, _histogram(variable, values), sample.name, region.name, rescale.name)
+                    total = total + values
+                accumulator[(variable.name, 'total', region.name, rescale.name)] = Histogram(variable.name, _histogram(variable, total), 'total', region.name, rescale.name)
+                for sample in samples:
+                    if sample.type != 'DATA': continue
+                    data = rng.poisson(total).astype(float)
+                    accumulator[(variable.name, sample.name, region.name, rescale.name)] = Histogram(variable.name, _histogram(variable, data), sample.name, region.name, rescale.name)
+
+    return dict(CoffeaPlotProcessor(CoffeaPlotSettings).postprocess(accumulator).to_plot)
+
+def setup(args):
+    '''
+    Fresh settings and histograms, preparing plots changes both
+    '''
+    validated = validate_config(bench_config(args))
+    setup_logging(validated['general']['loglevel'])
+    CoffeaPlotSettings = parse_config(validated)
+    CoffeaPlotSettings.setup_outpaths()
+    return CoffeaPlotSettings, make_histograms(CoffeaPlotSettings, args.seed)
+
+def prepare(histograms, CoffeaPlotSettings, plot_type):
+    if plot_type == '2D':
+        return list(prepare_2d_plots(histograms, TREE, CoffeaPlotSettings))
+    return list(prepare_1d_plots(histograms, TREE, CoffeaPlotSettings))
+
+# ================ Figure reuse ================ #
+class AxesLimits(object):
+    '''
+    Writer keeping the view and data limits and the scales of the axes of each
+    plot instead of saving it. Data limits are kept as well since autoscaled
+    limits are rounded, and would hide most leftovers of previous plots.
+    '''
+    def __init__(self):
+        self.limits = {}
+
+    def write(self, plot, fig, outpath, filename):
+        self.limits[(os.path.basename(outpath), filename)] = [(ax.get_xlim() + ax.get_ylim() + tuple(ax.dataLim.bounds), ax.get_xscale(), ax.get_yscale()) for ax in fig.axes]
+
+def _same_limits(axes, other_axes):
+    if len(axes) != len(other_axes):
+        return False
+    for (limits, xscale, yscale), (other_limits, other_xscale, other_yscale) in zip(axes, other_axes):
+        if (xscale, yscale) != (other_xscale, other_yscale) or not np.allclose(limits, other_limits):
+            return False
+    return True
+
+def check_figures(args):
+    '''
+    Draw the plots of all types on reused figures, the types taking turns on
+    each plot in both orders (e.g. DATAMC after SIGNIF, then SIGNIF after
+    DATAMC), and compare their axes to the same plots drawn on new figures.
+    Returns the plots whose axes differ.
+    '''
+    CoffeaPlotSettings, histograms = setup(args)
+    outpaths = CoffeaPlotSettings.tree_to_dir[TREE]
+    plots = {kind: prepare(histograms, CoffeaPlotSettings, kind) for kind in ['1D', '2D'] if any((plot_type == '2D') == (kind == '2D') for plot_type in args.plots)}
+
+    fresh = AxesLimits()
+    for plot_type in args.plots:
+        for plot in plots['2D' if plot_type == '2D' else '1D']:
+            figure_pool.close()
+            run_plot_job(plot_job(plot, plot_type, CoffeaPlotSettings, outpaths), fresh)
+
+    differ = []
+    for plot_types in [args.plots, args.plots[::-1]]:
+        figure_pool.close()
+        reused = AxesLimits()
+        for kind, kind_plots in plots.items():
+            for plot in kind_plots:
+                for plot_type in plot_types:
+                    if (plot_type == '2D') == (kind == '2D'):
+                        run_plot_job(plot_job(plot, plot_type, CoffeaPlotSettings, outpaths), reused)
+        differ += [plot for plot, limits in reused.limits.items() if not _same_limits(limits, fresh.limits[plot]) and plot not in differ]
+    figure_pool.close()
+    return differ
+
+# ================ Timing ================ #
+def time_plots(args):
+    '''
+    Seconds taken to prepare the plots and to draw each of them, by plot type
+    '''
+    CoffeaPlotSettings, histograms = setup(args)
+    outpaths = CoffeaPlotSettings.tree_to_dir[TREE]
+    seconds = {}
+
+    plots = {}
+    for kind in ['1D', '2D']:
+        plot_types = [plot_type for plot_type in args.plots if (plot_type == '2D') == (kind == '2D')]
+        if not plot_types: continue
+        start = perf_counter()
+        plots[kind] = prepare(histograms, CoffeaPlotSettings, plot_types[0])
+        seconds[f'prepare_{kind.lower()}_plots'] = [perf_counter() - start]
+
+    for plot_type in args.plots:
+        seconds[plot_type] = []
+        for plot in plots['2D' if plot_type == '2D' else '1D']:
+            job = plot_job(plot, plot_type, CoffeaPlotSettings, outpaths)
+            start = perf_counter()
+            run_plot_job(job)
+            seconds[plot_type].append(perf_counter() - start)
+    return seconds
+
+def measure_memory(args):
+    '''
+    Peak memory allocated while preparing the plots and while drawing each
+    of the first few plots, by plot type
+    '''
+    CoffeaPlotSettings, histograms = setup(args)
+    outpaths = CoffeaPlotSettings.tree_to_dir[TREE]
+    peaks = {}
+
+    tracemalloc.start()
+    try:
+        plots = {}
+        for kind in ['1D', '2D']:
+            plot_types = [plot_type for plot_type in args.plots if (plot_type == '2D') == (kind == '2D')]
+            if not plot_types: continue
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            plots[kind] = prepare(histograms, CoffeaPlotSettings, plot_types[0])
+            peaks[f'prepare_{kind.lower()}_plots'] = tracemalloc.get_traced_memory()[1] - start
+
+        for plot_type in args.plots:
+            peaks[plot_type] = 0
+            for plot in plots['2D' if plot_type == '2D' else '1D'][:args.memory_plots]:
+                job = plot_job(plot, plot_type, CoffeaPlotSettings, outpaths)
+                tracemalloc.reset_peak()
+                start = tracemalloc.get_traced_memory()[0]
+                run_plot_job(job)
+                peaks[plot_type] = max(peaks[plot_type], tracemalloc.get_traced_memory()[1] - start)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def benchmark(args):
+    '''
+    Latency and peak memory of each step, by its name (plot type, or the function preparing the plots)
+    '''
+    seconds = time_plots(args)
+    peaks = measure_memory(args)
+    names = {plot_type: maker[0].__name__ for plot_type, maker in PLOT_MAKERS.items()}
+
+    results = {}
+    for step, timings in seconds.items():
+        if not timings: continue
+        timings = sorted(timings)
+        results[names.get(step, step)] = {'plots': len(timings),
+                                          'mean_seconds': mean(timings),
+                                          'median_seconds': median(timings),
+                                          'p95_seconds': timings[min(int(0.95*len(timings)), len(timings) - 1)],
+                                          'max_seconds': timings[-1],
+                                          'peak_bytes': peaks.get(step, 0)}
+    return results
+
+# ================ Baselines ================ #
+def report(results, baseline, tolerance):
+    '''
+    Print the results next to the baseline. Returns the steps that are slower
+    or use more memory than the tolerance allows.
+    '''
+    slow = []
+    width = max([len(step) for step in results] + [4])
+    print(f"{'step':<{width}}  {'plots':>6}  {'mean ms':>9}  {'p95 ms':>9}  {'baseline':>9}  {'peak MB':>8}  {'baseline':>8}")
+    for step, result in results.items():
+        base = baseline.get(step)
+        worse = regressions(result, base, METRICS, tolerance)
+        base_ms = f"{1000*base['mean_seconds']:>9.1f}" if base is not None else f"{'-':>9}"
+        base_mb = f"{base['peak_bytes']/1024**2:>8.1f}" if base is not None else f"{'-':>8}"
+        print(f"{step:<{width}}  {result['plots']:>6}  {1000*result['mean_seconds']:>9.1f}  {1000*result['p95_seconds']:>9.1f}  {base_ms}  {result['peak_bytes']/1024**2:>8.1f}  {base_mb}  {' '.join(worse)}".rstrip())
+        if worse:
+            slow.append(step)
+    return slow
+
+def main():
+    args = argparser()
+    if args.check_figures:
+        differ = check_figures(args)
+        if differ:
+            log.error(f"{len(differ)} plots drawn on reused figures have other axes than on new figures: {', '.join('/'.join(plot) for plot in differ)}")
+        log.info("Plots drawn on reused figures have the same axes as on new figures")
+    results = benchmark(args)
+
+    slow = report(results, load_baseline(args.baseline), args.tolerance)
+
+    with open(os.path.join(args.workdir, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=1)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+
+    if slow:
+        log.warning(f"{len(slow)} steps are slower or use more memory than the baseline: {', '.join(slow)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
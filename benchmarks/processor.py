@@ -0,0 +1,200 @@
+'''
+Throughput benchmarks of the processor on synthetic ntuples.
+
+Each scenario is a config in benchmarks/configs, whose ntuples are generated
+locally with the branches its functors read (see util/synthetic.py). Every
+scenario is run with each of the requested chunk sizes and executors, each run
+in a python process of its own so that its peak memory is its own. Events per
+second and peak memory are compared to a stored baseline, and runs that got
+slower or bigger than the tolerance allows are reported as regressions.
+
+Run from the top directory of the package:
+
+    python -m benchmarks.processor
+    python -m benchmarks.processor --scenarios many_regions --chunksizes 50000 --executors futures
+    python -m benchmarks.processor --save-baseline
+'''
+# ================ Pythonic Imports ================ #
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+# ================ CoffeaPlot Imports ================ #
+from coffeaplot import log, setup_logging, parse_config, make_executor, run_processor
+from config.reader import read as read_config, validate as validate_config
+from util.planner import count_events
+from util.synthetic import WEIGHTS, config_branches, synthetic_files, write_ntuples
+from benchmarks.compare import load_baseline, save_baseline, regressions
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+CONFIGS    = os.path.join(BENCHMARKS, 'configs')
+BASELINE   = os.path.join(BENCHMARKS, 'baselines', 'processor.json')
+SCENARIOS  = ['many_regions', 'many_rescales', 'many_variables', 'eff_heavy', 'heavy_2d']
+EXECUTORS  = ['iterative', 'futures']
+# Branches of the benchmark configs that are jet collections
+JAGGED     = ['jet_.*']
+# Written next to the ntuples, they are only generated again if it changes
+SYNTHETIC  = 'synthetic.json'
+# Metrics compared to the baseline, +1 if higher is better and -1 if lower is
+METRICS    = {'events_per_second': +1, 'peak_rss': -1, 'peak_worker_rss': -1}
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Benchmark the processor on synthetic ntuples")
+    parser.add_argument("--scenarios",  nargs='+', default=SCENARIOS, help="Configs in benchmarks/configs to run")
+    parser.add_argument("--chunksizes", nargs='+', type=int, default=[100000], help="Chunk sizes to run each scenario with")
+    parser.add_argument("--executors",  nargs='+', default=EXECUTORS, choices=EXECUTORS, help="Executors to run each scenario with")
+    parser.add_argument("--workers",    type=int, default=4, help="Workers of the futures executor")
+    parser.add_argument("--events",     type=int, default=200000, help="Events in each synthetic file")
+    parser.add_argument("--files",      type=int, default=2, help="Synthetic files for each sample")
+    parser.add_argument("--njets",      type=float, default=5., help="Mean number of jets per event")
+    parser.add_argument("--weights",    default='normal', choices=WEIGHTS, help="Distribution of the weights")
+    parser.add_argument("--seed",       type=int, default=1, help="Seed of the synthetic ntuples")
+    parser.add_argument("--workdir",    default=os.path.join(tempfile.gettempdir(), 'coffeaplot_benchmarks'), help="Where ntuples and outputs are written")
+    parser.add_argument("--baseline",   default=BASELINE, help="Baseline to compare to, or to save")
+    parser.add_argument("--tolerance",  type=float, default=0.2, help="Fraction by which a run can be slower or bigger than the baseline")
+    parser.add_argument("--save-baseline", action='store_true', help="Save the results as the new baseline")
+    # Internal: run one scenario and write its results, used by the runs started by this script
+    parser.add_argument("--run",        default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--chunksize",  type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--executor",   default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result",     default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def load_settings(cfgp, workdir):
+    '''
+    Settings of a benchmark config, reading ntuples from and writing outputs
+    to the work directory. Helpers are found relative to the config.
+    '''
+    validated = validate_config(read_config(cfgp))
+    general = validated['general']
+    setup_logging(general['loglevel'])
+    general['dumpdir']      = os.path.join(workdir, 'output')
+    general['ntuplesdirs']  = [os.path.join(workdir, 'ntuples')]
+    general['helpers']      = [os.path.join(os.path.dirname(os.path.abspath(cfgp)), helper) for helper in (general['helpers'] or [])]
+    # Files are collected once the ntuples are written
+    general['runprocessor'] = False
+    general['runplotter']   = False
+    return parse_config(validated)
+
+# ================ Ntuples ================ #
+def generate(CoffeaPlotSettings, workdir, args):
+    '''
+    Write the ntuples of a scenario, unless the same ones are already there.
+    '''
+    branches = config_branches(CoffeaPlotSettings, jagged=JAGGED)
+    files = synthetic_files(CoffeaPlotSettings, args.files)
+    stamp = {'branches': branches, 'files': files, 'trees': CoffeaPlotSettings.trees,
+             'events': args.events, 'njets': args.njets, 'weights': args.weights, 'seed': args.seed}
+    # Compare through JSON, which turns the tuples into lists
+    stamp = json.loads(json.dumps(stamp))
+    stamp_path = os.path.join(workdir, 'ntuples', SYNTHETIC)
+
+    if os.path.exists(stamp_path) and all(os.path.exists(path) for path in files):
+        with open(stamp_path, 'r') as f:
+            if json.load(f) == stamp:
+                log.info(f"Reusing the ntuples in {os.path.dirname(stamp_path)}")
+                return
+
+    write_ntuples(files, CoffeaPlotSettings.trees, branches, args.events, seed=args.seed, workers=args.workers,
+                  njets=args.njets, weights=args.weights)
+    with open(stamp_path, 'w') as f:
+        json.dump(stamp, f, indent=1)
+
+# ================ Runs ================ #
+def run_scenario(args):
+    '''
+    Run the processor on one scenario, in the process started by benchmark()
+    '''
+    CoffeaPlotSettings = load_settings(args.run, args.workdir)
+    CoffeaPlotSettings.runprocessor = True
+    CoffeaPlotSettings.chunksize = args.chunksize
+    CoffeaPlotSettings.nworkers = 0 if args.executor == 'iterative' else args.workers
+    CoffeaPlotSettings.setup_filesets()
+    CoffeaPlotSettings.setup_outpaths()
+
+    fileset = {sample.name: sample.files for sample in CoffeaPlotSettings.samples_list}
+    executor = make_executor(CoffeaPlotSettings)
+
+    seconds = 0.
+    for tree in CoffeaPlotSettings.trees:
+        _, _, wall_seconds = run_processor(CoffeaPlotSettings, fileset, tree, executor)
+        seconds += wall_seconds
+    events = sum(count_events(CoffeaPlotSettings, tree) for tree in CoffeaPlotSettings.trees)
+
+    # ru_maxrss is in kilobytes on linux, workers only count once they have exited
+    result = {'events': events,
+              'seconds': seconds,
+              'events_per_second': events/seconds if seconds > 0 else None,
+              'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024,
+              'peak_worker_rss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*1024}
+    with open(args.result, 'w') as f:
+        json.dump(result, f, indent=1)
+
+def benchmark(args):
+    '''
+    Results of every scenario, chunk size and executor, by '{scenario}/{executor}/{chunksize}'
+    '''
+    results = {}
+    for scenario in args.scenarios:
+        cfgp = os.path.join(CONFIGS, f'{scenario}.yaml')
+        workdir = os.path.join(args.workdir, scenario)
+        generate(load_settings(cfgp, workdir), workdir, args)
+
+        for executor in args.executors:
+            for chunksize in args.chunksizes:
+                key = f'{scenario}/{executor}/{chunksize}'
+                result_path = os.path.join(workdir, f'result_{executor}_{chunksize}.json')
+                log.info(f"Running {key}")
+                subprocess.run([sys.executable, '-m', 'benchmarks.processor', '--run', cfgp, '--workdir', workdir, '--result', result_path,
+                                '--chunksize', str(chunksize), '--executor', executor, '--workers', str(args.workers)],
+                               cwd=os.path.dirname(BENCHMARKS), check=True)
+                with open(result_path, 'r') as f:
+                    results[key] = json.load(f)
+    return results
+
+# ================ Baselines ================ #
+def _size(nbytes):
+    return f'{nbytes/1024**2:.0f} MB'
+
+def report(results, baseline, tolerance):
+    '''
+    Print the results next to the baseline. Returns the keys of the runs
+    that are slower or use more memory than the tolerance allows.
+    '''
+    slow = []
+    width = max([len(key) for key in results] + [3])
+    print(f"{'run':<{width}}  {'events/s':>10}  {'baseline':>10}  {'peak rss':>10}  {'baseline':>10}  {'worker rss':>10}")
+    for key, result in results.items():
+        base = baseline.get(key)
+        worse = regressions(result, base, METRICS, tolerance)
+        base_rate = f"{base['events_per_second']:>10.0f}" if base is not None and base['events_per_second'] else f"{'-':>10}"
+        base_rss  = f"{_size(base['peak_rss']):>10}" if base is not None else f"{'-':>10}"
+        print(f"{key:<{width}}  {result['events_per_second'] or 0:>10.0f}  {base_rate}  {_size(result['peak_rss']):>10}  {base_rss}  {_size(result['peak_worker_rss']):>10}  {' '.join(worse)}".rstrip())
+        if worse:
+            slow.append(key)
+    return slow
+
+def main():
+    args = argparser()
+    if args.run is not None:
+        run_scenario(args)
+        return
+
+    results = benchmark(args)
+
+    slow = report(results, load_baseline(args.baseline), args.tolerance)
+
+    with open(os.path.join(args.workdir, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=1)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+
+    if slow:
+        log.warning(f"{len(slow)} runs are slower or use more memory than the baseline: {', '.join(slow)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,8 @@ a configuration file, and then the script takes care of the rest.
 '''
 # =========== Import statements =========== #
 # Import python packages
-import os
-from coffea import processor
-from coffea.nanoevents import  BaseSchema
+import os, re, time
 from pprint import pprint
-import cloudpickle as pickle
 import argparse
 import numpy as np
 import logging
@@ -18,11 +15,13 @@ from util.logger import ColoredLogger as logger
 log = logger(name='coffeaplot')
 
 # Import coffeaplot packages
-from config.reader import process as process_config
+from config.reader import read as read_config, validate as validate_config
+from config.compiled import compiled_path, config_key, load_compiled, save_compiled
 from config.general_parsers import parse_general, parse_samples, parse_regions, parse_variables, parse_rescales
 from config.plots_parsers import parse_special_plot_settings, parse_general_plot_settings
-from histogram.processor import CoffeaPlotProcessor
-from plot.plotter import prepare_1d_plots, make_plots, prepare_2d_plots, make_2d_plots
+from util.planner import plan, record_run
+# coffea, the processor and the plotter are slow to import, so they are only
+# imported in main() when they are needed
 
 # ========================================= #
 # =========== Set up functions =========== #
@@ -62,25 +61,32 @@ def setup_logging(loglevel: int):
 def argparser():
     parser = argparse.ArgumentParser()
     parser.add_argument("cfg",   help="Configuration file to run")
+    # Restrict what gets plotted, without touching the config or the processor
+    parser.add_argument("--variables", nargs='+', default=None, help="Only plot variables whose name matches one of these regexes")
+    parser.add_argument("--regions",   nargs='+', default=None, help="Only plot regions whose name matches one of these regexes")
+    parser.add_argument("--rescales",  nargs='+', default=None, help="Only plot rescales whose name matches one of these regexes")
+    parser.add_argument("--plots",     nargs='+', default=None, help="Only make plot types (e.g. DATAMC, 2D) matching one of these regexes")
+    parser.add_argument("--plan",      action='store_true', help="Report the histograms, memory, input chunks and runtime the processor would need, without running it")
+    parser.add_argument("--nocache",   action='store_true', help="Parse the configuration from scratch, without reading or saving the compiled configuration")
     return parser.parse_args()
 
 
-def main():
-
-    args = argparser()
-    cfgp = args.cfg
-
-    log.info("Parsing and Validating config file")
-    validated = process_config(cfgp)
+def parse_config(validated):
+    '''
+    Turn the validated configuration into the CoffeaPlotSettings object that
+    steers the processor and the plotter.
 
-    # Update logging level
-    setup_logging(validated['general']['loglevel'])
+    Parameters
+    ----------
+    validated : dict
+        The configuration after validation against the schema
 
+    Returns
+    -------
+    CoffeaPlotSettings : CPS object
+    '''
     # =========== Set up general settings =========== #
     CoffeaPlotSettings = parse_general(validated['general'])
-    CoffeaPlotSettings.setup_inputpaths()
-    CoffeaPlotSettings.setup_outpaths()
-    CoffeaPlotSettings.setup_helpers()
 
     all_samples_cfg = validated['samples'] + validated['supersamples']
     parse_samples(all_samples_cfg, CoffeaPlotSettings)
@@ -92,17 +98,6 @@ def main():
     parse_variables(validated['variables'], CoffeaPlotSettings)
     parse_rescales(validated['rescales'], CoffeaPlotSettings)
 
-    total_histograms =  (CoffeaPlotSettings.NumSamples
-                        *len(CoffeaPlotSettings.regions_list)
-                        *len(CoffeaPlotSettings.rescales_list)
-                        *len(CoffeaPlotSettings.variables_list)
-                        *len(CoffeaPlotSettings.trees) + # plus Total histograms
-                        len(CoffeaPlotSettings.regions_list)
-                        *len(CoffeaPlotSettings.rescales_list)
-                        *len(CoffeaPlotSettings.variables_list))
-
-    log.info(f"Ready to process {total_histograms} histograms")
-
     if CoffeaPlotSettings.runplotter:
         # =================== Set up plot settings =================== #
         GeneralPlotSettings      = parse_general_plot_settings(validated['plots'])
@@ -121,55 +116,184 @@ def main():
         if '2D' in CoffeaPlotSettings.makeplots:
             CoffeaPlotSettings.heatmap_plot_settings     = parse_special_plot_settings(validated['histo2d'], '2D', GeneralPlotSettings)
 
-    if not (CoffeaPlotSettings.runplotter or CoffeaPlotSettings.runprocessor):
-        log.warning("Setup everything but you are not running plotting or processing ... is that intentional?")
-        #return 0
-    # =========== Set up fileset =========== #
-    fileset = {}
-    for sample in CoffeaPlotSettings.samples_list:
-        fileset[sample.name] = sample.files
+    return CoffeaPlotSettings
+
+def make_executor(CoffeaPlotSettings):
+    '''
+    Coffea executor running the processor, with a pool of NWorkers processes
+    or iteratively in this process if NWorkers is 0. With PreReduce the pool
+    is made by CoffeaPlot and kept for all runs, since the workers hold the
+    histograms of their chunks until they are flushed.
+    '''
+    from coffea import processor
+    from histogram import prereduce
 
-    # =========== Setup executor =========== #
     if CoffeaPlotSettings.nworkers != 0:
         log.info(f"Running FuturesExecutor with {CoffeaPlotSettings.nworkers} workers")
-        executor = processor.FuturesExecutor(workers=CoffeaPlotSettings.nworkers)
+        if CoffeaPlotSettings.prereduce:
+            return processor.FuturesExecutor(workers=CoffeaPlotSettings.nworkers, pool=prereduce.make_pool(CoffeaPlotSettings.nworkers))
+        return processor.FuturesExecutor(workers=CoffeaPlotSettings.nworkers)
+    return processor.IterativeExecutor()
+
+def run_processor(CoffeaPlotSettings, fileset, tree, executor):
+    '''
+    Run the processor on one tree of the fileset.
+
+    Returns
+    -------
+    out : Histograms
+        The accumulator returned by the processor
+    coffea_metrics : dict or None
+        The metrics coffea collected, if SaveMetrics is on
+    wall_seconds : float
+        Time taken by the run
+    '''
+    from coffea import processor
+    from coffea.nanoevents import BaseSchema
+    from histogram.processor import CoffeaPlotProcessor
+    from histogram import prereduce
+    from containers.shared import release_blocks
+
+    run = processor.Runner(executor=executor, schema=BaseSchema, chunksize=CoffeaPlotSettings.chunksize, skipbadfiles=True, savemetrics=CoffeaPlotSettings.savemetrics)
+    coffea_processor = CoffeaPlotProcessor(CoffeaPlotSettings)
+    start = time.time()
+    try:
+        out = run(fileset, tree, coffea_processor)
+
+        coffea_metrics = None
+        if CoffeaPlotSettings.savemetrics:
+            out, coffea_metrics = out
+
+        # Histograms still held by the workers, postprocess waits for them
+        if coffea_processor.prereduce:
+            out = prereduce.flush(executor.pool, CoffeaPlotSettings.nworkers, out)
+            coffea_processor.defer_postprocess = False
+            out = coffea_processor.postprocess(out)
+        # Read histograms still in shared memory before the blocks are released
+        out.to_plot
+    finally:
+        # Shared memory blocks of results that were never read, e.g. if the run failed
+        release_blocks()
+    wall_seconds = time.time() - start
+    return out, coffea_metrics, wall_seconds
+
+def main():
+
+    args = argparser()
+    cfgp = args.cfg
+
+    log.info("Parsing and Validating config file")
+    raw_cfg = read_config(cfgp)
+
+    # Settings from an earlier run of the same config skip validation and parsing
+    compiled = compiled_path(raw_cfg)
+    key = config_key(cfgp)
+    CoffeaPlotSettings = None if args.nocache else load_compiled(compiled, key)
+    if CoffeaPlotSettings is None:
+        validated = validate_config(raw_cfg)
+        # Update logging level
+        setup_logging(validated['general']['loglevel'])
+        CoffeaPlotSettings = parse_config(validated)
+        if not args.nocache:
+            save_compiled(compiled, key, CoffeaPlotSettings)
     else:
-        executor = processor.IterativeExecutor()
+        setup_logging(CoffeaPlotSettings.loglevel)
+        CoffeaPlotSettings.setup_filesets()
+
+    CoffeaPlotSettings.setup_inputpaths()
+    CoffeaPlotSettings.setup_outpaths()
+
+    total_histograms =  (CoffeaPlotSettings.NumSamples
+                        *len(CoffeaPlotSettings.regions_list)
+                        *len(CoffeaPlotSettings.rescales_list)
+                        *len(CoffeaPlotSettings.variables_list)
+                        *len(CoffeaPlotSettings.trees) + # plus Total histograms
+                        len(CoffeaPlotSettings.regions_list)
+                        *len(CoffeaPlotSettings.rescales_list)
+                        *len(CoffeaPlotSettings.variables_list))
+
+    log.info(f"Ready to process {total_histograms} histograms")
+
+    if args.plan:
+        plan(CoffeaPlotSettings)
+        return
+
+    if not (CoffeaPlotSettings.runplotter or CoffeaPlotSettings.runprocessor):
+        log.warning("Setup everything but you are not running plotting or processing ... is that intentional?")
+        return
+
+    import cloudpickle as pickle
+
+    if CoffeaPlotSettings.runprocessor:
+        # =========== Set up fileset =========== #
+        fileset = {}
+        for sample in CoffeaPlotSettings.samples_list:
+            fileset[sample.name] = sample.files
+
+        # =========== Setup executor =========== #
+        executor = make_executor(CoffeaPlotSettings)
+
+    if CoffeaPlotSettings.runplotter:
+        from plot.plotter import prepare_1d_plots, make_plots, prepare_2d_plots, make_2d_plots
+
+        # =========== Restrict plots to the command line selections =========== #
+        CoffeaPlotSettings.selections = {kind: patterns for kind, patterns in [('variables', args.variables), ('regions', args.regions), ('rescales', args.rescales)]
+                                         if patterns is not None}
+        if args.plots is not None:
+            CoffeaPlotSettings.makeplots = [plot_type for plot_type in CoffeaPlotSettings.makeplots if any(re.fullmatch(pattern, plot_type) for pattern in args.plots)]
+            log.info(f"Making only the following plot types: {CoffeaPlotSettings.makeplots}")
 
     # =========== Run processor/tree =========== #
     for tree in CoffeaPlotSettings.trees:
 
         datadir = CoffeaPlotSettings.tree_to_dir[tree]['datadir']
         if CoffeaPlotSettings.runprocessor:
-            run = processor.Runner(executor=executor, schema=BaseSchema, skipbadfiles=True)
-            out = run(fileset, tree, CoffeaPlotProcessor(CoffeaPlotSettings))
+            out, coffea_metrics, wall_seconds = run_processor(CoffeaPlotSettings, fileset, tree, executor)
+            # Throughput of this run, used to estimate the runtime of later runs with --plan
+            record_run(CoffeaPlotSettings, tree, wall_seconds)
+
+            # Event rates of each sample and file, with the metrics coffea collected
+            if CoffeaPlotSettings.savemetrics and out.metrics is not None:
+                out.metrics.save(f"{datadir}/metrics___{tree}.json", tree, wall_seconds, coffea_metrics)
+                log.info(f"Saved run metrics of tree {tree} to {datadir}/metrics___{tree}.json")
+
+            # Timings of each functor and processing stage, summed over all chunks
+            if CoffeaPlotSettings.profile and out.profile is not None:
+                out.profile.save(f"{datadir}/profile___{tree}")
+                log.info(f"Saved profile of tree {tree} to {datadir}/profile___{tree}.txt")
+            # Memory used by each chunk, functor, sample and variable
+            if CoffeaPlotSettings.trackmemory and out.memory is not None:
+                out.memory.save(f"{datadir}/memory___{tree}")
+                log.info(f"Saved memory report of tree {tree} to {datadir}/memory___{tree}.txt")
 
             out = dict(out.to_plot)
 
             with open(f"{datadir}/data___{tree}.pkl", "wb") as f:
                 pickle.dump(out, f)
+
+            out = CoffeaPlotSettings.select_histograms(out)
         else:
+            # Histograms that are not selected for plotting are dropped as soon as each file is read
             if CoffeaPlotSettings.inputhistos is None:
                 with open(f"{datadir}/data___{tree}.pkl", "rb") as f:
-                    out = pickle.load(f)
+                    out = CoffeaPlotSettings.select_histograms(pickle.load(f))
 
             else:
                 out = {}
                 for inputhistos_file in CoffeaPlotSettings.inputhistos:
                     with open(inputhistos_file, "rb") as f:
-                        out.update(pickle.load(f))
+                        out.update(CoffeaPlotSettings.select_histograms(pickle.load(f)))
 
         if CoffeaPlotSettings.runplotter:
             # =========== Set up samples, regions, variables, and rescales =========== #
-            if CoffeaPlotSettings.makeplots != ['2D']:
-                plot_settings_list = prepare_1d_plots(out, tree, CoffeaPlotSettings)
-                if plot_settings_list is not None:
-                    make_plots(plot_settings_list, CoffeaPlotSettings, CoffeaPlotSettings.tree_to_dir[tree])
+            if any(plot_type != '2D' for plot_type in CoffeaPlotSettings.makeplots):
+                # Plots are prepared lazily, one at a time, as they get drawn
+                plot_settings = prepare_1d_plots(out, tree, CoffeaPlotSettings)
+                make_plots(plot_settings, CoffeaPlotSettings, CoffeaPlotSettings.tree_to_dir[tree])
 
             if '2D' in CoffeaPlotSettings.makeplots:
-                plot_settings_list = prepare_2d_plots(out, tree, CoffeaPlotSettings)
-                if plot_settings_list is not None:
-                    make_2d_plots(plot_settings_list, CoffeaPlotSettings, CoffeaPlotSettings.tree_to_dir[tree])
+                plot_settings = prepare_2d_plots(out, tree, CoffeaPlotSettings)
+                make_2d_plots(plot_settings, CoffeaPlotSettings, CoffeaPlotSettings.tree_to_dir[tree])
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,95 @@
+# ================ Pythonic Imports ================ #
+import hashlib
+import os
+from glob import glob
+import cloudpickle as pickle
+import logging
+log = logging.getLogger(__name__)
+
+COMPILED = 'config___compiled.pkl'
+
+def _code_salt():
+    '''
+    Changes to the schema, the parsers or the containers change what a config
+    is parsed into, so their sources go into the hash as well.
+    '''
+    salt = hashlib.sha256()
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for source in sorted(glob(f'{package}/config/*.py') + glob(f'{package}/containers/*.py')):
+        with open(source, 'rb') as f:
+            salt.update(f.read())
+    return salt.hexdigest()
+
+def _file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def compiled_path(raw_cfg):
+    '''
+    The compiled configuration lives with the processor outputs in the dump directory.
+    Returns None if the config has no dump directory, validation will complain about it.
+    '''
+    dumpdir = raw_cfg.get('general', {}).get('dumpdir') if isinstance(raw_cfg, dict) else None
+    if not isinstance(dumpdir, str):
+        return None
+    return f'{dumpdir}/data/{COMPILED}'
+
+def config_key(cfgp):
+    '''
+    Hash of the config file contents and of the code that parses it.
+    '''
+    key = hashlib.sha256(_code_salt().encode())
+    with open(cfgp, 'rb') as f:
+        key.update(f.read())
+    return key.hexdigest()
+
+def load_compiled(path, key):
+    '''
+    Load the settings saved by a previous run of the same config. Returns None
+    if there are none, or if the config, the helper modules or the parsing code
+    changed since they were saved.
+    '''
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            # The header is read first, so a stale cache is never fully unpickled
+            header = pickle.load(f)
+            if header.get('key') != key:
+                log.info("Configuration changed since the last run, parsing it again")
+                return None
+            if any(_file_hash(helper) != digest for helper, digest in header.get('helpers', {}).items()):
+                log.info("Helper modules changed since the last run, parsing the configuration again")
+                return None
+            settings = pickle.load(f)
+    except Exception as err:
+        log.warning(f"Could not read compiled configuration {path} ({err}), parsing the configuration again")
+        return None
+
+    log.info(f"Loaded compiled configuration from {path}")
+    return settings
+
+def save_compiled(path, key, settings):
+    '''
+    Save the parsed settings so that later runs of the same config can skip
+    validating and parsing it. Failing to save is not fatal.
+    '''
+    if path is None:
+        return
+    helpers = {helper: _file_hash(helper) for helper in (settings.helpers or [])}
+    tmp_path = f'{path}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'key': key, 'helpers': helpers}, f)
+            pickle.dump(settings, f)
+        os.replace(tmp_path, path)
+    except Exception as err:
+        log.warning(f"Could not save compiled configuration to {path} ({err})")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    log.debug(f"Saved compiled configuration to {path}")
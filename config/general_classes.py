@@ -18,6 +18,7 @@ class CoffeaPlotSettings(object):
         self.ntuplesdirs = None
         self.trees = None
         self.mcweight = None
+        # Registries of objects indexed by name (see containers/registry.py)
         self.samples_list = None
         self.regions_list = None
         self.variables_list = None
@@ -30,28 +31,98 @@ class CoffeaPlotSettings(object):
         self.runplotter = None
         self.skipnomrescale = None
         self.loglevel = None
+        self.chunksize = None
+        self.profile = None
+        self.trackmemory = None
+        self.savemetrics = None
+        self.sharedmemory = None
+        self.prereduce = None
+        self.prereducelimit = None
         self.makeplots = None
+        self.plotworkers = None
+        self.plotcache = None
+        self.multipagepdf = None
+        self.writerthreads = None
+        self.writerqueue = None
 
         # Processed attributes (not read from config)
         self.functions = None
         self.tree_to_dir = None
 
+        # Regexes restricting what gets plotted (set from command line, not config)
+        self.selections = {}
+
         # Plot Settings (not read from config)
         self.datamc_plot_settings = None
         self.mcmc_plot_settings = None
         self.significance_plot_settings = None
         self.separation_plot_settings = None
+        self.eff_plot_settings = None
         self.piechart_plot_settings = None
         self.heatmap_plot_settings = None
 
     def __getitem__(self, item):
         return getattr(self, item)
 
+    def is_selected(self, kind, name):
+        """
+        Check if a variable, region or rescale passes the regexes the user gave
+        on the command line to restrict what gets plotted. Efficiency and pie
+        chart variables are selected by the name of the variable they come from.
+
+        Parameters
+        ----------
+        kind : str
+            One of 'variables', 'regions' or 'rescales'
+        name : str
+            Name of the variable, region or rescale
+
+        Returns
+        -------
+        bool
+            True if no regexes were given for this kind, or if one of them
+            matches the whole name
+        """
+        patterns = self.selections.get(kind)
+        if not patterns:
+            return True
+        if kind == 'variables':
+            name = name.split(':')[0]
+        return any(re.fullmatch(pattern, name) for pattern in patterns)
+
+    def select_histograms(self, histograms):
+        """
+        Drop the histograms of variables, regions and rescales that are not
+        selected for plotting.
+
+        Parameters
+        ----------
+        histograms : dict
+            Dictionary of (variable, sample, region, rescale) to Histogram
+
+        Returns
+        -------
+        dict
+            Dictionary with the selected histograms only
+        """
+        if not self.selections:
+            return histograms
+
+        selected = {key: histogram for key, histogram in histograms.items()
+                    if self.is_selected('variables', key[0])
+                    and self.is_selected('regions', key[2])
+                    and self.is_selected('rescales', key[3])}
+        log.info(f"Selected {len(selected)} out of {len(histograms)} histograms to plot")
+        return selected
+
     def setup_helpers(self):
         """
         Import helper functions from external module specified in config
-        and save them as a dict of function name to function object.
+        and save them as a dict of function name to function object. The
+        modules are only imported once, later calls are no-ops.
         """
+        if self.functions is not None:
+            return
 
         log.info("Setting up helper functions")
         # Paths to helper functions modules
@@ -73,6 +144,17 @@ class CoffeaPlotSettings(object):
 
         self.functions = functions
 
+    def setup_filesets(self):
+        """
+        Collect the input files of every sample again. Used when the settings
+        are loaded from a compiled configuration, since files may have been
+        added or removed since it was saved.
+        """
+        if not self.runprocessor:
+            return
+        for sample in self.samples_list:
+            sample.create_fileset()
+
     def setup_inputpaths(self):
         """
         Check that all input paths used in config general settings exist and are valid.
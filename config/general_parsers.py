@@ -8,37 +8,10 @@ from containers.regions import Region
 from containers.rescales import Rescale
 from containers.variables import Variable, Variables, Eff
 from containers.functors import Functor
+from containers.registry import Registry
 from config.general_classes import CoffeaPlotSettings as CPS
 
 
-def same_name_obj_found(obj_name, alist):
-    """
-    Check if an object with the same name as obj_name is found in alist.
-    Special handling for cases where an object is searched for in a list
-    with Supersample objects, where the subsamples should be searched.
-
-    Parameters
-    ----------
-    obj_name : str
-        Name of object to search for
-    alist : list
-        List of objects to search in
-
-    Returns
-    -------
-    found : bool
-        True if object with same name is found in alist, False otherwise
-    """
-    names_list = []
-    for elem in alist:
-        if isinstance(elem, SuperSample):
-            names_list.extend([ss.name for ss in elem.subsamples])
-        else:
-            names_list.append(elem.name)
-
-    return any([obj_name == name_in_list for name_in_list in names_list])
-
-
 def create_weights_functor(weight, CoffeaPlotSettings, sample_name):
     """
     Create a functor instance to define weights to apply to events. This uses
@@ -68,19 +41,19 @@ def create_weights_functor(weight, CoffeaPlotSettings, sample_name):
 
         # Create a functor instance to be used to define weights
         weight_fn = CoffeaPlotSettings.functions[weight[0]]
-        weight_functor = Functor(weight_fn, weight[1])
+        weight_functor = Functor(weight_fn, weight[1], name = weight[0], role = 'weight')
         log.debug(f"Sample {sample_name} weight set to use function {weight_functor.fn.__repr__()} with arguments {weight[1]}")
 
     # ======== If user provided weight configuration that is a string, they expect to use a branch ======== #
     elif isinstance(weight, str):
         # Create a functor instance to be used to define weights as just the branch
-        weight_functor = Functor(lambda w: w, [weight])
+        weight_functor = Functor(lambda w: w, [weight], name = weight, role = 'weight')
         log.debug(f"Sample {sample_name} weight set to use branch {weight}")
 
     # ======== If user provided weight configuration that is a float, they expect to use a constant weighting ======== #
     else:
         # Create a functor instance to be used to define weights as a constant rescaling
-        weight_functor = Functor(lambda w: w*weight, ['weights'])
+        weight_functor = Functor(lambda w: w*weight, ['weights'], name = str(weight), role = 'weight')
         log.debug(f"Sample {sample_name} weight set to use float {weight}")
 
     return weight_functor
@@ -155,7 +128,7 @@ def parse_samples(samples_cfg: dict, CoffeaPlotSettings: CPS):
     log.info(f"Setting up samples ...")
 
     # Declarations needed for parsing
-    samples_list = []
+    samples_list = Registry('sample')
     num_samples = 0
     data_sample_found = False
 
@@ -164,8 +137,11 @@ def parse_samples(samples_cfg: dict, CoffeaPlotSettings: CPS):
         is_supersample = False
         if 'subsamples' in sample:
             subsamples = sample['subsamples']
-            # Create a SuperSample instance
+            # Create a SuperSample instance, its subsamples are registered as they are parsed
+            if sample['name'] in samples_list.index:
+                log.error(f"Sample {sample['name']} is defined more than once. Please check your configuration file.")
             supersample = SuperSample(sample['name'])
+            samples_list.add(supersample)
             is_supersample = True
         else:
             subsamples = [sample]
@@ -247,7 +223,7 @@ def parse_samples(samples_cfg: dict, CoffeaPlotSettings: CPS):
                 selection_fn      = CoffeaPlotSettings.functions.get(selection[0], None)
                 if selection_fn is None:
                     log.error(f"Function {selection[0]} is not defined in any helper module. Please check your configuration file.")
-                selection_functor = Functor(selection_fn, selection[1])
+                selection_functor = Functor(selection_fn, selection[1], name = selection[0], role = 'selection')
                 log.debug(f"Sample selector set to use function {selection[0]} with arguments {selection[1]}")
             else:
                 log.debug(f"Sample {sample_name} has no special selection.")
@@ -297,14 +273,15 @@ def parse_samples(samples_cfg: dict, CoffeaPlotSettings: CPS):
 
             # ========= check for unique sample names ========= #
             # Check if sample is defined more than once
-            if same_name_obj_found(sample_obj.name, samples_list):
+            # A subsample can share the name of its own SuperSample, whose name only labels the fileset
+            if sample_obj.name in samples_list or (not is_supersample and sample_obj.name in samples_list.index):
                 log.error(f"Sample {sample_name} is defined more than once. Please check your configuration file.")
 
 
             # ========== Handle how we store super-samples ========== #
             if is_supersample:
                 # Add subsample to supersample
-                supersample.add_subsample(sample_obj)
+                samples_list.add_subsample(supersample, sample_obj)
                 # Set regex and directories to use for this supersample
                 supersample.regexes = sample_regexes
                 supersample.direcs = look_in
@@ -315,7 +292,7 @@ def parse_samples(samples_cfg: dict, CoffeaPlotSettings: CPS):
                 sample_obj.create_fileset()
 
             # Add sample to list of samples
-            samples_list.append(sample_obj)
+            samples_list.add(sample_obj)
 
             # Count sample for logging
             num_samples += 1
@@ -323,7 +300,6 @@ def parse_samples(samples_cfg: dict, CoffeaPlotSettings: CPS):
         if is_supersample:
             if CoffeaPlotSettings.runprocessor:
                 supersample.create_fileset()
-            samples_list.append(supersample)
             num_samples += len(supersample)
 
 
@@ -359,21 +335,21 @@ def parse_regions(regions_cfg: dict, CoffeaPlotSettings: CPS):
     None
     '''
     log.info("Parsing regions....")
-    regions_list = []
+    regions_list = Registry('region')
     for region in regions_cfg:
 
         # ========= check for unique region names ========= #
         region_name = region['name']
-        if same_name_obj_found(region_name, regions_list):
+        if region_name in regions_list:
             log.error(f"Region {region_name} is defined more than once. Please check your configuration file.")
 
         # ========= set up region selection ========= #
         selection = region['selection']
         selection_fn = CoffeaPlotSettings.functions[selection[0]]
-        selection_functor = Functor(selection_fn, selection[1])
+        selection_functor = Functor(selection_fn, selection[1], name = selection[0], role = 'region')
 
         # ========= Create Region instance and pass it to list ========= #
-        regions_list.append(Region(name = region_name,
+        regions_list.add(Region(name = region_name,
                                    howto = selection_functor,
                                    target_sample = region['targets'],
                                    label = region['label']))
@@ -407,14 +383,14 @@ def parse_variables(variables_cfg, CoffeaPlotSettings):
     None
     """
 
-    variables_list = []
+    variables_list = Registry('variable')
 
     # Loop over 1D variables
     for variable in variables_cfg['1d']+variables_cfg['2d']:
 
         # ====== Check for unique variable names ====== #
         variable_name = variable['name']
-        if same_name_obj_found(variable_name, variables_list):
+        if variable_name in variables_list:
             log.error(f"Variable {variable_name} is defined more than once. Please check your configuration file.")
 
 
@@ -429,10 +405,10 @@ def parse_variables(variables_cfg, CoffeaPlotSettings):
                 if isinstance(axis_method, list):
                     # Method is a functor
                     method_fn = CoffeaPlotSettings.functions[axis_method[0]]
-                    func = Functor(method_fn, axis_method[1])
+                    func = Functor(method_fn, axis_method[1], name = axis_method[0], role = 'variable')
                 else:
                     # Method is simply a branch name
-                    func = Functor(lambda x: x, [axis_method])
+                    func = Functor(lambda x: x, [axis_method], name = axis_method, role = 'variable')
 
                 howto_functor.append(func)
         else:
@@ -440,10 +416,10 @@ def parse_variables(variables_cfg, CoffeaPlotSettings):
             if isinstance(howto, list):
                 # Method is a functor
                 method_fn = CoffeaPlotSettings.functions[howto[0]]
-                howto_functor = Functor(method_fn, howto[1])
+                howto_functor = Functor(method_fn, howto[1], name = howto[0], role = 'variable')
             else:
                 # Method is simply a branch name
-                howto_functor = Functor(lambda x: x, [howto])
+                howto_functor = Functor(lambda x: x, [howto], name = howto, role = 'variable')
 
         # ====== Set up the binning for the variable histogram ====== #
         if var_2d:
@@ -466,7 +442,7 @@ def parse_variables(variables_cfg, CoffeaPlotSettings):
         # ====== Create Variable instance and pass it to list ====== #
 
         if variable.get('numsel', None) is  None:
-            variables_list.append(Variable(name = variable_name,
+            variables_list.add(Variable(name = variable_name,
                                             howto = howto_functor,
                                             binning = binning,
                                             label = variable['label'],
@@ -482,22 +458,22 @@ def parse_variables(variables_cfg, CoffeaPlotSettings):
             if isinstance(numsel, list):
                 # Method is a functor
                 method_fn = CoffeaPlotSettings.functions[numsel[0]]
-                numsel_functor = Functor(method_fn, numsel[1])
+                numsel_functor = Functor(method_fn, numsel[1], name = numsel[0], role = 'selection')
             else:
                 # Method is simply a branch name
-                numsel_functor = Functor(lambda x: x, [numsel])
+                numsel_functor = Functor(lambda x: x, [numsel], name = numsel, role = 'selection')
 
             denomsel = variable['denomsel']
             if isinstance(denomsel, list):
                 # Method is a functor
                 method_fn = CoffeaPlotSettings.functions[denomsel[0]]
-                denomsel_functor = Functor(method_fn, denomsel[1])
+                denomsel_functor = Functor(method_fn, denomsel[1], name = denomsel[0], role = 'selection')
             else:
                 # Method is simply a branch name
-                denomsel_functor = Functor(lambda x: x, [denomsel])
+                denomsel_functor = Functor(lambda x: x, [denomsel], name = denomsel, role = 'selection')
 
             # Enter with 2 histograms
-            variables_list.append(Eff(name = variable_name+":Num",
+            variables_list.add(Eff(name = variable_name+":Num",
                                       howto = howto_functor,
                                       binning = binning,
                                       numsel = numsel_functor,
@@ -509,7 +485,7 @@ def parse_variables(variables_cfg, CoffeaPlotSettings):
                                       vtype=variable['type'],
                                       rebin = variable['rebin']))
 
-            variables_list.append(Eff(name = variable_name+":Denom",
+            variables_list.add(Eff(name = variable_name+":Denom",
                                       howto = howto_functor,
                                       binning = binning,
                                       numsel = numsel_functor,
@@ -552,12 +528,12 @@ def parse_rescales(rescales_cfg, CoffeaPlotSettings):
     None
     """
 
-    rescales_list = []
+    rescales_list = Registry('rescale')
     for rescale in rescales_cfg:
 
         # ====== Check for unique rescale names ====== #
         rescale_name = rescale['name']
-        if same_name_obj_found(rescale_name, rescales_list):
+        if rescale_name in rescales_list:
             log.error(f"Rescale {rescale_name} is defined more than once. Please check your configuration file.")
 
         # ====== Set up the method for creating the rescale ====== #
@@ -565,22 +541,24 @@ def parse_rescales(rescales_cfg, CoffeaPlotSettings):
         howto = rescale['method']
         if isinstance(howto, list):
             # Method is a functor
-            howto_functor = Functor(CoffeaPlotSettings.functions[howto[0]], howto[1])
+            howto_functor = Functor(CoffeaPlotSettings.functions[howto[0]], howto[1], name = howto[0], role = 'rescale')
         else:
-            # Method is simply a float to apply to weights branch
-            howto_functor = Functor(lambda x: x*howto, ['weights'])
+            # Method is simply a float to apply to weights branch, bound now since howto changes with the loop
+            howto_functor = Functor(lambda x, factor = howto: x*factor, ['weights'], name = str(howto), role = 'rescale')
 
         # ====== Create Rescale instance and pass it to list ====== #
-        rescales_list.append(Rescale(name = rescale['name'],
+        rescales_list.add(Rescale(name = rescale['name'],
                                      affected_samples_names = rescale['affects'],
                                      howto = howto_functor,
                                      label = rescale['label']))
 
     # ====== Add nominal rescale if not skipped by user ====== #
     if not CoffeaPlotSettings.skipnomrescale:
-        rescales_list.append(Rescale(name = 'Nominal',
+        if 'Nominal' in rescales_list:
+            log.error(f"Rescale Nominal is added automatically, rename your rescale or set SkipNomRescale. Please check your configuration file.")
+        rescales_list.add(Rescale(name = 'Nominal',
                                      affected_samples_names = ['.*'],
-                                     howto = Functor(lambda w: w, ['weights']),
+                                     howto = Functor(lambda w: w, ['weights'], name = 'Nominal', role = 'rescale'),
                                      label = 'Nominal'))
 
     log.info(f"Created {len(rescales_list)} rescales")
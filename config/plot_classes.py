@@ -18,10 +18,24 @@ class GeneralPlotSettings(object):
         self.lumi = None
         self.energy  = None
         self.experiment = None
+        # Output files
+        self.formats = None
+        self.draft = None
+        self.draftdpi = None
+        # Drawing
+        self.renderer = None
 
     def __getitem__(self, item):
         return getattr(self, item)
 
+    def output_formats(self):
+        """
+        File formats each plot is saved in. Draft mode only writes a PNG.
+        """
+        if self.draft:
+            return ['png']
+        return self.formats
+
 class PlotWithRatioSettings(GeneralPlotSettings):
     """
     Plots that have a main + ratio panels have all settings of a GeneralPlotSettings object,
@@ -71,6 +85,8 @@ class Histo2dSettings(PlotWithRatioSettings):
         self.vhlinewidths = None
         self.colormap     = None
         self.colorbarpos  = None
+        self.rasterize    = None
+        self.rasterdpi    = None
 
         super(Histo2dSettings, self).__init__()
 
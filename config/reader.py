@@ -5,6 +5,8 @@ from config.schemas import schema
 from util.utils import keys_to_lower
 # ================ Pythonic Imports ================ #
 import yaml
+# The libyaml loader is much faster, fall back to the pure python one if it is missing
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 def validate(indict):
     """
@@ -13,7 +15,7 @@ def validate(indict):
     Parameters
     ----------
     indict : dict
-        Dictionary with config file after being read by yaml.safe_load
+        Dictionary with config file after being read by read()
 
     Returns
     -------
@@ -55,6 +57,25 @@ def validate(indict):
 
     return validated
 
+def read(cfgp):
+    """
+    Open a config file and load it, without validating it
+
+    Parameters
+    ----------
+    cfgp : str
+        Path to config file
+
+    Returns
+    -------
+    raw : dict
+        Config file as a dictionary, with lower case keys
+    """
+    with open(cfgp,'r') as f:
+        raw = yaml.load(f, Loader=SafeLoader)
+
+    return keys_to_lower(raw) if isinstance(raw, dict) else raw
+
 def process(cfgp):
     """
     Open a config file and validate it against the schema
@@ -69,8 +90,6 @@ def process(cfgp):
     validated : dict
         Validated config file as a dictionary
     """
-    with open(cfgp,'r') as f:
-        output = yaml.safe_load(f)
-        validated = validate(output)
+    validated = validate(read(cfgp))
 
     return validated
\ No newline at end of file
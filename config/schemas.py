@@ -98,6 +98,12 @@ class CanvasSchema(object):
             Optional('energy',              default = 13): Or(int, float),
             Optional('status',              default = 'Internal'): str,
             Optional('heightratios',        default = None): And([int]), # Ratio of main to ratio canvas
+            # Output files
+            Optional('formats',             default = ['pdf']): And(Use(string_to_list), lambda x: all(y in ['pdf', 'png', 'svg'] for y in x)),
+            Optional('draft',               default = False): bool, # Quick low resolution PNGs, replaces formats
+            Optional('draftdpi',            default = 50): int,
+            # Drawing backend, 'fast' draws stacks, error bars and markers as single collections
+            Optional('renderer',            default = 'mplhep'): And(str, lambda x: x in ['mplhep', 'fast']),
         }
 
         # ========== If non-general canvas (e.g. DATAMC) schema is being built, set defaults to None ========== #
@@ -146,6 +152,8 @@ class CanvasSchema(object):
                     Optional('vhlinewidths', default=3): Use(float),
                     Optional('colormap', default='coolwarm'): Use(str),
                     Optional('colorbarpos', default='bottom'): And(Use(str), lambda x: x in ['left', 'right', 'top', 'bottom']),
+                    Optional('rasterize', default=False): bool, # Draw the bins as an image in vector formats, axes and text stay vectors
+                    Optional('rasterdpi', default=150): And(int, lambda x: x > 0),
                 })
 
         if canvas_type == 'GENERAL':
@@ -269,6 +277,18 @@ class GeneralSettingsSchema(object):
                             Optional('skipnomrescale', default = False): bool,
                             Optional('loglevel',       default = 3): int,
                             Optional('nworkers',       default = 8): int, # 0 is Iterative executor...
+                            Optional('chunksize',      default = 100000): And(int, lambda x: x > 0), # Events per chunk given to the processor
+                            Optional('profile',        default = False): bool, # Time each functor and processing stage
+                            Optional('trackmemory',    default = False): bool, # Track memory use of each chunk, functor and sample
+                            Optional('savemetrics',    default = False): bool, # Save event rates and read times of each sample and file
+                            Optional('sharedmemory',   default = False): bool, # Workers return histograms through shared memory instead of pickling them, a killed run can leave blocks in /dev/shm
+                            Optional('prereduce',      default = False): bool, # Workers merge the histograms of their chunks and return them once
+                            Optional('prereducelimit', default = 0): And(int, lambda x: x >= 0), # MB of histograms a worker holds before returning them, 0 for no limit
+                            Optional('plotworkers',    default = 0): int, # 0 renders plots in the main process
+                            Optional('plotcache',      default = False): bool, # Skip plots whose inputs did not change
+                            Optional('multipagepdf',   default = None): Or(None, And(str, lambda x: x in ['tree', 'region'])), # One PDF per tree or region for each plot type
+                            Optional('writerthreads',  default = 0): And(int, lambda x: x >= 0), # 0 writes plot files before drawing the next plot
+                            Optional('writerqueue',    default = 8): And(int, lambda x: x > 0), # Max number of plot files waiting to be written
                         }
 
         self.schema = general_schema
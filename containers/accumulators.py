@@ -0,0 +1,101 @@
+
+# The coffea import is heavy, so the accumulator is kept apart from the
+# histogram classes that the plotter needs to read the processor output
+from coffea.processor import AccumulatorABC
+
+from containers.histograms import Histogram
+from containers.profile import Profile
+from containers.memory import MemoryReport
+from containers.metrics import RunMetrics
+from containers.shared import SharedHistograms, in_worker
+
+class Histograms(AccumulatorABC):
+    def __init__(self, profile = None, memory = None, metrics = None, shared = False):
+        # Initialize any necessary data structures or variables for your accumulator
+        self._to_plot = {}
+        # Timings, memory use and metrics of the chunks merged into this accumulator, if tracked
+        self.profile = profile
+        self.memory = memory
+        self.metrics = metrics
+        # Histograms are handed from workers to the parent through shared memory
+        self.shared = shared
+        # Histograms received from a worker and not read yet
+        self._shared = None
+        # Chunks whose histograms are in this accumulator
+        self.chunks = 0
+
+    @property
+    def to_plot(self):
+        if self._shared is not None:
+            self._to_plot, self._shared = self._shared.materialize(), None
+        return self._to_plot
+
+    @to_plot.setter
+    def to_plot(self, to_plot):
+        self._to_plot, self._shared = to_plot, None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shared and in_worker():
+            state['_to_plot'], state['_shared'] = {}, SharedHistograms(self.to_plot)
+        else:
+            state['_to_plot'], state['_shared'] = self.to_plot, None
+        return state
+
+    def add(self, other):
+        with Profile.timer(self.profile or other.profile, 'stage', 'merge'):
+            if other._shared is not None:
+                # Bins are added straight from the shared memory of the worker
+                other._shared.merge_into(self.to_plot)
+                other._shared = None
+            # Implement the addition logic to combine histograms
+            for key, value in other._to_plot.items():
+                if key in self.to_plot:
+                    # Add the histograms together or define your own custom logic
+                    self.to_plot[key] += value
+                else:
+                    # Initialize the histogram in the accumulator if it doesn't exist
+                    self.to_plot[key] = value
+
+        self.chunks += other.chunks
+        if other.profile is not None:
+            if self.profile is None:
+                self.profile = Profile()
+            self.profile.add(other.profile)
+        if other.memory is not None:
+            if self.memory is None:
+                self.memory = MemoryReport()
+            self.memory.add(other.memory)
+        if other.metrics is not None:
+            if self.metrics is None:
+                self.metrics = RunMetrics()
+            self.metrics.add(other.metrics)
+
+    def __getitem__(self, histo):
+
+        if isinstance(histo, Histogram):
+            key = (histo.name, histo.sample, histo.region, histo.rescale)
+        else:
+            key = histo
+        return self.to_plot[key]
+
+    def identity(self):
+        # Create and return a new instance of the accumulator
+        return Histograms(Profile() if self.profile is not None else None,
+                          MemoryReport() if self.memory is not None else None,
+                          RunMetrics() if self.metrics is not None else None,
+                          self.shared)
+
+    def clone(self):
+        # Create a copy of the accumulator
+        acc = MyAccumulator()
+        acc.histograms = deepcopy(self.to_plot)
+        return acc
+
+    def __setitem__(self, histo, h ):
+
+        if isinstance(histo, Histogram):
+            key = (histo.name, histo.sample, histo.region, histo.rescale)
+        else:
+            key = histo
+        self.to_plot[key] = h
@@ -1,9 +1,13 @@
 class Functor(object):
-    def __init__(self, fn, args):
+    def __init__(self, fn, args, name = None, role = None):
         self.fn = fn
         self.args = args
         assert isinstance(self.args, list)
+        # Function name from the config (or the branch read), and what the
+        # functor is used for (weight, selection, region, variable, rescale)
+        self.name = name if name is not None else getattr(fn, '__name__', repr(fn))
+        self.role = role
 
     def evaluate(self, data):
         data_args = [data[arg] for arg in self.args]
-        return self.fn(*data_args)
\ No newline at end of file
+        return self.fn(*data_args)
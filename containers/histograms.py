@@ -2,8 +2,6 @@
 # Histogramming imports
 import hist
 import numpy as np
-import math
-from coffea.processor import AccumulatorABC
 
 class Histogram(object):
 
@@ -40,6 +38,17 @@ class Histogram(object):
     def values(self):
         return self.h.values()
 
+    def scaled(self, factor):
+        '''
+        Return a scaled copy of this histogram, leaving this one untouched
+        '''
+        scaled = Histogram(self.name, self.h*factor, self.sample, self.region, self.rescale, self.label)
+        scaled.stylish_sample  = self.stylish_sample
+        scaled.stylish_region  = self.stylish_region
+        scaled.stylish_rescale = self.stylish_rescale
+        scaled.color = self.color
+        return scaled
+
     def __eq__(self, other):
         return (self.name == other.name) and (self.sample == other.sample) and (self.region == other.region) and (self.rescale == other.rescale)
 
@@ -85,85 +94,117 @@ class Histogram(object):
             return f'Hist: {self.name}, Sample: {self.sample}, Region: {self.region}, Rescale: {self.rescale}'
 
     def rebin(self, new_edges):
-        # Need to match storage of incoming histogram
+        '''
+        Merge bins of the histogram into the coarser binning new_edges. For 1D
+        histograms new_edges is a list of edges, for 2D histograms it is a list
+        with one list of edges (or None to keep the axis as is) per axis. Old
+        bins falling outside the new range are moved to the under/overflow bins.
+        Rebinning to the binning the histogram already has is a no-op, so the
+        same histogram can safely be rebinned more than once.
+        '''
         histo = self.h
-        new_axis = hist.axis.Variable(new_edges, name=histo.axes[0].name)
-        new_edges = new_axis.edges
-        sw =  np.array(histo.values())
-        sw2 =  np.array(histo.variances())
-
-        edges_correct = []
-        for ne in new_edges:
-            available = False
-            for oe in histo.axes[0].edges:
-                if math.isclose(ne, oe, rel_tol = 1e-4):
-                    available = True
-            edges_correct.append(available)
-
-        assert all(edges_correct)
-
-        centers = histo.axes[0].centers
-
-        binmap = np.digitize(centers, new_edges)
-        new_sw, new_sw2 = [], []
-
-        for bin_num in sorted(set(binmap)):
-            old_bins_in_this_bin = np.where(binmap == bin_num)[0]
-
-            if new_edges[0] == histo.axes[0].edges[0] and new_edges[-1] != histo.axes[0].edges[-1]:
-                if old_bins_in_this_bin == histo.axes[0].edges[-1]:
-                    continue
-            if new_edges[-1] == histo.axes[0].edges[-1] and new_edges[0] != histo.axes[0].edges[0]:
-                if old_bins_in_this_bin == histo.axes[0].edges[0]:
-                    continue
-
-            w_slice = sw[old_bins_in_this_bin].sum()
-            sw2_slice = sw2[old_bins_in_this_bin].sum()
-            new_sw.append(w_slice)
-            new_sw2.append(sw2_slice)
-
-        hnew = hist.Hist.new.Var(new_edges, name=histo.axes[0].name, label=histo.label, flow=True).Weight()
-        hnew[...] = np.stack([new_sw, new_sw2], axis=-1)
+        if histo.ndim == 1:
+            new_edges = [new_edges]
+        assert len(new_edges) == histo.ndim, f"Need one set of edges per axis to rebin {self}, got {len(new_edges)} for {histo.ndim} axes"
+
+        if all(edges is None or _same_edges(axis.edges, edges) for axis, edges in zip(histo.axes, new_edges)):
+            return
+
+        values    = histo.values(flow=True)
+        variances = histo.variances(flow=True)
+        if variances is None:
+            variances = values
+
+        new_axes = []
+        for dim, (axis, edges) in enumerate(zip(histo.axes, new_edges)):
+            if edges is None:
+                edges = axis.edges
+            # Always rebin into histograms with flow bins, pad the old ones if they don't have them
+            pad = [(0, 0)]*histo.ndim
+            pad[dim] = (int(not axis.traits.underflow), int(not axis.traits.overflow))
+            values, variances = np.pad(values, pad), np.pad(variances, pad)
+
+            starts    = _rebin_starts(axis.edges, edges, self)
+            values    = np.add.reduceat(values, starts, axis=dim)
+            variances = np.add.reduceat(variances, starts, axis=dim)
+            new_axes.append(hist.axis.Variable(edges, name=axis.name, label=axis.label, flow=True))
+
+        hnew = hist.Hist(*new_axes, storage=hist.storage.Weight(), label=histo.label)
+        view = hnew.view(flow=True)
+        view['value']    = values
+        view['variance'] = variances
 
         self.h = hnew
 
-class Histograms(AccumulatorABC):
-    def __init__(self):
-        # Initialize any necessary data structures or variables for your accumulator
-        self.to_plot = {}
-
-    def add(self, other):
-        # Implement the addition logic to combine histograms
-        for key, value in other.to_plot.items():
-            if key in self.to_plot:
-                # Add the histograms together or define your own custom logic
-                self.to_plot[key] += value
-            else:
-                # Initialize the histogram in the accumulator if it doesn't exist
-                self.to_plot[key] = value
-
-    def __getitem__(self, histo):
-
-        if isinstance(histo, Histogram):
-            key = (histo.name, histo.sample, histo.region, histo.rescale)
-        else:
-            key = histo
-        return self.to_plot[key]
-
-    def identity(self):
-        # Create and return a new instance of the accumulator
-        return Histograms()
+def _same_edges(old_edges, new_edges):
+    return len(old_edges) == len(new_edges) and np.allclose(old_edges, new_edges, rtol=1e-4, atol=0)
+
+def _rebin_starts(old_edges, new_edges, histogram):
+    '''
+    Map new_edges onto old_edges, returning the index of the first flow-padded
+    old bin going into each of the new bins (underflow, bins, overflow). This
+    is what np.add.reduceat needs to sum the old bins into the new ones.
+    '''
+    old_edges = np.asarray(old_edges, dtype=float)
+    new_edges = np.asarray(new_edges, dtype=float)
+    assert np.all(np.diff(new_edges) > 0), f"New edges {new_edges} for {histogram} must be strictly increasing"
+
+    # Find the closest old edge to each new edge and check they agree
+    idx     = np.clip(np.searchsorted(old_edges, new_edges), 1, len(old_edges)-1)
+    closest = np.where(np.abs(old_edges[idx-1] - new_edges) <= np.abs(old_edges[idx] - new_edges), idx-1, idx)
+    matched = np.isclose(old_edges[closest], new_edges, rtol=1e-4, atol=0)
+    assert np.all(matched), f"New edges {new_edges[~matched]} for {histogram} are not edges of the original binning"
+
+    # Old edge i is the upper edge of padded bin i, so the new bin starting at
+    # old edge i starts at padded bin i+1. Underflow always starts at bin 0.
+    return np.concatenate([[0], closest + 1])
+
+class HistogramAggregates(object):
+    '''
+    Sums of the MC histograms of one (variable, region, rescale), computed the
+    first time they are needed and reused by all the plots of that key.
+    '''
+    def __init__(self, backgrounds, signals):
+        self.backgrounds = backgrounds
+        self.signals = signals
+        self._cache = {}
+
+    def _cached(self, name, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    def total_backgrounds(self):
+        '''
+        Sum of the background histograms, None if there are no backgrounds
+        '''
+        return self._cached('backgrounds', lambda: sum(self.backgrounds) if self.backgrounds != [] else None)
 
-    def clone(self):
-        # Create a copy of the accumulator
-        acc = MyAccumulator()
-        acc.histograms = deepcopy(self.to_plot)
-        return acc
+    def total_signals(self):
+        '''
+        Sum of the signal histograms, None if there are no signals
+        '''
+        return self._cached('signals', lambda: sum(self.signals) if self.signals != [] else None)
 
-    def __setitem__(self, histo, h ):
+    def total_mc(self):
+        '''
+        Sum of all background and signal histograms, built from their totals
+        '''
+        def compute():
+            totals = [total for total in (self.total_backgrounds(), self.total_signals()) if total is not None]
+            return sum(totals) if totals != [] else None
+        return self._cached('mc', compute)
 
-        if isinstance(histo, Histogram):
-            key = (histo.name, histo.sample, histo.region, histo.rescale)
-        else:
-            key = histo
-        self.to_plot[key] = h
+    def background_to(self, target):
+        '''
+        Sum of all MC histograms except the target one, computed as the total
+        MC minus the target instead of summing all the other samples again.
+        '''
+        total_mc = self.total_mc()
+        background = Histogram(total_mc.name, total_mc.h.copy(), '___DUMMY___', total_mc.region, total_mc.rescale)
+        if any(histogram.sample == target.sample for histogram in self.backgrounds+self.signals):
+            view, target_view = background.h.view(flow=True), target.h.view(flow=True)
+            view['value'] -= target_view['value']
+            # Guard against rounding making the variance of an empty background negative
+            view['variance'] = np.maximum(view['variance'] - target_view['variance'], 0)
+        return background
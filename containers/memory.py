@@ -0,0 +1,148 @@
+
+# Kept apart from the coffea accumulators so that it can be read without coffea
+import json
+import os
+import resource
+
+import awkward as ak
+import numpy as np
+
+def rss():
+    '''
+    Resident memory of this process in bytes. Falls back on the peak resident
+    memory where /proc is not available.
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def nbytes(obj):
+    '''
+    Memory held by the result of a functor, 0 if it is not an array.
+    '''
+    if isinstance(obj, (ak.Array, np.ndarray)):
+        return obj.nbytes
+    return 0
+
+def _size(nbytes):
+    for unit in ['B', 'kB', 'MB']:
+        if abs(nbytes) < 1024:
+            return f'{nbytes:.0f} {unit}'
+        nbytes /= 1024
+    return f'{nbytes:.1f} GB'
+
+class MemoryReport(object):
+    '''
+    Memory used while processing: resident memory before and after each chunk,
+    size of the arrays returned by each functor, and size of the histograms
+    of each sample and variable. Reports of all chunks are added together along
+    with the histograms.
+    '''
+    def __init__(self):
+        # dataset -> [chunks, largest rss before, largest rss after, largest growth, total growth]
+        self.chunks = {}
+        # (role, name) -> [calls, largest array, total bytes]
+        self.functors = {}
+        # sample or variable name -> [largest in a chunk, in the output]
+        self.samples = {}
+        self.variables = {}
+
+    def record_chunk(self, dataset, before, after):
+        chunk = self.chunks.setdefault(dataset, [0, 0, 0, 0, 0])
+        chunk[0] += 1
+        chunk[1] = max(chunk[1], before)
+        chunk[2] = max(chunk[2], after)
+        chunk[3] = max(chunk[3], after - before)
+        chunk[4] += after - before
+
+    def record_functor(self, functor, result):
+        size = nbytes(result)
+        record = self.functors.setdefault((functor.role, functor.name), [0, 0, 0])
+        record[0] += 1
+        record[1] = max(record[1], size)
+        record[2] += size
+
+    def _histogram_sizes(self, histograms):
+        samples, variables = {}, {}
+        for (variable, sample, _, _), histogram in histograms.items():
+            # Data does not contribute to the total, its total histogram is 0
+            if not hasattr(histogram.h, 'view'): continue
+            size = histogram.h.view(flow=True).nbytes
+            samples[sample] = samples.get(sample, 0) + size
+            variables[variable] = variables.get(variable, 0) + size
+        return samples, variables
+
+    def record_accumulator(self, histograms):
+        '''
+        Histograms returned by one chunk
+        '''
+        for sizes, records in zip(self._histogram_sizes(histograms), [self.samples, self.variables]):
+            for name, size in sizes.items():
+                record = records.setdefault(name, [0, 0])
+                record[0] = max(record[0], size)
+
+    def record_output(self, histograms):
+        '''
+        Histograms of the merged output
+        '''
+        for sizes, records in zip(self._histogram_sizes(histograms), [self.samples, self.variables]):
+            for name, size in sizes.items():
+                records.setdefault(name, [0, 0])[1] = size
+
+    def add(self, other):
+        for dataset, (chunks, before, after, growth, total) in other.chunks.items():
+            chunk = self.chunks.setdefault(dataset, [0, 0, 0, 0, 0])
+            self.chunks[dataset] = [chunk[0] + chunks, max(chunk[1], before), max(chunk[2], after), max(chunk[3], growth), chunk[4] + total]
+        for key, (calls, largest, total) in other.functors.items():
+            record = self.functors.setdefault(key, [0, 0, 0])
+            self.functors[key] = [record[0] + calls, max(record[1], largest), record[2] + total]
+        for mine, theirs in [(self.samples, other.samples), (self.variables, other.variables)]:
+            for name, (largest, output) in theirs.items():
+                record = mine.setdefault(name, [0, 0])
+                mine[name] = [max(record[0], largest), max(record[1], output)]
+
+    def rows(self):
+        '''
+        Report as dictionaries, largest first.
+        '''
+        return {
+            'chunks':    sorted([{'dataset': dataset, 'chunks': chunks, 'max_rss_before': before, 'max_rss_after': after, 'max_growth': growth, 'mean_growth': total/chunks}
+                                 for dataset, (chunks, before, after, growth, total) in self.chunks.items()], key = lambda row: -row['max_rss_after']),
+            'functors':  sorted([{'role': role, 'name': name, 'calls': calls, 'max_bytes': largest, 'mean_bytes': total/calls}
+                                 for (role, name), (calls, largest, total) in self.functors.items()], key = lambda row: -row['max_bytes']),
+            'samples':   sorted([{'sample': name, 'max_chunk_bytes': largest, 'output_bytes': output}
+                                 for name, (largest, output) in self.samples.items()], key = lambda row: -row['output_bytes']),
+            'variables': sorted([{'variable': name, 'max_chunk_bytes': largest, 'output_bytes': output}
+                                 for name, (largest, output) in self.variables.items()], key = lambda row: -row['output_bytes']),
+        }
+
+    def report(self):
+        '''
+        Text tables of the report
+        '''
+        rows = self.rows()
+        lines = []
+        tables = [('chunks',    'dataset',  ['chunks', 'max_rss_before', 'max_rss_after', 'max_growth', 'mean_growth']),
+                  ('functors',  None,       ['calls', 'max_bytes', 'mean_bytes']),
+                  ('samples',   'sample',   ['max_chunk_bytes', 'output_bytes']),
+                  ('variables', 'variable', ['max_chunk_bytes', 'output_bytes'])]
+        for table, key, columns in tables:
+            names = [f"{row['role']}:{row['name']}" if key is None else row[key] for row in rows[table]]
+            width = max([len(name) for name in names] + [len(table)])
+            lines.append(f"{table:<{width}}  " + '  '.join(f'{column:>15}' for column in columns))
+            for name, row in zip(names, rows[table]):
+                lines.append(f"{name:<{width}}  " + '  '.join(f'{row[column]:>15}' if column in ['calls', 'chunks'] else f'{_size(row[column]):>15}' for column in columns))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def save(self, stem):
+        '''
+        Write the report to {stem}.json and {stem}.txt
+        '''
+        with open(f'{stem}.json', 'w') as f:
+            json.dump(self.rows(), f, indent=1)
+        with open(f'{stem}.txt', 'w') as f:
+            f.write(self.report())
@@ -0,0 +1,101 @@
+
+# Kept apart from the coffea accumulators so that it can be read without coffea
+import json
+import time
+
+import numpy as np
+
+# Number of files listed in the summary as the slowest
+SLOWEST_FILES = 10
+
+def _jsonable(obj):
+    if isinstance(obj, dict):
+        return {str(key): _jsonable(value) for key, value in obj.items()}
+    if isinstance(obj, (set, frozenset)):
+        return sorted(_jsonable(value) for value in obj)
+    if isinstance(obj, (list, tuple)):
+        return [_jsonable(value) for value in obj]
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    return obj
+
+def _rate(events, seconds):
+    return events/seconds if seconds > 0 else None
+
+class RunMetrics(object):
+    '''
+    Metrics of each chunk: where it comes from, how many events it has, how
+    long reading and processing it took, and how many histogram fills it made.
+    Metrics of all chunks are collected along with the histograms.
+    '''
+    def __init__(self):
+        self.chunks = []
+        # Fills of the chunk being processed
+        self.fills = 0
+        self.filled = 0
+
+    def record_fill(self, values):
+        self.fills += 1
+        self.filled += values
+
+    def record_chunk(self, metadata, events, read_seconds, process_seconds):
+        self.chunks.append({'dataset': metadata.get('dataset'),
+                            'file': metadata.get('filename'),
+                            'entrystart': metadata.get('entrystart'),
+                            'entrystop': metadata.get('entrystop'),
+                            'events': events,
+                            'read_seconds': read_seconds,
+                            'process_seconds': process_seconds,
+                            'fills': self.fills,
+                            'filled': self.filled})
+        self.fills, self.filled = 0, 0
+
+    def add(self, other):
+        self.chunks.extend(other.chunks)
+
+    def summary(self, tree, wall_seconds, coffea_metrics = None):
+        '''
+        Events per second for each sample, split of the time between reading and
+        processing, and the files with the lowest event rate.
+        '''
+        datasets, files = {}, {}
+        for chunk in self.chunks:
+            for groups, key in [(datasets, chunk['dataset']), (files, chunk['file'])]:
+                group = groups.setdefault(key, {'chunks': 0, 'events': 0, 'read_seconds': 0., 'process_seconds': 0., 'fills': 0, 'filled': 0})
+                group['chunks'] += 1
+                for field in ['events', 'read_seconds', 'process_seconds', 'fills', 'filled']:
+                    group[field] += chunk[field]
+
+        for groups in [datasets, files]:
+            for group in groups.values():
+                group['events_per_second'] = _rate(group['events'], group['process_seconds'])
+
+        events = sum(group['events'] for group in datasets.values())
+        read_seconds = sum(group['read_seconds'] for group in datasets.values())
+        process_seconds = sum(group['process_seconds'] for group in datasets.values())
+
+        slowest = sorted(files.items(), key = lambda item: item[1]['events_per_second'] if item[1]['events_per_second'] is not None else 0)
+
+        return _jsonable({
+            'tree': tree,
+            'time': time.time(),
+            'wall_seconds': wall_seconds,
+            'events': events,
+            'events_per_second': _rate(events, wall_seconds),
+            'read_seconds': read_seconds,
+            'process_seconds': process_seconds,
+            'read_fraction': read_seconds/process_seconds if process_seconds > 0 else None,
+            'fills': sum(group['fills'] for group in datasets.values()),
+            'filled': sum(group['filled'] for group in datasets.values()),
+            'samples': [{'sample': name, **group} for name, group in sorted(datasets.items())],
+            'slowest_files': [{'file': name, **group} for name, group in slowest[:SLOWEST_FILES]],
+            'coffea': coffea_metrics,
+            'chunks': self.chunks,
+        })
+
+    def save(self, path, tree, wall_seconds, coffea_metrics = None):
+        '''
+        Write the summary of the run to a JSON file
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.summary(tree, wall_seconds, coffea_metrics), f, indent=1)
@@ -0,0 +1,69 @@
+
+# Kept apart from the coffea accumulators so that it can be read without coffea
+import json
+from contextlib import contextmanager
+from time import perf_counter
+
+class Profile(object):
+    '''
+    Time spent in each stage of the processor (reading, filling, merging...)
+    and in each functor, by the role it has in the config and its function name.
+    Profiles of all chunks are added together along with the histograms.
+    '''
+    def __init__(self):
+        # (role, name) -> [seconds, calls]
+        self.timings = {}
+
+    def record(self, role, name, seconds, calls = 1):
+        timing = self.timings.setdefault((role, name), [0., 0])
+        timing[0] += seconds
+        timing[1] += calls
+
+    def add(self, other):
+        for (role, name), (seconds, calls) in other.timings.items():
+            self.record(role, name, seconds, calls)
+
+    @staticmethod
+    @contextmanager
+    def timer(profile, role, name):
+        '''
+        Time the body of the with statement, does nothing if there is no profile.
+        '''
+        if profile is None:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            profile.record(role, name, perf_counter() - start)
+
+    def rows(self):
+        '''
+        Timings as dictionaries, slowest first.
+        '''
+        rows = [{'role': role, 'name': name, 'seconds': seconds, 'calls': calls}
+                for (role, name), (seconds, calls) in self.timings.items()]
+        return sorted(rows, key = lambda row: (-row['seconds'], row['role'], row['name']))
+
+    def report(self):
+        '''
+        Text table of the timings, with the share of the time spent in process.
+        '''
+        process = self.timings.get(('stage', 'process'), [0., 0])[0]
+        rows = self.rows()
+        width = max([len(f"{row['role']}:{row['name']}") for row in rows] + [4])
+        lines = [f"{'what':<{width}}  {'seconds':>10}  {'calls':>8}  {'ms/call':>9}  {'% process':>9}"]
+        for row in rows:
+            share = f"{100*row['seconds']/process:9.1f}" if process > 0 else f"{'-':>9}"
+            lines.append(f"{row['role'] + ':' + row['name']:<{width}}  {row['seconds']:>10.3f}  {row['calls']:>8}  {1000*row['seconds']/max(row['calls'], 1):>9.3f}  {share}")
+        return '\n'.join(lines)
+
+    def save(self, stem):
+        '''
+        Write the timings to {stem}.json and {stem}.txt
+        '''
+        with open(f'{stem}.json', 'w') as f:
+            json.dump(self.rows(), f, indent=1)
+        with open(f'{stem}.txt', 'w') as f:
+            f.write(self.report() + '\n')
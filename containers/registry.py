@@ -0,0 +1,113 @@
+import re
+
+class Registry(object):
+    '''
+    Ordered collection of samples, regions, variables or rescales, indexed by
+    name. Iterating over it gives the objects in the order they were added,
+    like the lists it replaces. SuperSamples are indexed by their own name (the
+    name of their fileset) and by the names of their subsamples.
+    '''
+    def __init__(self, kind, items = None):
+        self.kind = kind
+        self.items = []
+        # Name to object, for objects added directly (for samples, the fileset names)
+        self.index = {}
+        # Name to object, with subsamples instead of their SuperSample
+        self.unpacked_index = {}
+        # Caches, cleared whenever an object is added
+        self._unpacked = None
+        self._selections = {}
+
+        for item in (items or []):
+            self.add(item)
+
+    def _reset(self):
+        self._unpacked = None
+        self._selections = {}
+
+    def __contains__(self, name):
+        # Histograms are made for each sample and subsample, SuperSample names only name filesets
+        return name in self.unpacked_index
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            item = self.get(key)
+            if item is None:
+                raise KeyError(f'No {self.kind} called {key}')
+            return item
+        return self.items[key]
+
+    def get(self, name, default = None):
+        '''
+        Object with this name, looking at subsamples too.
+        '''
+        item = self.index.get(name)
+        if item is None:
+            item = self.unpacked_index.get(name, default)
+        return item
+
+    def add(self, item):
+        '''
+        Add an object, its name must not be taken yet. The subsamples of a
+        SuperSample can be added with it or later with add_subsample.
+        '''
+        if item.name in self.index:
+            raise ValueError(f'{self.kind.capitalize()} {item.name} is defined more than once')
+        self.items.append(item)
+        self.index[item.name] = item
+        if getattr(item, 'is_super', False):
+            for subsample in item.subsamples:
+                self._index_subsample(subsample)
+        else:
+            self._index_subsample(item)
+        self._reset()
+
+    def _index_subsample(self, sample):
+        if sample.name in self.unpacked_index:
+            raise ValueError(f'{self.kind.capitalize()} {sample.name} is defined more than once')
+        self.unpacked_index[sample.name] = sample
+
+    def add_subsample(self, supersample, sample):
+        '''
+        Add a sample to a SuperSample that is already in the registry.
+        '''
+        self._index_subsample(sample)
+        supersample.add_subsample(sample)
+        self._reset()
+
+    def unpacked(self):
+        '''
+        All objects with SuperSamples replaced by their subsamples. The list
+        is built once and shared, it must not be modified.
+        '''
+        if self._unpacked is None:
+            self._unpacked = [subsample for item in self.items
+                              for subsample in (item.subsamples if getattr(item, 'is_super', False) else [item])]
+        return self._unpacked
+
+    def select(self, patterns, unpack = False):
+        '''
+        Objects whose name matches one of the regexes at its start (as re.match
+        does, which is how the config regexes were always used). Results are
+        cached per list of regexes.
+        '''
+        key = (tuple(patterns), unpack)
+        if key not in self._selections:
+            pool = self.unpacked() if unpack else self.items
+            compiled = [re.compile(pattern) for pattern in patterns]
+            selected = [item for item in pool if any(regex.match(item.name) is not None for regex in compiled)]
+            self._selections[key] = (selected, frozenset(item.name for item in selected))
+        return self._selections[key][0]
+
+    def selected_names(self, patterns, unpack = False):
+        '''
+        Names of the objects returned by select, as a set.
+        '''
+        self.select(patterns, unpack)
+        return self._selections[(tuple(patterns), unpack)][1]
@@ -0,0 +1,189 @@
+
+# Kept apart from the coffea accumulators so that it can be read without coffea
+import os
+import secrets
+from multiprocessing import shared_memory, resource_tracker, parent_process
+
+import hist
+import numpy as np
+
+from containers.histograms import Histogram
+
+# Offsets of the arrays in a block are multiples of this, to keep them aligned
+ALIGNMENT = 64
+
+# Blocks received by this process and not freed yet, see release_blocks
+_received = set()
+# Where blocks can be listed, on linux
+SHM_DIR = '/dev/shm'
+
+def _prefix(pid):
+    # Blocks are named after the process they are handed to, short enough for macOS
+    return f'cp{pid}_'
+
+def in_worker():
+    '''
+    Whether this is a process started by a pool of workers
+    '''
+    return parent_process() is not None
+
+def _unlink(name):
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+def release_blocks():
+    '''
+    Free the blocks received from workers that were never read, e.g. when a
+    run fails while results are still on their way. Workers hand their blocks
+    over to the parent, so nothing else frees them before a reboot. Where
+    blocks can be listed, those made for this process but not received yet
+    (results coffea has not unpickled, workers that died) are freed as well.
+    '''
+    names = set(_received)
+    if os.path.isdir(SHM_DIR):
+        names.update(name for name in os.listdir(SHM_DIR) if name.startswith(_prefix(os.getpid())))
+    for name in names:
+        _unlink(name)
+    _received.clear()
+
+def _axis_spec(axis):
+    '''
+    What is needed to build an axis again, None for axes other than the
+    variable ones the processor books
+    '''
+    if not isinstance(axis, hist.axis.Variable):
+        return None
+    return (tuple(axis.edges), axis.name, axis.label, axis.traits.underflow, axis.traits.overflow)
+
+def _make_axis(spec):
+    edges, name, label, underflow, overflow = spec
+    return hist.axis.Variable(edges, name=name, label=label, underflow=underflow, overflow=overflow)
+
+def _storage(h):
+    if isinstance(h.storage_type(), hist.storage.Weight):
+        return 'weight'
+    if isinstance(h.storage_type(), hist.storage.Double):
+        return 'double'
+    return None
+
+class SharedHistograms(object):
+    '''
+    The histograms of an accumulator, with their bin contents in one shared
+    memory block. Only the index of the block is pickled, so a worker hands
+    its histograms to the parent without serialising their bins. The parent
+    reads the block once, with merge_into, and frees it.
+    '''
+    def __init__(self, to_plot):
+        # Axes are shared by many histograms, they are stored once
+        self.axes = []
+        axis_ids = {}
+        # (key, name, sample, region, rescale, label, axes, storage, dtype, offset, shape)
+        self.index = []
+        # Anything that is not a histogram with known axes and storage, pickled as it is
+        self.objects = {}
+
+        arrays = []
+        offset = 0
+        for key, histogram in to_plot.items():
+            h = histogram.h
+            specs = [_axis_spec(axis) for axis in h.axes] if isinstance(h, hist.Hist) else [None]
+            if None in specs or _storage(h) is None or h.label is not None or h.name is not None:
+                self.objects[key] = histogram
+                continue
+            axes = []
+            for spec in specs:
+                if spec not in axis_ids:
+                    axis_ids[spec] = len(self.axes)
+                    self.axes.append(spec)
+                axes.append(axis_ids[spec])
+            array = np.asarray(h.view(flow=True))
+            self.index.append((key, histogram.name, histogram.sample, histogram.region, histogram.rescale, histogram.label,
+                               tuple(axes), _storage(h), array.dtype.descr, offset, array.shape))
+            arrays.append((offset, array))
+            offset += -(-array.nbytes//ALIGNMENT)*ALIGNMENT
+
+        self.name = None
+        self.size = offset
+        if offset == 0:
+            return
+        block = shared_memory.SharedMemory(name=_prefix(os.getppid()) + secrets.token_hex(6), create=True, size=offset)
+        for start, array in arrays:
+            np.frombuffer(block.buf, dtype=array.dtype, count=array.size, offset=start).reshape(array.shape)[...] = array
+        self.name = block.name
+        block.close()
+        # The parent frees the block, this process must not do it when it exits
+        resource_tracker.unregister(block._name, 'shared_memory')
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.name is not None and not in_worker():
+            _received.add(self.name)
+
+    def __len__(self):
+        return len(self.index) + len(self.objects)
+
+    def _make_histogram(self, entry, array):
+        _, name, sample, region, rescale, label, axes, storage, _, _, _ = entry
+        storage = hist.storage.Weight() if storage == 'weight' else hist.storage.Double()
+        h = hist.Hist(*[_make_axis(self.axes[axis]) for axis in axes], storage=storage)
+        np.asarray(h.view(flow=True))[...] = array
+        return Histogram(name, h, sample, region, rescale, label)
+
+    def merge_into(self, to_plot):
+        '''
+        Add the histograms to those of to_plot, straight from the block where
+        both have the same bins, and free the block.
+        '''
+        for key, histogram in self.objects.items():
+            if key in to_plot:
+                to_plot[key] += histogram
+            else:
+                to_plot[key] = histogram
+        self.objects = {}
+
+        if self.name is None:
+            return
+        block = shared_memory.SharedMemory(name=self.name)
+        _received.discard(self.name)
+        self.name = None
+        array = None
+        try:
+            for entry in self.index:
+                key, _, _, _, _, _, _, storage, dtype, offset, shape = entry
+                array = np.frombuffer(block.buf, dtype=np.dtype(dtype), count=int(np.prod(shape)), offset=offset).reshape(shape)
+                existing = to_plot.get(key)
+                if existing is None:
+                    to_plot[key] = self._make_histogram(entry, array)
+                elif isinstance(existing.h, hist.Hist) and existing.h.view(flow=True).shape == shape and _storage(existing.h) == storage:
+                    view = np.asarray(existing.h.view(flow=True))
+                    if array.dtype.names is None:
+                        view += array
+                    else:
+                        for field in array.dtype.names:
+                            view[field] += array[field]
+                else:
+                    to_plot[key] += self._make_histogram(entry, array)
+        finally:
+            # The block can only be closed once no array points into it
+            array = None
+            block.close()
+            block.unlink()
+        self.index = []
+
+    def materialize(self):
+        '''
+        The histograms as a dictionary like Histograms.to_plot
+        '''
+        to_plot = {}
+        self.merge_into(to_plot)
+        return to_plot
+
+    def __del__(self):
+        # Free blocks that were never read, e.g. when a result is dropped
+        if self.name is not None and not in_worker():
+            _received.discard(self.name)
+            _unlink(self.name)
@@ -0,0 +1,72 @@
+'''
+Write synthetic ntuples for a configuration, to run the processor at scale
+without the real inputs. The branches are the ones the functors of the config
+read (see util/synthetic.py), and the files are named after the NtuplesRgxs of
+each sample so that the config picks them up unchanged.
+
+    python generate_ntuples.py configs/myconfig.yaml --files 10 --events 1000000 --workers 8
+'''
+# =========== Import statements =========== #
+# Import python packages
+import os, time
+import argparse
+# Import coffeaplot packages
+from coffeaplot import log, setup_logging, parse_config
+from config.reader import read as read_config, validate as validate_config
+from util.synthetic import WEIGHTS, COMPRESSIONS, config_branches, synthetic_files, write_ntuples
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Write synthetic ntuples with the branches a configuration reads")
+    parser.add_argument("cfg",             help="Configuration file to write ntuples for")
+    parser.add_argument("--files",         type=int, default=1, help="Files written for each sample")
+    parser.add_argument("--events",        type=int, default=100000, help="Events in each file")
+    parser.add_argument("--njets",         type=float, default=5., help="Mean number of jets per event")
+    parser.add_argument("--maxjets",       type=int, default=None, help="Largest number of jets in an event")
+    parser.add_argument("--weights",       default='normal', choices=WEIGHTS, help="Distribution of the weights")
+    parser.add_argument("--jagged",        nargs='+', default=None, help="Regexes of branches that are jet collections, beyond those of 'nonevent' variables")
+    parser.add_argument("--outdir",        default=None, help="Write the files here instead of the NtuplesDirs of the config")
+    parser.add_argument("--workers",       type=int, default=os.cpu_count(), help="Files written in parallel")
+    parser.add_argument("--seed",          type=int, default=0, help="Seed of the random values, the same seed gives the same files")
+    parser.add_argument("--compression",   default='zlib', choices=COMPRESSIONS, help="Compression of the files")
+    parser.add_argument("--skip-existing", action='store_true', help="Do not write files that already exist")
+    return parser.parse_args()
+
+def main():
+    args = argparser()
+
+    log.info("Parsing and Validating config file")
+    validated = validate_config(read_config(args.cfg))
+    setup_logging(validated['general']['loglevel'])
+    # Files are only looked for by the processor, and there are none yet
+    validated['general']['runprocessor'] = False
+    validated['general']['runplotter'] = False
+    if args.outdir is not None:
+        validated['general']['ntuplesdirs'] = [args.outdir]
+    CoffeaPlotSettings = parse_config(validated)
+
+    # Samples with directories of their own write there too
+    if args.outdir is not None:
+        for sample in CoffeaPlotSettings.samples_list:
+            for subsample in (sample.subsamples if sample.is_super else []):
+                subsample.direcs = [args.outdir]
+            sample.direcs = [args.outdir]
+
+    branches = config_branches(CoffeaPlotSettings, jagged=args.jagged)
+    for kind in ['flat', 'jagged', 'weight', 'mask']:
+        names = sorted(name for name, branch in branches.items() if branch['kind'] == kind)
+        log.info(f"{len(names)} {kind} branches: {', '.join(names)}")
+
+    files = synthetic_files(CoffeaPlotSettings, args.files)
+    if args.skip_existing and all(os.path.exists(path) for path in files):
+        log.warning("All files already exist, nothing to write")
+        return
+
+    log.info(f"Writing {len(files)} files of {args.events} events in trees {CoffeaPlotSettings.trees} with {args.workers} workers")
+    start = time.time()
+    nbytes = write_ntuples(files, CoffeaPlotSettings.trees, branches, args.events, seed=args.seed, workers=args.workers, skip_existing=args.skip_existing,
+                           njets=args.njets, maxjets=args.maxjets, weights=args.weights, compression=args.compression)
+    seconds = time.time() - start
+    log.info(f"Wrote {nbytes/1024**3:.2f} GB in {seconds:.1f} s ({nbytes/1024**2/seconds:.0f} MB/s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Pre-reduction of the processor output in the workers. Each worker adds the
+histograms of the chunks it processes to an accumulator of its own and hands
+back an empty one, so the parent merges one accumulator per worker instead of
+one per chunk. A worker returns its accumulator early if it grows beyond a
+memory limit, and all of them are collected with flush() once the run is done.
+
+The accumulators live in the worker processes, so the pool of workers is
+made here and kept for the whole run.
+'''
+# ================ Pythonic Imports ================ #
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import logging
+log = logging.getLogger(__name__)
+
+# Seconds a worker waits for the others to take their flush
+FLUSH_TIMEOUT = 600
+
+# ================ Worker state ================ #
+# Accumulator of the chunks processed by this worker and not handed back yet
+_local = None
+# Barrier making every worker take exactly one flush
+_barrier = None
+# Chunks added to the accumulators of all workers
+_absorbed = None
+
+def _initialize(barrier, absorbed):
+    global _barrier, _absorbed
+    _barrier = barrier
+    _absorbed = absorbed
+
+def _nbytes(accum):
+    return sum(histogram.h.view(flow=True).nbytes for histogram in accum.to_plot.values() if hasattr(histogram.h, 'view'))
+
+def absorb(accum, limit = 0):
+    '''
+    Add the accumulator of a chunk to the one of this worker. Returns an
+    empty accumulator, or the one of this worker once it holds more than
+    limit bytes of histograms (0 for no limit).
+    '''
+    global _local
+    if _local is None:
+        _local = accum
+    else:
+        _local.add(accum)
+    with _absorbed.get_lock():
+        _absorbed.value += accum.chunks
+
+    if limit > 0 and _nbytes(_local) > limit:
+        full, _local = _local, None
+        return full
+    return accum.identity()
+
+def _flush():
+    global _local
+    # Workers wait here for each other, so none of them takes two flushes
+    _barrier.wait(FLUSH_TIMEOUT)
+    local, _local = _local, None
+    return local
+
+# ================ Parent ================ #
+def make_pool(workers):
+    '''
+    Pool of workers sharing the barrier and counter used by absorb and flush.
+    The parent keeps them too, to read the counter.
+    '''
+    context = multiprocessing.get_context()
+    shared = (context.Barrier(workers), context.Value('q', 0))
+    _initialize(*shared)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_initialize, initargs=shared)
+
+def flush(pool, workers, out):
+    '''
+    Add the accumulators left in the workers to the output of the run, and
+    check that no chunk was lost on the way.
+    '''
+    flushed = [future.result() for future in [pool.submit(_flush) for _ in range(workers)]]
+    for local in flushed:
+        if local is not None:
+            out.add(local)
+
+    with _absorbed.get_lock():
+        absorbed, _absorbed.value = _absorbed.value, 0
+    if absorbed != out.chunks:
+        log.error(f"Workers processed {absorbed} chunks but {out.chunks} are in the output, {absorbed - out.chunks} chunks were lost")
+    log.info(f"Collected {sum(local is not None for local in flushed)} worker accumulators holding {out.chunks} chunks")
+    return out
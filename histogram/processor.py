@@ -3,23 +3,28 @@ from coffea import processor
 
 # IO and Processing imports
 import awkward as ak
-import uproot
 import numpy as np
 
 # Histogramming imports
 import hist
 
 # Standard Python imports
-import os, re
+import os
 from copy import deepcopy
 from collections import defaultdict
+from time import perf_counter
 
 os.environ["MALLOC_TRIM_THRESHOLD_"] = "65536"
 
 # CoffeaPlot imports
-from containers.histograms import Histogram, Histograms
+from containers.histograms import Histogram
+from containers.accumulators import Histograms
+from containers.profile import Profile
+from containers.memory import MemoryReport, rss
+from containers.metrics import RunMetrics
 from containers.samples import SuperSample
 from containers.variables import Eff
+from histogram import prereduce
 
 class CoffeaPlotProcessor(processor.ProcessorABC):
 
@@ -35,16 +40,73 @@ class CoffeaPlotProcessor(processor.ProcessorABC):
             self.pie_sumsample  = None
             self.pie_samples    = None
 
+        # Time functors and processing stages, track memory use
+        self.profile = CoffeaPlotSettings.profile
+        self.trackmemory = CoffeaPlotSettings.trackmemory
+        self.savemetrics = CoffeaPlotSettings.savemetrics
+        self.sharedmemory = CoffeaPlotSettings.sharedmemory
+        # Chunks are merged in the workers, only when there are workers
+        self.prereduce = CoffeaPlotSettings.prereduce and CoffeaPlotSettings.nworkers != 0
+        self.prereducelimit = CoffeaPlotSettings.prereducelimit*1024**2
+        # The output is only complete once the accumulators left in the workers are flushed
+        self.defer_postprocess = self.prereduce
+        self.branches = sorted({arg for functor in self.functors() for arg in functor.args})
+
+    def functors(self):
+        '''
+        All functors evaluated in process
+        '''
+        for sample in self.samples_list.unpacked():
+            yield from (functor for functor in [sample.mc_weight, sample.weight, sample.sel] if functor is not None)
+        for region in self.regions_list:
+            yield region.sel
+        for variable in self.variables_list:
+            yield from (variable.howto if variable.dim == 2 else [variable.howto])
+            if isinstance(variable, Eff):
+                yield from [variable.numsel, variable.denomsel]
+        for rescale in self.rescales_list:
+            yield rescale.method
+
+    def evaluate(self, functor, data, accum):
+        if accum.profile is None and accum.memory is None:
+            return functor.evaluate(data)
+        with Profile.timer(accum.profile, functor.role, functor.name):
+            result = functor.evaluate(data)
+        if accum.memory is not None:
+            accum.memory.record_functor(functor, result)
+        return result
+
+    def fill(self, accum, h, *values, weight = None, **named_values):
+        with Profile.timer(accum.profile, 'stage', 'fill'):
+            h.fill(*values, weight = weight, **named_values)
+        if accum.metrics is not None:
+            accum.metrics.record_fill(len(weight))
+
+    def read_branches(self, events):
+        '''
+        Read all branches used by the config, so that reading them is timed
+        apart from the functors that use them.
+        '''
+        materialize = getattr(ak, 'materialize', None) or getattr(ak, 'materialized', None) or ak.packed
+        for branch in self.branches:
+            if branch in events.fields:
+                materialize(events[branch])
+
     def process(self, presel_events):
 
-        accum = Histograms()
-        dataset = presel_events.metadata['dataset']
+        start = perf_counter()
+        rss_before = rss() if self.trackmemory else None
+        profile = Profile() if self.profile else None
+        if self.profile or self.savemetrics:
+            with Profile.timer(profile, 'stage', 'io'):
+                self.read_branches(presel_events)
+        read_seconds = perf_counter() - start
 
-        for a_sample in self.samples_list:
+        accum = Histograms(profile, MemoryReport() if self.trackmemory else None, RunMetrics() if self.savemetrics else None, self.sharedmemory)
+        dataset = presel_events.metadata['dataset']
 
-            if dataset != a_sample.name: continue
-            the_sample = a_sample
-            break
+        # Datasets are named after samples and SuperSamples
+        the_sample = self.samples_list.index[dataset]
 
         if isinstance(the_sample, SuperSample):
             samples = the_sample.subsamples
@@ -54,11 +116,11 @@ class CoffeaPlotProcessor(processor.ProcessorABC):
 
         for sample in samples:
             presel_events['weights'] = 1.0
-            mc_weight = sample.mc_weight.evaluate(presel_events)
-            sample_weights = sample.weight.evaluate(presel_events)
+            mc_weight = self.evaluate(sample.mc_weight, presel_events, accum)
+            sample_weights = self.evaluate(sample.weight, presel_events, accum)
             presel_events['weights'] = sample_weights*mc_weight
 
-            filt_sample = presel_events[sample.sel.evaluate(presel_events)] if sample.sel is not None else presel_events
+            filt_sample = presel_events[self.evaluate(sample.sel, presel_events, accum)] if sample.sel is not None else presel_events
 
             # ====== Loop over 1D plots ====== #
 
@@ -77,18 +139,16 @@ class CoffeaPlotProcessor(processor.ProcessorABC):
                     eff_mask_functor = variable.numsel if ':Num' in name else variable.denomsel
 
                 if variable.type == 'GHOST':
-                    filt_sample[name] = histo_compute.evaluate(filt_sample)
+                    filt_sample[name] = self.evaluate(histo_compute, filt_sample, accum)
                     continue
 
-                for region_to_plot in self.regions_list:
-
-                    if all(re.match(region_to_use, region_to_plot.name) is None for region_to_use in regions_to_use): continue
+                for region_to_plot in self.regions_list.select(regions_to_use):
 
-                    filt_reg = filt_sample[region_to_plot.sel.evaluate(filt_sample)]
+                    filt_reg = filt_sample[self.evaluate(region_to_plot.sel, filt_sample, accum)]
 
                     # Get the bool mask for the efficiency variable component
                     if isinstance(variable, Eff):
-                        eff_mask = eff_mask_functor.evaluate(filt_reg)
+                        eff_mask = self.evaluate(eff_mask_functor, filt_reg, accum)
 
                     # ================ Empty histogram for this region for this sample ===========
                     if ak.num(filt_reg['weights'], axis=0) == 0:
@@ -97,8 +157,8 @@ class CoffeaPlotProcessor(processor.ProcessorABC):
                     # =============== Non empty histogram for this region for this sample ==========
                     for rescaling in self.rescales_list:
 
-                        if any(re.match(affected_sample, sample.name) is not None for affected_sample in rescaling.affects):
-                            rescaled_weights = rescaling.method.evaluate(filt_reg)
+                        if sample.name in self.samples_list.selected_names(rescaling.affects, unpack=True):
+                            rescaled_weights = self.evaluate(rescaling.method, filt_reg, accum)
                         else:
                             rescaled_weights = filt_reg['weights']
 
@@ -108,7 +168,7 @@ class CoffeaPlotProcessor(processor.ProcessorABC):
 
                             if idxing == 'nonevent':
                                 # Compute variable of interest
-                                var = histo_compute.evaluate(filt_reg)
+                                var = self.evaluate(histo_compute, filt_reg, accum)
                                 # Expect all args going into the histogram variable have same shape, make weights have same shape
                                 w, _ = ak.broadcast_arrays(rescaled_weights[:, np.newaxis], filt_reg[histo_compute.args[0]])
                                 # TODO:: Make this more general than just flattening operations
@@ -119,28 +179,29 @@ class CoffeaPlotProcessor(processor.ProcessorABC):
                                     w   = w[eff_mask]
 
                             else:
-                                var = histo_compute.evaluate(filt_reg)
+                                var = self.evaluate(histo_compute, filt_reg, accum)
                                 w = rescaled_weights
                                 if isinstance(variable, Eff):
                                     var = var[eff_mask]
                                     w   = w[eff_mask]
 
                             # Fill the histogram
-                            h.fill(var, weight = w)
+                            self.fill(accum, h, var, weight = w)
 
                             # Save the histogram
                             samp_histo_obj = Histogram(name, h, sample.name, region_to_plot.name , rescaling.name)
-                            if sample.type != 'DATA':
-                                tot_histo_obj = Histogram(name, deepcopy(h), 'total', region_to_plot.name , rescaling.name)
-                            else:
-                                tot_histo_obj = Histogram(name, 0, 'total', region_to_plot.name , rescaling.name)
-
                             accum[samp_histo_obj] = samp_histo_obj
 
-                            if sample == samples[0]:
-                                accum[tot_histo_obj] = tot_histo_obj
-                            else:
-                                accum[tot_histo_obj] += tot_histo_obj
+                            with Profile.timer(profile, 'stage', 'merge'):
+                                if sample.type != 'DATA':
+                                    tot_histo_obj = Histogram(name, deepcopy(h), 'total', region_to_plot.name , rescaling.name)
+                                else:
+                                    tot_histo_obj = Histogram(name, 0, 'total', region_to_plot.name , rescaling.name)
+
+                                if sample == samples[0]:
+                                    accum[tot_histo_obj] = tot_histo_obj
+                                else:
+                                    accum[tot_histo_obj] += tot_histo_obj
                         else:
 
                             h = (hist.Hist.new.Var(binning[0], name = "x", label=label[0], flow=True)
@@ -151,37 +212,53 @@ class CoffeaPlotProcessor(processor.ProcessorABC):
                             for axis in range(2):
                                 if idxing == 'nonevent':
                                     # Compute variable of interest
-                                    var = histo_compute[axis].evaluate(filt_reg)
+                                    var = self.evaluate(histo_compute[axis], filt_reg, accum)
                                     # Expect all args going into the histogram variable have same shape, make weights have same shape
                                     w, _ = ak.broadcast_arrays(rescaled_weights[:, np.newaxis], filt_reg[histo_compute[axis].args[0]])
                                     # TODO:: Make this more general than just flattening operations
                                     w = ak.flatten(w)
                                 else:
-                                    var = histo_compute[axis].evaluate(filt_reg)
+                                    var = self.evaluate(histo_compute[axis], filt_reg, accum)
                                     w = rescaled_weights
 
                                 fill_what = 'x' if axis == 0 else 'y'
                                 filler[fill_what] = (var, w)
 
-                            h.fill(x=filler['x'][0], y=filler['y'][0], weight = filler['x'][1])
+                            self.fill(accum, h, x=filler['x'][0], y=filler['y'][0], weight = filler['x'][1])
 
                             # Save the histogram
                             samp_histo_obj = Histogram(name, h, sample.name, region_to_plot.name , rescaling.name)
-                            if sample.type != 'DATA':
-                                tot_histo_obj = Histogram(name, deepcopy(h), 'total', region_to_plot.name , rescaling.name)
-                            else:
-                                tot_histo_obj = Histogram(name, 0, 'total', region_to_plot.name , rescaling.name)
-
                             accum[samp_histo_obj] = samp_histo_obj
 
-                            if sample == samples[0]:
-                                accum[tot_histo_obj] = tot_histo_obj
-                            else:
-                                accum[tot_histo_obj] += tot_histo_obj
+                            with Profile.timer(profile, 'stage', 'merge'):
+                                if sample.type != 'DATA':
+                                    tot_histo_obj = Histogram(name, deepcopy(h), 'total', region_to_plot.name , rescaling.name)
+                                else:
+                                    tot_histo_obj = Histogram(name, 0, 'total', region_to_plot.name , rescaling.name)
+
+                                if sample == samples[0]:
+                                    accum[tot_histo_obj] = tot_histo_obj
+                                else:
+                                    accum[tot_histo_obj] += tot_histo_obj
+
+        if profile is not None:
+            profile.record('stage', 'process', perf_counter() - start)
+        if accum.metrics is not None:
+            accum.metrics.record_chunk(presel_events.metadata, len(presel_events), read_seconds, perf_counter() - start)
+        if accum.memory is not None:
+            accum.memory.record_accumulator(accum.to_plot)
+            accum.memory.record_chunk(dataset, rss_before, rss())
+        accum.chunks = 1
+        if self.prereduce:
+            return prereduce.absorb(accum, self.prereducelimit)
         return accum
 
     def postprocess(self, accumulator):
 
+        if self.defer_postprocess:
+            return accumulator
+        start = perf_counter()
+
         for a_sample in self.samples_list:
 
             if isinstance(a_sample, SuperSample):   samples = a_sample.subsamples
@@ -235,4 +312,9 @@ class CoffeaPlotProcessor(processor.ProcessorABC):
                                 accumulator[eff_histo] = eff_histo
 
                                 done_vars.append(variable_name)
+
+        if accumulator.profile is not None:
+            accumulator.profile.record('stage', 'postprocess', perf_counter() - start)
+        if accumulator.memory is not None:
+            accumulator.memory.record_output(accumulator.to_plot)
         return accumulator
@@ -1,5 +1,6 @@
 
 from collections import defaultdict
+from copy import copy
 
 import hist
 import mplhep
@@ -7,19 +8,33 @@ import mplhep
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpl_patches
+from matplotlib.transforms import Bbox
 
 from containers.histograms import Histogram
 from config.plot_classes import SeparationSettings
+from plot import fastdraw
 
 import logging
 log = logging.getLogger(__name__)
 
-plt.style.use(mplhep.style.ATLAS)
-plt.rcParams['axes.linewidth'] = 3
-plt.rcParams['font.size'] = 30
-plt.rcParams['xtick.major.pad']='10'
-plt.rcParams['ytick.major.pad']='10'
-plt.rcParams['text.latex.preamble'] = r'\centering'
+_style_is_set = False
+
+def setup_style():
+    '''
+    Apply the plot style to matplotlib. This is done once, the first time a figure
+    is made, rather than on import so that importing the plot classes stays cheap.
+    '''
+    global _style_is_set
+    if _style_is_set:
+        return
+
+    plt.style.use(mplhep.style.ATLAS)
+    plt.rcParams['axes.linewidth'] = 3
+    plt.rcParams['font.size'] = 30
+    plt.rcParams['xtick.major.pad']='10'
+    plt.rcParams['ytick.major.pad']='10'
+    plt.rcParams['text.latex.preamble'] = r'\centering'
+    _style_is_set = True
 
 class CoffeaPlot(object):
     '''
@@ -42,7 +57,6 @@ class CoffeaPlot(object):
 
 
     def make_figure(self):
-        fig    = plt.figure(figsize=self.settings.figuresize)
         nrows = len(self.ratio_plots) + 1
 
         if self.settings.heightratios is None:
@@ -54,28 +68,18 @@ class CoffeaPlot(object):
             assert len(self.settings.heightratios) == nrows, f"Number of height ratios ({len(self.settings.heightratios)}) does not match number of axes ({len(self.ratio_plots)})"
             height_ratios = self.settings.heightratios
 
-        gs     = fig.add_gridspec(ncols=1, nrows=nrows, height_ratios=height_ratios, hspace=0.2)
-        main_ax     = fig.add_subplot(gs[0, 0])
-        rat_axes = []
-        for i in range(nrows-1):
-            rat_ax = fig.add_subplot(gs[i+1, 0], sharex=main_ax)
-            rat_axes.append(rat_ax)
+        return figure_pool.get(self.settings.figuresize, height_ratios)
 
-        return fig, main_ax, rat_axes
+    def shade_blinded_bins(self, ax, blinded_bins, edges):
 
-    def apply_blinder(self, ax, blinder, histograms, binval, binerr):
+        if self.settings.renderer == 'fast':
+            blinded_bins = np.asarray(blinded_bins, dtype=int)
+            fastdraw.shade_bins(ax, edges[blinded_bins], edges[blinded_bins+1], label='Blinded')
+            return
 
-        # Get the blinded bin indices
-        blinded_bins = blinder.get_blinded_bins()
-        # Loop over each bin index to be blinded
         for blinded_bin_idx in blinded_bins:
-            # Loop over all histograms in the stack plot affected by blinding and nullify the bin contents
-            for histogram in histograms:
-                histogram.values()[blinded_bin_idx] = binval
-                histogram.variances()[blinded_bin_idx] = binerr
-
             # Get bin edges to shade between
-            shade_x1, shade_x2 = histograms[0].axes.edges[0][blinded_bin_idx:blinded_bin_idx+2] # Last index is not inclusive
+            shade_x1, shade_x2 = edges[blinded_bin_idx:blinded_bin_idx+2] # Last index is not inclusive
 
             # Need to shade twice to get the hatch to show up in legend
             VSpanBox((shade_x1, shade_x2), color='blue', alpha=0.06, linewidth=0).draw(ax)
@@ -85,6 +89,27 @@ class CoffeaPlot(object):
 
             VSpanBox((shade_x1, shade_x2), facecolor='none', edgecolor='grey', hatch="//", alpha=0.5, linewidth=0, label = label).draw(ax)
 
+    def apply_blinder(self, ax, blinder, histograms, binval, binerr):
+        '''
+        Shade the blinded bins and return copies of the histograms with the blinded bin
+        contents set to binval and variances to binerr. The histograms passed in are
+        not modified since they are shared between plots.
+        '''
+        # Get the blinded bin indices
+        blinded_bins = blinder.get_blinded_bins()
+        self.shade_blinded_bins(ax, blinded_bins, histograms[0].axes.edges[0])
+        if len(blinded_bins) == 0:
+            return histograms
+
+        # Only copy the histograms being drawn, and nullify the blinded bin contents
+        blinded_histograms = []
+        for histogram in histograms:
+            histogram = histogram.copy()
+            histogram.values()[blinded_bins] = binval
+            histogram.variances()[blinded_bins] = binerr
+            blinded_histograms.append(histogram)
+
+        return blinded_histograms
 
     def plot_1d_canvas(self, main_ax):
 
@@ -133,13 +158,16 @@ class CoffeaPlot(object):
 
             # If the stack needs to blinded, shade the blinded bins and set the bin contents to 0
             if stack.blinder is not None:
-                self.apply_blinder(main_ax, stack.blinder, histograms, 1e-10, 1e-20)
+                histograms = self.apply_blinder(main_ax, stack.blinder, histograms, 1e-10, 1e-20)
 
             # Set the x-range while we have the histograms
             xrange = (histograms[0].axes[0].edges[0], histograms[0].axes[0].edges[-1])
 
             # Plot the stack
-            mplhep.histplot(histograms, label = labels, ax = main_ax, histtype=stack.bar_type, stack=stack.stack, flow='hint', **styles)
+            if self.settings.renderer == 'fast':
+                fastdraw.histplot(main_ax, histograms, label = labels, histtype=stack.bar_type, stack=stack.stack, flow=True, **styles)
+            else:
+                mplhep.histplot(histograms, label = labels, ax = main_ax, histtype=stack.bar_type, stack=stack.stack, flow='hint', **styles)
 
 
         return max_bin_contents, xrange
@@ -163,12 +191,12 @@ class CoffeaPlot(object):
             labels = [l+rf' ( {histograms[i].values()[0]*100:.1f} $\pm$ {histograms[i].variances()[0]*100:.1f} %)' for i, l in enumerate(labels)]
 
             if len(vals) > 4:
-                patches, texts = plt.pie(vals, colors=colors, startangle=90, wedgeprops={'linewidth': 3.0, 'edgecolor': 'white'})
+                patches, texts = main_ax.pie(vals, colors=colors, startangle=90, wedgeprops={'linewidth': 3.0, 'edgecolor': 'white'})
             else:
-                patches, texts = plt.pie(vals, labels=labels, colors=colors, startangle=90, wedgeprops={'linewidth': 3.0, 'edgecolor': 'white'}, labeldistance=1.05)
+                patches, texts = main_ax.pie(vals, labels=labels, colors=colors, startangle=90, wedgeprops={'linewidth': 3.0, 'edgecolor': 'white'}, labeldistance=1.05)
 
-            plt.axis('equal')
-            plt.legend(patches, labels, loc=self.settings.main.legendloc, fontsize=self.settings.main.legendfontsize)
+            main_ax.axis('equal')
+            main_ax.legend(patches, labels, loc=self.settings.main.legendloc, fontsize=self.settings.main.legendfontsize)
 
 
     def decorate_1d_canvas(self, main_ax, max_bin_contents, xrange):
@@ -244,8 +272,7 @@ class CoffeaPlot(object):
 
             # Normalise numerators and denominators if the main plot is normalised
             if self.settings.main.ynorm:
-                ratio_item.numerator.h   *= 1/ratio_item.numerator.h.values().sum()
-                ratio_item.denominator.h *= 1/ratio_item.denominator.h.values().sum()
+                ratio_item = ratio_item.normalised()
 
             # Get the bin centers edges and widths for the ratio plot
             bin_centers = ratio_item.numerator.h.axes[0].centers
@@ -256,15 +283,17 @@ class CoffeaPlot(object):
             ratio_vals = ratio_item.get_ratio_vals()
             ratio_err  = ratio_item.err()
 
-            # If the stack needs to blinded, shade the blinded bins and set the bin contents to 0
+            # If the stack needs to blinded, shade the blinded bins and set the ratio to 0
             if ratio_plot.blinder is not None:
-                self.apply_blinder(ratio_ax, ratio_plot.blinder, [ratio_item.numerator.h], 0, 1e-20)
-                ratio_vals = ratio_item.get_ratio_vals()
+                self.shade_blinded_bins(ratio_ax, blinded_bins, bin_edges)
+                ratio_vals[blinded_bins] = 0
 
             if self.settings.ratio.yrange is not None:
                 uplim = self.settings.ratio.yrange[1]
                 lowlim = self.settings.ratio.yrange[0]
 
+                # Arrows pointing to the ratios out of the y-axis range
+                arrows_x, arrows_tail, arrows_head = [], [], []
                 for i, binval in enumerate(ratio_vals):
                     if lowlim is not None and binval < lowlim:
                         if lowlim > 0:   sign = 1
@@ -273,7 +302,7 @@ class CoffeaPlot(object):
                         if i in blinded_bins:
                             continue
 
-                        ratio_ax.annotate("", xytext=(bin_centers[i], lowlim*(1+sign*0.1)), xy=(bin_centers[i], lowlim), arrowprops=dict(arrowstyle="->", color='blue', linewidth=3))
+                        arrows_x.append(bin_centers[i]); arrows_tail.append(lowlim*(1+sign*0.1)); arrows_head.append(lowlim)
 
                     if uplim is not None and binval > uplim:
                         if uplim > 0:   sign = -1
@@ -282,17 +311,29 @@ class CoffeaPlot(object):
                         if i in blinded_bins:
                             continue
 
-                        ratio_ax.annotate("", xytext=(bin_centers[i], uplim*(1+sign*0.1)), xy=(bin_centers[i], uplim), arrowprops=dict(arrowstyle="->", color='blue', linewidth=3))
+                        arrows_x.append(bin_centers[i]); arrows_tail.append(uplim*(1+sign*0.1)); arrows_head.append(uplim)
+
+                if self.settings.renderer == 'fast':
+                    fastdraw.arrows(ratio_ax, arrows_x, arrows_tail, arrows_head, color='blue', linewidth=3)
+                else:
+                    for x, tail, head in zip(arrows_x, arrows_tail, arrows_head):
+                        ratio_ax.annotate("", xytext=(x, tail), xy=(x, head), arrowprops=dict(arrowstyle="->", color='blue', linewidth=3))
 
             # Plot the ratio and error bars
-            mplhep.histplot(ratio_vals, bins=bin_edges, yerr=ratio_err, label = ratio_item.label, ax = ratio_ax, histtype=ratio_plot.bar_type, stack=ratio_plot.stack, **ratio_item.styling)
+            if self.settings.renderer == 'fast':
+                fastdraw.histplot(ratio_ax, [ratio_vals], edges=bin_edges, yerr=[ratio_err], label = ratio_item.label, histtype=ratio_plot.bar_type, stack=ratio_plot.stack, **ratio_item.styling)
+            else:
+                mplhep.histplot(ratio_vals, bins=bin_edges, yerr=ratio_err, label = ratio_item.label, ax = ratio_ax, histtype=ratio_plot.bar_type, stack=ratio_plot.stack, **ratio_item.styling)
 
             # If this is a DataMC plot, add a relative MC uncertainty band
             if isinstance(ratio_item, DataOverMC):
                 # Get the uncertainty band
                 mc_err = ratio_item.mc_err()
                 # Plot the uncertainty band
-                ratio_ax.bar(bin_centers, 2*mc_err, width= bin_widths, bottom=(1.0-mc_err), fill=False, linewidth=0, edgecolor="gray", hatch=3 * "/",)
+                if self.settings.renderer == 'fast':
+                    fastdraw.bars(ratio_ax, bin_edges[:-1], bin_edges[1:], 1.0-mc_err, 1.0+mc_err, facecolors='none', linewidths=0, edgecolors="gray", hatch=3 * "/")
+                else:
+                    ratio_ax.bar(bin_centers, 2*mc_err, width= bin_widths, bottom=(1.0-mc_err), fill=False, linewidth=0, edgecolor="gray", hatch=3 * "/",)
 
 
     def decorate_ratio_canvases(self, ratio_plot, ratio_ax, last_canvas):
@@ -337,6 +378,9 @@ class CoffeaPlot(object):
 
         histogram = self.stacks[0].stackatinos[0].sum.h
         plot = mplhep.hist2dplot(histogram, label = self.stacks[0].stackatinos[0].label, ax = main_ax, cbar=False, cmap=plt.colormaps[self.settings.colormap], **self.stacks[0].stackatinos[0].styling)
+        # One image instead of a vector patch per bin, the resolution is set when saving
+        if self.settings.rasterize:
+            plot[0].set_rasterized(True)
         if self.settings.colorbarpos in ['bottom', 'top']:
             fig.colorbar(mappable=plot[0], orientation='horizontal')
         elif self.settings.colorbarpos in ['left', 'right']:
@@ -356,7 +400,7 @@ class CoffeaPlot(object):
                 main_ax.axhline(y=nice_y, color=self.settings.vhlinecolors, linewidth=self.settings.vhlinewidths)
 
 
-    def plot(self, outpath, plot_type='MPLUSR'):
+    def plot(self, outpath, plot_type='MPLUSR', writer=None):
 
         fig, main_ax, rat_axes = self.make_figure()
 
@@ -379,17 +423,105 @@ class CoffeaPlot(object):
         if plot_type == '2D':
             self.plot_2d_canvas(main_ax, fig)
 
-        if plot_type != '2D':
-            filename = self.stacks[0].plotid.variable + '__' + self.stacks[0].plotid.region + '__' + self.stacks[0].plotid.rescale
+        filename = self.stacks[0].plotid.filename(plot_type)
+        # Writers can collect plots in other ways than one file per plot
+        if writer is None:
+            self.save(fig, outpath, filename)
         else:
-            filename = self.stacks[0].plotid.variable + '__' + self.stacks[0].plotid.region + '__' + self.stacks[0].plotid.sample + '__' + self.stacks[0].plotid.rescale
-        plt.savefig(f"{outpath}/{filename}.pdf", bbox_inches='tight')
-        plt.close('all')
+            writer.write(self, fig, outpath, filename)
+
+    def tight_bbox(self, fig):
+        return fig.get_tightbbox().padded(plt.rcParams['savefig.pad_inches'])
+
+    def save(self, fig, outpath, filename, formats=None):
+        for fmt, options in self.save_options(fig, formats):
+            fig.savefig(f"{outpath}/{filename}.{fmt}", **options)
+
+    def save_options(self, fig, formats=None):
+        '''
+        The format and savefig keyword arguments of each file the figure is saved to
+        '''
+        if self.settings.draft:
+            # No tight bounding box, it needs a full extra draw of the figure
+            return [('png', {'dpi': self.settings.draftdpi})]
+
+        if formats is None:
+            formats = self.settings.output_formats()
+
+        # Compute the tight bounding box once and save all formats with it,
+        # instead of letting savefig redraw the figure to find it for each format.
+        # A single format has nothing to share, savefig finds the box for it as it did
+        bbox = self.tight_bbox(fig) if len(formats) > 1 else 'tight'
+        options = []
+        for fmt in formats:
+            options.append((fmt, {'bbox_inches': bbox}))
+            # Resolution of the rasterized parts of vector formats, PNGs keep the figure dpi
+            if fmt != 'png' and getattr(self.settings, 'rasterize', False):
+                options[-1][1]['dpi'] = self.settings.rasterdpi
+        return options
 
 
 class PieChart(CoffeaPlot):
     pass
 
+class FigurePool(object):
+    '''
+    Setting up a figure with its gridspec and styled axes is a large part of the
+    time spent on a plot. Figures are therefore kept per layout (figure size and
+    height ratios of the panels) and their axes are cleared to draw the next plot
+    with the same layout.
+    '''
+    def __init__(self):
+        self.figures = {}
+
+    def get(self, figuresize, height_ratios):
+        key = (tuple(figuresize), len(height_ratios), tuple(height_ratios))
+        if key not in self.figures:
+            self.figures[key] = self.new_figure(figuresize, height_ratios)
+        else:
+            self.reset(*self.figures[key])
+
+        fig, axes, _ = self.figures[key]
+        return fig, axes[0], axes[1:]
+
+    def new_figure(self, figuresize, height_ratios):
+        setup_style()
+        fig    = plt.figure(figsize=figuresize)
+        nrows  = len(height_ratios)
+        gs     = fig.add_gridspec(ncols=1, nrows=nrows, height_ratios=height_ratios, hspace=0.2)
+        main_ax     = fig.add_subplot(gs[0, 0])
+        axes = [main_ax]
+        for i in range(nrows-1):
+            rat_ax = fig.add_subplot(gs[i+1, 0], sharex=main_ax)
+            axes.append(rat_ax)
+
+        return fig, axes, [ax.get_subplotspec() for ax in axes]
+
+    def reset(self, fig, axes, subplotspecs):
+        # Remove axes added while plotting, e.g. colorbars
+        for ax in fig.axes:
+            if ax not in axes:
+                ax.remove()
+        # Colorbars shrink the axes they are attached to, so put the axes back in place
+        for ax, subplotspec in zip(axes, subplotspecs):
+            ax.set_subplotspec(subplotspec)
+            ax.clear()
+            # clear() keeps the aspect and frame, which pie charts change
+            ax.set_aspect('auto', adjustable='box')
+            ax.set_frame_on(True)
+            # clear() also keeps the data limits of axes sharing x, the ratio axes would
+            # then be autoscaled to the data of the previous plots as well
+            ax.dataLim.set(Bbox.null())
+            ax.ignore_existing_data_limits = True
+            ax.set_autoscale_on(True)
+
+    def close(self):
+        for fig, _, _ in self.figures.values():
+            plt.close(fig)
+        self.figures = {}
+
+figure_pool = FigurePool()
+
 class StylableObject(object):
 
     VALID_STYLE_SETTINGS = ["facecolor", "linestyle", "linewidth", "color", "edgecolor", "markersize", "marker", "fill", "alpha", "hatch"]
@@ -490,6 +622,15 @@ class RatioItem(StylableObject):
 
         StylableObject.__init__(self, **styling)
 
+    def normalised(self):
+        '''
+        Copy of this ratio item with the numerator and denominator normalised to unity
+        '''
+        normalised = copy(self)
+        normalised.numerator   = self.numerator.scaled(1/self.numerator.h.values().sum())
+        normalised.denominator = self.denominator.scaled(1/self.denominator.h.values().sum())
+        return normalised
+
     def get_ratio_vals(self):
         numerator_vals = self.numerator.values()
         denominator_vals = self.denominator.values()
@@ -693,6 +834,7 @@ class PlotterSettings(object):
         self.total_mc_histo = None
         self.category_to_sample_histos= None
         self.region_targets_histos = None
+        self.aggregates = None
 
 
         self.mc_stack = None
@@ -715,4 +857,10 @@ class PlotIdentifier(object):
         self.variable_obj = plottersettings.variable
         self.region_obj   = plottersettings.region
         self.rescale_obj  = plottersettings.rescale
-        self.sample_obj   = plottersettings.sample
\ No newline at end of file
+        self.sample_obj   = plottersettings.sample
+
+    def filename(self, plot_type='MPLUSR'):
+        if plot_type != '2D':
+            return self.variable + '__' + self.region + '__' + self.rescale
+        else:
+            return self.variable + '__' + self.region + '__' + self.sample + '__' + self.rescale
@@ -0,0 +1,159 @@
+
+import hashlib
+import json
+import os
+import types
+
+import hist
+import numpy as np
+import matplotlib
+import mplhep
+
+import logging
+log = logging.getLogger(__name__)
+
+MANIFEST = '.plotcache.json'
+
+def _code_salt():
+    '''
+    Anything that changes how plots are drawn without changing their inputs must
+    invalidate the cache too, so the plotting code and library versions go in every hash.
+    '''
+    salt = hashlib.sha256()
+    salt.update(f'matplotlib={matplotlib.__version__};mplhep={mplhep.__version__};'.encode())
+    plotdir = os.path.dirname(os.path.abspath(__file__))
+    for source in ['PlotClasses.py', 'plotter.py', 'fastdraw.py']:
+        with open(f'{plotdir}/{source}', 'rb') as f:
+            salt.update(f.read())
+    return salt.digest()
+
+_CODE_SALT = None
+
+def fingerprint(*objs):
+    '''
+    Deterministic hash of plot objects: histogram contents and edges, stacks,
+    ratio plots and plot settings. Two runs with the same inputs and settings give
+    the same hash, regardless of object identities or dictionary ordering.
+    '''
+    global _CODE_SALT
+    if _CODE_SALT is None:
+        _CODE_SALT = _code_salt()
+
+    hasher = hashlib.sha256(_CODE_SALT)
+    memo = {}
+    for obj in objs:
+        hasher.update(_digest(obj, memo, set()))
+    return hasher.hexdigest()
+
+def _cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        # The variable of the closure is not assigned yet
+        return None
+
+def _digest(obj, memo, active):
+
+    # Objects shared between stacks and ratio plots are only hashed once
+    key = id(obj)
+    if key in memo:
+        return memo[key][1]
+    # Back-references (e.g. a variable pointing to its container) end the recursion
+    if key in active:
+        return b'<cycle>'
+
+    h = hashlib.sha256(type(obj).__qualname__.encode())
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        h.update(repr(obj).encode())
+        return h.digest()
+
+    if isinstance(obj, (np.ndarray, np.generic)):
+        arr = np.ascontiguousarray(obj)
+        h.update(str(arr.dtype).encode())
+        h.update(str(arr.shape).encode())
+        h.update(arr.tobytes())
+        return h.digest()
+
+    active.add(key)
+
+    if isinstance(obj, hist.Hist):
+        h.update(repr(obj.storage_type).encode())
+        h.update(_digest(obj.label, memo, active))
+        for axis in obj.axes:
+            h.update(_digest([axis.name, axis.label, axis.traits.underflow, axis.traits.overflow, np.asarray(axis.edges)], memo, active))
+        h.update(_digest(np.asarray(obj.view(flow=True)), memo, active))
+
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            h.update(_digest(item, memo, active))
+
+    elif isinstance(obj, (set, frozenset)):
+        for item in sorted(_digest(item, memo, active) for item in obj):
+            h.update(item)
+
+    elif isinstance(obj, dict):
+        for item in sorted(_digest(k, memo, active) + _digest(v, memo, active) for k, v in obj.items()):
+            h.update(item)
+
+    elif isinstance(obj, (types.FunctionType, types.MethodType, types.BuiltinFunctionType)):
+        # Functions are identified by name, bytecode and the values they were made with,
+        # their repr holds a memory address
+        h.update(f'{getattr(obj, "__module__", "")}.{obj.__qualname__}'.encode())
+        code = getattr(obj, '__code__', None)
+        if code is not None:
+            h.update(code.co_code)
+            h.update(_digest([c for c in code.co_consts if not isinstance(c, types.CodeType)], memo, active))
+            h.update(_digest([_cell_contents(cell) for cell in (obj.__closure__ or ())], memo, active))
+            h.update(_digest([obj.__defaults__, obj.__kwdefaults__], memo, active))
+
+    elif hasattr(obj, '__dict__'):
+        h.update(_digest(vars(obj), memo, active))
+
+    else:
+        h.update(repr(obj).encode())
+
+    active.discard(key)
+    # Keep a reference to the object so that its id can't be reused by a temporary
+    memo[key] = (obj, h.digest())
+    return memo[key][1]
+
+
+class PlotCache(object):
+    '''
+    Keeps track of the hash of the inputs of each plot, with one manifest
+    per output directory. A plot is only re-drawn if its hash changed or if
+    any of the files it was saved to is gone.
+    '''
+    def __init__(self):
+        self.manifests = {}
+        self.skipped = 0
+
+    def manifest(self, outpath):
+        if outpath not in self.manifests:
+            manifest_path = f'{outpath}/{MANIFEST}'
+            manifest = {}
+            if os.path.exists(manifest_path):
+                try:
+                    with open(manifest_path, 'r') as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError):
+                    log.warning(f"Could not read plot cache {manifest_path}, all plots in {outpath} will be re-drawn")
+            self.manifests[outpath] = manifest
+        return self.manifests[outpath]
+
+    def is_fresh(self, outpath, filename, key, files):
+        if self.manifest(outpath).get(filename) != key:
+            return False
+        if not all(os.path.exists(f'{outpath}/{file}') for file in files):
+            return False
+        self.skipped += 1
+        return True
+
+    def record(self, outpath, filename, key):
+        self.manifest(outpath)[filename] = key
+
+    def save(self):
+        for outpath, manifest in self.manifests.items():
+            with open(f'{outpath}/{MANIFEST}', 'w') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
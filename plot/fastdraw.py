@@ -0,0 +1,296 @@
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.patches as mpl_patches
+from matplotlib.collections import PolyCollection, LineCollection
+from matplotlib.container import ErrorbarContainer
+from matplotlib.colors import to_rgba
+from matplotlib.lines import Line2D
+from matplotlib.markers import MarkerStyle
+from matplotlib.path import Path
+
+import logging
+log = logging.getLogger(__name__)
+
+# ==================================================================== #
+# Drawing helpers for the 'fast' renderer. They draw the same things as
+# mplhep.histplot, axvspan and annotate in CoffeaPlot, but each stack,
+# set of error bars, blinded bands or out-of-range arrows is a single
+# collection, rather than one matplotlib artist per item or per bin.
+# ==================================================================== #
+
+def _chunk_styles(styles, n):
+    '''
+    Split mplhep-like keyword arguments into one dict per item, lists with
+    one entry per item are spread over the items, anything else is shared
+    '''
+    chunks = [{} for _ in range(n)]
+    for key, value in styles.items():
+        if isinstance(value, list) and len(value) == n:
+            for chunk, item_value in zip(chunks, value):
+                chunk[key] = item_value
+        else:
+            for chunk in chunks:
+                chunk[key] = value
+    return chunks
+
+def _errors(values, variances):
+    '''
+    Down and up errors as mplhep computes them: Poisson intervals for integer
+    variances (unweighted data), sqrt of the variances otherwise
+    '''
+    if variances is None:
+        variances = values
+    if np.allclose(variances, 0):
+        return np.zeros_like(values), np.zeros_like(values)
+    if np.allclose(variances, np.around(variances)):
+        try:
+            from mplhep.error_estimation import poisson_interval
+            low, high = poisson_interval(values, variances)
+        except ImportError:
+            low, high = values - np.sqrt(variances), values + np.sqrt(variances)
+    else:
+        low, high = values - np.sqrt(variances), values + np.sqrt(variances)
+    return np.nan_to_num(np.abs(values - low), nan=0), np.nan_to_num(np.abs(high - values), nan=0)
+
+def _steps(edges, values):
+    # x and y of the top of the bins, drawn as a staircase
+    return np.repeat(edges, 2)[1:-1], np.repeat(values, 2)
+
+def _aligned_marker(marker, halign):
+    '''
+    Marker with its left or right edge, rather than its center, on the point it marks
+    '''
+    style = MarkerStyle(marker)
+    path = style.get_path().transformed(style.get_transform())
+    xmin, _, xmax, _ = path.get_extents().extents
+    shift = -xmax if halign == 'right' else -xmin
+    return Path(path.vertices + [shift, 0], path.codes)
+
+class _PatchProxy(mpl_patches.Rectangle):
+    # Legend entry of one item of a collection, never drawn itself
+    def draw(self, renderer):
+        pass
+
+class _LineProxy(Line2D):
+    # Legend entry of one item of a collection, never drawn itself
+    def draw(self, renderer):
+        pass
+
+def _add_legend_proxy(ax, proxy):
+    '''
+    Collections hold several items but get one legend entry, so each item gets
+    a proxy artist. Proxies are added to the axes where mplhep would have drawn
+    the item, so that the legend keeps the same order, but they draw nothing and
+    are left out of the layout. Errorbar proxies are containers, as in mplhep.
+    '''
+    if proxy.get_label() in [None, ''] or proxy.get_label().startswith('_'):
+        return
+    if isinstance(proxy, ErrorbarContainer):
+        ax.add_container(proxy)
+    else:
+        proxy.set_in_layout(False)
+        ax.add_artist(proxy)
+
+def histplot(ax, histograms, edges=None, yerr=None, label=None, histtype='step', stack=False, flow=False, **styles):
+    '''
+    Draw a list of histograms like mplhep.histplot does, with histtype one of
+    'fill', 'step' or 'errorbar'. Histograms can be hist objects, or arrays of
+    bin contents with the bin edges given separately. When yerr is given, it
+    holds one array of symmetric errors per histogram.
+
+    With flow=True, markers on the x-axis hint at under- and overflow in the
+    last histogram, as mplhep does.
+    '''
+    n = len(histograms)
+    labels = label if isinstance(label, list) else [label]*n
+    chunks = _chunk_styles(styles, n)
+
+    if edges is None:
+        edges = histograms[0].axes[0].edges
+    edges = np.asarray(edges, dtype=float)
+    centers = (edges[1:] + edges[:-1])/2
+
+    # ==================== Bin contents and errors ==================== #
+    values, variances = [], []
+    for histogram in histograms:
+        if hasattr(histogram, 'values'):
+            values.append(np.nan_to_num(histogram.values()))
+            variances.append(histogram.variances())
+        else:
+            values.append(np.nan_to_num(np.asarray(histogram, dtype=float)))
+            variances.append(None)
+
+    tops = np.cumsum(values, axis=0) if stack else np.array(values)
+    bottoms = np.vstack([np.zeros_like(tops[0]), tops[:-1]]) if stack else np.zeros_like(tops)
+
+    # Errors of stacked histograms are those of the running sum, as in mplhep
+    errors, total_variance = [], None
+    for i in range(n):
+        own_variance = values[i] if variances[i] is None else np.nan_to_num(variances[i])
+        total_variance = own_variance if total_variance is None or not stack else total_variance + own_variance
+        if yerr is not None:
+            errors.append((yerr[i], yerr[i]))
+        elif histtype == 'fill':
+            errors.append(None)
+        elif np.allclose(own_variance, 0):
+            errors.append((np.zeros_like(tops[i]), np.zeros_like(tops[i])))
+        else:
+            errors.append(_errors(tops[i], total_variance))
+
+    # mplhep draws stacks from the top down, so that the legend follows the stack
+    order = list(range(n))[::-1] if stack else list(range(n))
+
+    # ==================== Draw ==================== #
+    if histtype == 'fill':
+        artist = _fill(ax, edges, [tops[i] for i in order], [bottoms[i] for i in order], [labels[i] for i in order], [chunks[i] for i in order])
+    elif histtype == 'step':
+        artist = _step(ax, edges, centers, [tops[i] for i in order], [errors[i] for i in order], [labels[i] for i in order], [chunks[i] for i in order])
+    elif histtype == 'errorbar':
+        for i in order:
+            options = {'linestyle': 'none', 'marker': '.', 'elinewidth': 1, **chunks[i]}
+            artist = ax.errorbar(centers, tops[i], yerr=np.array(errors[i]), label=labels[i], **options)[0]
+    else:
+        raise NotImplementedError(f"Unsupported histogram type for the fast renderer: {histtype}")
+
+    # Same autoscaling as mplhep, y-axis starts at 0 if nothing is below
+    artist.sticky_edges.y.append(0)
+
+    if flow and hasattr(histograms[-1], 'values'):
+        _flow_hints(ax, histograms[-1], edges)
+
+    return artist
+
+def _fill(ax, edges, tops, bottoms, labels, chunks):
+    '''
+    One polygon per item, from its bottom to its top, in one collection per hatch style
+    '''
+    verts = []
+    for top, bottom in zip(tops, bottoms):
+        x, y_top = _steps(edges, top)
+        _, y_bottom = _steps(edges, bottom)
+        verts.append(np.column_stack([np.concatenate([x, x[::-1]]), np.concatenate([y_top, y_bottom[::-1]])]))
+
+    # Collections can't have one hatch per polygon, so items with different hatches are split
+    collection, groups = None, []
+    for i, chunk in enumerate(chunks):
+        if groups != [] and groups[-1][0] == chunk.get('hatch'):
+            groups[-1][1].append(i)
+        else:
+            groups.append((chunk.get('hatch'), [i]))
+
+    for hatch, indices in groups:
+        facecolors, edgecolors, linewidths, linestyles = [], [], [], []
+        for i in indices:
+            chunk = chunks[i]
+            color = chunk.get('color', f'C{i}')
+            facecolor = to_rgba(chunk.get('facecolor', color), chunk.get('alpha'))
+            # Like filled stairs, color only sets the face, there is no edge unless one is asked for
+            edgecolor = to_rgba(chunk['edgecolor'], chunk.get('alpha')) if chunk.get('edgecolor') is not None else 'none'
+            facecolors.append(facecolor)
+            edgecolors.append(edgecolor)
+            linewidths.append(chunk.get('linewidth', plt.rcParams['patch.linewidth']))
+            linestyles.append(chunk.get('linestyle', 'solid'))
+
+            _add_legend_proxy(ax, _PatchProxy((0, 0), 1, 1, facecolor=facecolor, edgecolor=edgecolor, linewidth=linewidths[-1],
+                                            linestyle=linestyles[-1], hatch=hatch, label=labels[i]))
+
+        collection = PolyCollection([verts[i] for i in indices], facecolors=facecolors, edgecolors=edgecolors, linewidths=linewidths,
+                                    linestyles=linestyles, hatch=hatch, zorder=1)
+        ax.add_collection(collection)
+
+    return collection
+
+def _step(ax, edges, centers, tops, errors, labels, chunks):
+    '''
+    Outlines of all items as one collection of lines, and their error bars as another
+    '''
+    outlines, bars = [], []
+    colors, linewidths, linestyles, bar_colors, bar_linewidths = [], [], [], [], []
+    for i, (top, error, chunk) in enumerate(zip(tops, errors, chunks)):
+        x, y = _steps(edges, top)
+        # Outlines go down to 0 at both ends, like mplhep steps
+        outlines.append(np.column_stack([np.r_[edges[0], x, edges[-1]], np.r_[0, y, 0]]))
+        color = to_rgba(chunk.get('color', f'C{i}'), chunk.get('alpha'))
+        linewidth = chunk.get('linewidth', 1.5)
+        linestyle = chunk.get('linestyle', 'solid')
+        colors.append(color)
+        linewidths.append(linewidth)
+        linestyles.append(linestyle)
+
+        if error is None:
+            _add_legend_proxy(ax, _LineProxy([], [], color=color, linewidth=linewidth, linestyle=linestyle, label=labels[i]))
+            continue
+
+        down, up = error
+        bars.append(np.stack([np.column_stack([centers, top - down]), np.column_stack([centers, top + up])], axis=1))
+        bar_colors += [color]*len(centers)
+        bar_linewidths += [linewidth]*len(centers)
+
+        # Same legend entry as the errorbars mplhep draws for histograms with errors
+        bar = LineCollection([], colors=[color], linewidths=[linewidth])
+        line = Line2D([], [], color=color, linestyle=linestyle)
+        _add_legend_proxy(ax, ErrorbarContainer((line, (), (bar,)), has_xerr=False, has_yerr=True, label=labels[i]))
+
+    collection = LineCollection(outlines, colors=colors, linewidths=linewidths, linestyles=linestyles, zorder=1)
+    ax.add_collection(collection)
+    if bars != []:
+        ax.add_collection(LineCollection(np.concatenate(bars), colors=bar_colors, linewidths=bar_linewidths, zorder=2))
+
+    return collection
+
+def _flow_hints(ax, histogram, edges):
+
+    traits = histogram.axes[0].traits
+    values = histogram.values(flow=True)
+    x, markers = [], []
+    if traits.underflow and values[0] != 0:
+        x.append(edges[0])
+        markers.append(_aligned_marker('<', 'right'))
+    if traits.overflow and values[-1] != 0:
+        x.append(edges[-1])
+        markers.append(_aligned_marker('>', 'left'))
+
+    size = 30*ax.get_window_extent().transformed(ax.figure.dpi_scale_trans.inverted()).width
+    for xpos, marker in zip(x, markers):
+        ax.scatter(xpos, 0, size, marker=marker, edgecolor='black', facecolor='white', zorder=5, clip_on=False, transform=ax.get_xaxis_transform())
+
+def shade_bins(ax, lows, highs, label=None):
+    '''
+    Blue band with a grey hatch over each (low, high) x-range, spanning the
+    full height of the axes. The hatch carries the legend entry.
+    '''
+    if len(lows) == 0:
+        return
+    verts = [[(low, 0), (low, 1), (high, 1), (high, 0)] for low, high in zip(lows, highs)]
+    transform = ax.get_xaxis_transform()
+    ax.add_collection(PolyCollection(verts, facecolors=to_rgba('blue', 0.06), edgecolors=to_rgba('blue', 0.06), linewidths=0, transform=transform), autolim=False)
+    ax.add_collection(PolyCollection(verts, facecolors='none', edgecolors=to_rgba('grey', 0.5), linewidths=0, hatch='//', transform=transform, label=label), autolim=False)
+
+def bars(ax, lefts, rights, bottoms, tops, **styles):
+    '''
+    Rectangles spanning [left, right] x [bottom, top] in data coordinates, as one collection
+    '''
+    verts = [[(left, bottom), (left, top), (right, top), (right, bottom)] for left, right, bottom, top in zip(lefts, rights, bottoms, tops)]
+    collection = PolyCollection(verts, **styles)
+    ax.add_collection(collection)
+    return collection
+
+def arrows(ax, x, tails, heads, color='blue', linewidth=3):
+    '''
+    Vertical arrows from tails to heads, drawn as one collection of lines and
+    one scatter of open arrow heads per direction
+    '''
+    x, tails, heads = np.asarray(x), np.asarray(tails), np.asarray(heads)
+    if len(x) == 0:
+        return
+    ax.add_collection(LineCollection(np.stack([np.column_stack([x, tails]), np.column_stack([x, heads])], axis=1), colors=color, linewidths=linewidth, zorder=3), autolim=False)
+
+    # Open arrow heads with the tip on the point, about as big as those of annotate.
+    # Both are drawn above the histograms, like annotations
+    for pointing_up, tip in [(True, [(-0.5, -1), (0, 0), (0.5, -1)]), (False, [(-0.5, 1), (0, 0), (0.5, 1)])]:
+        mask = (heads > tails) if pointing_up else (heads <= tails)
+        if not mask.any():
+            continue
+        marker = Path(tip, [Path.MOVETO, Path.LINETO, Path.LINETO])
+        ax.scatter(x[mask], heads[mask], s=24**2, marker=marker, facecolors='none', edgecolors=color, linewidths=linewidth, zorder=3)
@@ -1,19 +1,24 @@
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from copy import copy, deepcopy
-import os, re
+import os
 import numpy as np
+import cloudpickle
 import logging
 log = logging.getLogger(__name__)
 
-from plot.PlotClasses import PlotterSettings, CoffeaPlot, Stack, Stackatino, RatioPlot, RatioItem, DataOverMC, Significance, Blinder, PieStack
+from plot.PlotClasses import PlotterSettings, PlotIdentifier, CoffeaPlot, Stack, Stackatino, RatioPlot, RatioItem, DataOverMC, Significance, Blinder, PieStack, figure_pool
+from plot.cache import PlotCache, fingerprint
+from plot.writers import MultiPagePDFWriter, AsyncFigureWriter
 from util.utils import compute_total_separation
 from containers.variables import Eff
+from containers.histograms import HistogramAggregates
 
 def sort_samples(histograms, samples_list, PlotSettings, rebin = None):
 
     region, rescale, variable = PlotSettings.region, PlotSettings.rescale, PlotSettings.variable
-    region_targets_names = region.targets
+    region_targets_names = samples_list.selected_names(region.targets, unpack = True)
     variable_label = variable.label
     # ============== Declare categories ============== #
     category_to_samples = defaultdict(list)
@@ -22,7 +27,7 @@ def sort_samples(histograms, samples_list, PlotSettings, rebin = None):
     refMC = None
 
     # ============== Loop over subsamples ============== #
-    for sample in samples_list:
+    for sample in samples_list.unpacked():
 
         # =========== Categorise MC according to config =========== #
         if sample.type != 'DATA':
@@ -43,7 +48,7 @@ def sort_samples(histograms, samples_list, PlotSettings, rebin = None):
                 category_to_samples[sample.label].append(category_histogram)
 
         # ============== Target samples for this region ============== #
-        if any(re.match(region_target_name, sample.name) for region_target_name in region_targets_names):
+        if sample.name in region_targets_names:
             log.debug(f"Adding sample {sample.name} to region {region.name} targets")
             region_target_histogram = histograms[(variable.name, sample.name, region.name, rescale.name)]
             region_target_histogram.label = variable_label
@@ -122,9 +127,13 @@ def sort_samples(histograms, samples_list, PlotSettings, rebin = None):
             data.rebin(rebin)
     PlotSettings.data_histo = data
 
+    # ============== Sums of MC histograms, shared by all plots of this key ============== #
+    aggregates = HistogramAggregates(backgrounds, signals)
+    PlotSettings.aggregates = aggregates
+
     # ============== Backgrounds Histo ============== #
     if backgrounds != []:
-        tot_backgrounds_histogram = sum(backgrounds)
+        tot_backgrounds_histogram = aggregates.total_backgrounds()
     else:
         tot_backgrounds_histogram = deepcopy(data)
         values = np.full_like(tot_backgrounds_histogram.values(), 1e-6)
@@ -142,7 +151,7 @@ def sort_samples(histograms, samples_list, PlotSettings, rebin = None):
 
     # ============== Signal Histo ============== #
     if signals != []:
-        tot_signals_histogram = sum(signals)
+        tot_signals_histogram = aggregates.total_signals()
     else:
         tot_signals_histogram = deepcopy(data)
         values    = np.full_like(tot_signals_histogram.values(), 1e-6)
@@ -159,9 +168,15 @@ def sort_samples(histograms, samples_list, PlotSettings, rebin = None):
     PlotSettings.tot_signals_histo = tot_signals_histogram
 
     # ============== Total Histo ============== #
-    total_histogram =  histograms[(variable.name, 'total', region.name, rescale.name)]
-    if rebin is not None:
-        total_histogram.rebin(rebin)
+    # Same sum as the processor's 'total' histogram, taken from the shared aggregates.
+    # Efficiencies of the samples do not add up to the efficiency of their sum, which
+    # the processor makes from the summed numerators and denominators
+    total_histogram = aggregates.total_mc() if not isinstance(variable, Eff) else None
+    if total_histogram is None:
+        total_histogram = histograms[(variable.name, 'total', region.name, rescale.name)]
+        if rebin is not None:
+            total_histogram.rebin(rebin)
+    total_histogram.sample = 'total'
     total_histogram.label = variable_label
     total_histogram.stylish_sample = 'Total'
     total_histogram.stylish_region = region.label
@@ -179,20 +194,24 @@ def sort_samples(histograms, samples_list, PlotSettings, rebin = None):
     PlotSettings.category_to_samples_histos = category_to_samples
 
 
-def prepare_1d_plots(histograms, tree, CoffeaPlotSettings):
+def needed_plot_objects(plot_types):
+    '''
+    PlotterSettings attributes (stacks, ratio plots) needed to draw the given plot types
+    '''
+    return {attr for plot_type in plot_types for attr in PLOT_MAKERS[plot_type][3]}
 
+def prepare_1d_plots(histograms, tree, CoffeaPlotSettings):
+    '''
+    Generator of the PlotterSettings of each 1D plot. Plot objects are only built
+    for the plot types that were asked for, and one plot is prepared at a time so
+    that it can be released once it is drawn.
+    '''
     if not any(variable.dim == 1 for variable in CoffeaPlotSettings.variables_list):
         return
 
-    # ====== Loop over 1D plots ====== #
-    plot_settings_list = []
+    needs = needed_plot_objects([plot_type for plot_type in PLOT_MAKERS if plot_type != '2D' and plot_type in CoffeaPlotSettings.makeplots])
 
-    unpacked_samples = []
-    for sample in CoffeaPlotSettings.samples_list:
-        if sample.is_super:
-            unpacked_samples.extend(sample.subsamples)
-        else:
-            unpacked_samples.append(sample)
+    unpacked_samples = CoffeaPlotSettings.samples_list.unpacked()
 
 
     if all(s.type != 'DATA' for s in unpacked_samples):
@@ -208,12 +227,15 @@ def prepare_1d_plots(histograms, tree, CoffeaPlotSettings):
         if variable.dim  != 1:    continue
         if variable.name in dont_double_count:  continue
         if variable.type == 'GHOST': continue
+        if not CoffeaPlotSettings.is_selected('variables', variable.name): continue
 
         log.debug(f"Setting up variable {variable.name}")
         for region in CoffeaPlotSettings.regions_list:
+            if not CoffeaPlotSettings.is_selected('regions', region.name): continue
             log.debug(f"Setting up region {region.name}")
 
             for rescale in CoffeaPlotSettings.rescales_list:
+                if not CoffeaPlotSettings.is_selected('rescales', rescale.name): continue
                 log.debug(f"Setting up rescale {rescale.name}")
 
                 dont_double_count.append(variable.name.replace(':Num', '').replace(':Denom', ''))
@@ -224,69 +246,73 @@ def prepare_1d_plots(histograms, tree, CoffeaPlotSettings):
                 PlotSettings = PlotterSettings(variable, region, rescale )
 
                 # Sort samples and save them to PlotSettings
-                sort_samples(histograms, unpacked_samples, PlotSettings, variable.rebin)
+                sort_samples(histograms, CoffeaPlotSettings.samples_list, PlotSettings, variable.rebin)
 
                 # ================================================ #
                 # ============== Create the blinding box ============== #
                 # ================================================ #
-                blinder = Blinder(PlotSettings.tot_signals_histo, PlotSettings.tot_backgrounds_histo, threshold=CoffeaPlotSettings.blinding)
+                if 'data_stack' in needs or 'data_over_mc_ratio' in needs:
+                    blinder = Blinder(PlotSettings.tot_signals_histo, PlotSettings.tot_backgrounds_histo, threshold=CoffeaPlotSettings.blinding)
 
                 # ================================================ #
                 # ============== Create the MC stack ============== #
                 # ================================================ #
-                mc_stack              = Stack(stackatinos = [], bar_type = 'stepfilled', error_type = 'stat', plottersettings = PlotSettings)
-                log.debug(f"Preparing MC stack")
-                # ============== Make a Stackatino for each category ============== #
-                for category, cat_samples_histograms in PlotSettings.category_to_samples_histos.items():
-                    log.debug(f"Adding sample category:  {category} to stack")
-                    # ============== Create a Stackatino for each category ============== #
-                    # Category color is the color of the first sample in the category
-                    stackatino = Stackatino(histograms=[], label=category, color=cat_samples_histograms[0].color, linewidth=3)
-                    for cat_sample_histogram in cat_samples_histograms:
-                        stackatino.append(cat_sample_histogram)
-                    # Add up all the histograms in the stackatino
-                    stackatino.sum_histograms()
-                    # Add the stackatino to the stack
-                    mc_stack.append(stackatino)
+                if 'mc_stack' in needs:
+                    mc_stack              = Stack(stackatinos = [], bar_type = 'stepfilled', error_type = 'stat', plottersettings = PlotSettings)
+                    log.debug(f"Preparing MC stack")
+                    # ============== Make a Stackatino for each category ============== #
+                    for category, cat_samples_histograms in PlotSettings.category_to_samples_histos.items():
+                        log.debug(f"Adding sample category:  {category} to stack")
+                        # ============== Create a Stackatino for each category ============== #
+                        # Category color is the color of the first sample in the category
+                        stackatino = Stackatino(histograms=[], label=category, color=cat_samples_histograms[0].color, linewidth=3)
+                        for cat_sample_histogram in cat_samples_histograms:
+                            stackatino.append(cat_sample_histogram)
+                        # Add up all the histograms in the stackatino
+                        stackatino.sum_histograms()
+                        # Add the stackatino to the stack
+                        mc_stack.append(stackatino)
 
-                # Append stack to kust of stacks (one per region, rescale, variable)
-                PlotSettings.mc_stack = mc_stack
+                    # Append stack to kust of stacks (one per region, rescale, variable)
+                    PlotSettings.mc_stack = mc_stack
 
                 # ================================================ #
                 # ============== Create the Data stack ============== #
                 # ================================================ #
-                log.debug(f"Preparing Data stack")
-                data_stack = Stack(stackatinos = [], bar_type = 'points', error_type = 'stat', plottersettings = PlotSettings)
-                # ============== Data Stack ==============
-                data_histogram = PlotSettings.data_histo
-                data_stackicino = Stackatino([data_histogram], label = data_histogram.stylish_sample, color = 'black', fill = None, marker='o', markersize=12)
-                data_stackicino.sum_histograms()
-                data_stack.append(data_stackicino)
-                # Apply blinding
-                data_stack.blinder = blinder
-                PlotSettings.data_stack = data_stack
+                if 'data_stack' in needs:
+                    log.debug(f"Preparing Data stack")
+                    data_stack = Stack(stackatinos = [], bar_type = 'points', error_type = 'stat', plottersettings = PlotSettings)
+                    # ============== Data Stack ==============
+                    data_histogram = PlotSettings.data_histo
+                    data_stackicino = Stackatino([data_histogram], label = data_histogram.stylish_sample, color = 'black', fill = None, marker='o', markersize=12)
+                    data_stackicino.sum_histograms()
+                    data_stack.append(data_stackicino)
+                    # Apply blinding
+                    data_stack.blinder = blinder
+                    PlotSettings.data_stack = data_stack
 
                 # ================================================ #
                 # ============== Create the Separation stack ============== #
                 # ================================================ #
-                sep_stack              = Stack(stackatinos = [], bar_type = 'step', error_type = 'stat', plottersettings = PlotSettings)
-                signals_histograms = PlotSettings.signals_histos
-                for signal_histogram in signals_histograms:
-                    signal_stackatino = Stackatino([signal_histogram], label = signal_histogram.stylish_sample, color = signal_histogram.color, fill = None, linewidth=3)
-                    signal_stackatino.sum_histograms()
-                    sep_stack.append(signal_stackatino)
+                if 'sep_stack' in needs:
+                    sep_stack              = Stack(stackatinos = [], bar_type = 'step', error_type = 'stat', plottersettings = PlotSettings)
+                    signals_histograms = PlotSettings.signals_histos
+                    for signal_histogram in signals_histograms:
+                        signal_stackatino = Stackatino([signal_histogram], label = signal_histogram.stylish_sample, color = signal_histogram.color, fill = None, linewidth=3)
+                        signal_stackatino.sum_histograms()
+                        sep_stack.append(signal_stackatino)
 
-                background_histogram = PlotSettings.tot_backgrounds_histo
-                background_stackatino = Stackatino([background_histogram], label = background_histogram.stylish_sample, color = 'black', fill = None, linewidth=3)
-                background_stackatino.sum_histograms()
+                    background_histogram = PlotSettings.tot_backgrounds_histo
+                    background_stackatino = Stackatino([background_histogram], label = background_histogram.stylish_sample, color = 'black', fill = None, linewidth=3)
+                    background_stackatino.sum_histograms()
 
-                sep_stack.append(background_stackatino)
-                PlotSettings.sep_stack = sep_stack
+                    sep_stack.append(background_stackatino)
+                    PlotSettings.sep_stack = sep_stack
 
                 # ================================================ #
                 # ============== Create the Efficiency stack ============== #
                 # ================================================ #
-                if isinstance(variable, Eff):
+                if 'eff_stack' in needs and isinstance(variable, Eff):
                     eff_stack              = Stack(stackatinos = [], bar_type = 'points', error_type = 'stat', plottersettings = PlotSettings)
                     # ============== Make a Stackatino for each category ============== #
                     for category, cat_samples_histograms in PlotSettings.category_to_samples_histos.items():
@@ -303,53 +329,56 @@ def prepare_1d_plots(histograms, tree, CoffeaPlotSettings):
                 # ================================================ #
                 # ============== Create the Data/MC ratio ============== #
                 # ================================================ #
-                log.debug(f"Preparing Data/MC ratio")
-                data_over_mc_ratio    = RatioPlot(ratio_items = [], bar_type = 'points', error_type = 'stat', plottersettings = PlotSettings)
-                data_over_mc_ratioitem = DataOverMC(data_histogram,  PlotSettings.total_mc_histo, label = None, marker = 'o', color = 'black', markersize=12)
-                data_over_mc_ratio.append(data_over_mc_ratioitem)
-                data_over_mc_ratio.blinder = blinder
-                PlotSettings.data_over_mc_ratio = data_over_mc_ratio
+                if 'data_over_mc_ratio' in needs:
+                    log.debug(f"Preparing Data/MC ratio")
+                    data_over_mc_ratio    = RatioPlot(ratio_items = [], bar_type = 'points', error_type = 'stat', plottersettings = PlotSettings)
+                    data_over_mc_ratioitem = DataOverMC(PlotSettings.data_histo,  PlotSettings.total_mc_histo, label = None, marker = 'o', color = 'black', markersize=12)
+                    data_over_mc_ratio.append(data_over_mc_ratioitem)
+                    data_over_mc_ratio.blinder = blinder
+                    PlotSettings.data_over_mc_ratio = data_over_mc_ratio
 
                 # ================================================ #
                 # ============== Create the MC/MC ratio ============== #
                 # ================================================ #
-                mc_over_mc_ratio      = RatioPlot(ratio_items = [], bar_type = 'step', error_type = 'stat', plottersettings = PlotSettings)
-                log.debug(f"Preparing MC/MC ratio")
-                if PlotSettings.refMC_histo is not None:
-                    for mc_histogram in PlotSettings.backgrounds_histos+PlotSettings.signals_histos:
-                        mc_over_mc_ratioitem = RatioItem(mc_histogram, PlotSettings.refMC_histo, label = None, color = mc_histogram.color, linewidth=3)
-                        mc_over_mc_ratio.append(mc_over_mc_ratioitem)
-                else:
-                    mc_over_mc_ratio = None
-
-                PlotSettings.mc_over_mc_ratio = mc_over_mc_ratio
+                if 'mc_over_mc_ratio' in needs:
+                    mc_over_mc_ratio      = RatioPlot(ratio_items = [], bar_type = 'step', error_type = 'stat', plottersettings = PlotSettings)
+                    log.debug(f"Preparing MC/MC ratio")
+                    if PlotSettings.refMC_histo is not None:
+                        for mc_histogram in PlotSettings.backgrounds_histos+PlotSettings.signals_histos:
+                            mc_over_mc_ratioitem = RatioItem(mc_histogram, PlotSettings.refMC_histo, label = None, color = mc_histogram.color, linewidth=3)
+                            mc_over_mc_ratio.append(mc_over_mc_ratioitem)
+                    else:
+                        mc_over_mc_ratio = None
+
+                    PlotSettings.mc_over_mc_ratio = mc_over_mc_ratio
 
                 # ================================================ #
                 # ============== Create the Significance Plot ============== #
                 # ================================================ #
-                log.debug(f"Preparing Significance ratio plots")
-                signif_ratios_for_one_stack = []
-                # ============== Set up significance ratio plots ============== #
-                for target_histogram in PlotSettings.region_targets_histos:
-                    signif_ratio = RatioPlot(ratio_items = [], bar_type = 'stepfilled', error_type = 'stat', ylabel=f'{target_histogram.sample}/'+r'$\sqrt{B}$', plottersettings = PlotSettings)
-                    # Backgrounds to this target (AllMC - Target)
-                    background_to_this_target_histograms = [histogram for histogram in PlotSettings.backgrounds_histos+PlotSettings.signals_histos if histogram.sample != target_histogram.sample]
-                    background_to_this_target_histogram = sum(background_to_this_target_histograms)
-                    background_to_this_target_histogram.sample         = f'background_to_{target_histogram.sample}'
-                    background_to_this_target_histogram.stylish_sample = 'Background'
+                if 'signif_ratios' in needs:
+                    log.debug(f"Preparing Significance ratio plots")
+                    signif_ratios_for_one_stack = []
+                    # ============== Set up significance ratio plots ============== #
+                    for target_histogram in PlotSettings.region_targets_histos:
+                        signif_ratio = RatioPlot(ratio_items = [], bar_type = 'stepfilled', error_type = 'stat', ylabel=f'{target_histogram.sample}/'+r'$\sqrt{B}$', plottersettings = PlotSettings)
+                        # Backgrounds to this target (AllMC - Target)
+                        background_to_this_target_histogram = PlotSettings.aggregates.background_to(target_histogram)
+                        background_to_this_target_histogram.sample         = f'background_to_{target_histogram.sample}'
+                        background_to_this_target_histogram.stylish_sample = 'Background'
 
-                    # Create a Ratio Item.
-                    signif_ratioitem = Significance(target_histogram, background_to_this_target_histogram, color = target_histogram.color, alpha = 0.8)
-                    signif_ratio.append(signif_ratioitem)
-                    signif_ratios_for_one_stack.append(signif_ratio)
+                        # Create a Ratio Item.
+                        signif_ratioitem = Significance(target_histogram, background_to_this_target_histogram, color = target_histogram.color, alpha = 0.8)
+                        signif_ratio.append(signif_ratioitem)
+                        signif_ratios_for_one_stack.append(signif_ratio)
 
-                PlotSettings.signif_ratios = signif_ratios_for_one_stack
+                    PlotSettings.signif_ratios = signif_ratios_for_one_stack
 
 
                 # ================================================ #
                 # ============== Create the Piechart stack ============== #
                 # ================================================ #
-                if CoffeaPlotSettings.piechart_plot_settings is not None:
+                # Efficiencies have no pie chart, the processor makes them from the numerator and denominator
+                if 'pie_stack' in needs and CoffeaPlotSettings.piechart_plot_settings is not None and not isinstance(variable, Eff):
                     pie_stack = PieStack(stackatinos = [], bar_type = 'pie', error_type = 'stat', plottersettings = PlotSettings)
                     for category, cat_samples_histograms in PlotSettings.category_to_samples_histos.items():
                         for cat_sample_histogram in cat_samples_histograms:
@@ -366,76 +395,72 @@ def prepare_1d_plots(histograms, tree, CoffeaPlotSettings):
                     PlotSettings.pie_stack = pie_stack
                 # ================================================ #
                 #================= Save plot objects in PlotSettings ============== #
-                plot_settings_list.append(PlotSettings)
-
-    return plot_settings_list
+                yield PlotSettings
 
 def prepare_2d_plots(histograms, tree, CoffeaPlotSettings):
-
+    '''
+    Generator of the PlotterSettings of each 2D plot, one per variable, region and sample.
+    '''
     if not any(variable.dim == 2 for variable in CoffeaPlotSettings.variables_list):
         return
 
-    # ====== Loop over 1D plots ====== #
-    plot_settings_list = []
-
-    unpacked_samples = []
-    for sample in CoffeaPlotSettings.samples_list:
-        if sample.is_super:
-            unpacked_samples.extend(sample.subsamples)
-        else:
-            unpacked_samples.append(sample)
+    unpacked_samples = CoffeaPlotSettings.samples_list.unpacked()
 
     for variable in CoffeaPlotSettings.variables_list:
         #if variable.tree != tree: continue
         if variable.dim  != 2:    continue
 
+        if not CoffeaPlotSettings.is_selected('variables', variable.name): continue
+
         log.debug(f"Setting up variable {variable.name}")
 
         for region in CoffeaPlotSettings.regions_list:
+            if not CoffeaPlotSettings.is_selected('regions', region.name): continue
             log.debug(f"Setting up region {region.name}")
 
             for rescale in CoffeaPlotSettings.rescales_list:
+                if not CoffeaPlotSettings.is_selected('rescales', rescale.name): continue
                 log.debug(f"Setting up rescale {rescale.name}")
 
-            for sample in unpacked_samples:
-                PlotSettings = PlotterSettings(variable, region, rescale, sample)
+                for sample in unpacked_samples:
+                    PlotSettings = PlotterSettings(variable, region, rescale, sample)
 
-                sample_histo = histograms[(variable.name, sample.name, region.name, rescale.name)]
+                    sample_histo = histograms[(variable.name, sample.name, region.name, rescale.name)]
 
-                sample_histo.label = variable.label
-                sample_histo.color = sample.color
-                sample_histo.stylish_sample = sample.label
-                sample_histo.stylish_region = region.label
-                sample_histo.stylish_rescale = rescale.label
-                if variable.rebin is not None:
-                    sample_histo.rebin(variable.rebin)
+                    sample_histo.label = variable.label
+                    sample_histo.color = sample.color
+                    sample_histo.stylish_sample = sample.label
+                    sample_histo.stylish_region = region.label
+                    sample_histo.stylish_rescale = rescale.label
+                    if variable.rebin is not None:
+                        sample_histo.rebin(variable.rebin)
 
-                # Category color is the color of the first sample in the category
-                stackatino = Stackatino(histograms=[sample_histo], label=sample.label)
-                # Add up all the histograms in the stackatino
-                stackatino.sum_histograms()
-                # Add the stackatino to the stack
-                mc_stack = Stack(stackatinos = [stackatino], bar_type = 'stepfilled', error_type = 'stat', plottersettings = PlotSettings)
+                    # Category color is the color of the first sample in the category
+                    stackatino = Stackatino(histograms=[sample_histo], label=sample.label)
+                    # Add up all the histograms in the stackatino
+                    stackatino.sum_histograms()
+                    # Add the stackatino to the stack
+                    mc_stack = Stack(stackatinos = [stackatino], bar_type = 'stepfilled', error_type = 'stat', plottersettings = PlotSettings)
 
-                # Append stack to kust of stacks (one per region, rescale, variable)
-                PlotSettings.mc_stack = mc_stack
-                plot_settings_list.append(PlotSettings)
-    return plot_settings_list
+                    # Append stack to kust of stacks (one per region, rescale, variable)
+                    PlotSettings.mc_stack = mc_stack
+                    yield PlotSettings
 
-def make_datamc(plot, settings, outpath):
+def make_datamc(plot, settings, outpath, writer=None):
 
-    mc_stack = deepcopy(plot.mc_stack)
-    data_stack = deepcopy(plot.data_stack)
-    data_over_mc_ratio = deepcopy(plot.data_over_mc_ratio)
+    mc_stack = plot.mc_stack
+    data_stack = plot.data_stack
+    data_over_mc_ratio = plot.data_over_mc_ratio
 
     stack_with_datamc = CoffeaPlot([mc_stack, data_stack], data_over_mc_ratio, settings)
 
     log.info(f"Plotting Data v MC plots")
-    stack_with_datamc.plot(outpath)
+    stack_with_datamc.plot(outpath, writer=writer)
 
-def make_mcmc(plot, settings, outpath):
-    mc_stack = deepcopy(plot.mc_stack)
-    mc_over_mc_ratio = deepcopy(plot.mc_over_mc_ratio)
+def make_mcmc(plot, settings, outpath, writer=None):
+    # Shallow copy, the stack is drawn unstacked here but shared with other plots
+    mc_stack = copy(plot.mc_stack)
+    mc_over_mc_ratio = plot.mc_over_mc_ratio
 
     if mc_over_mc_ratio is None:
         mc_over_mc_ratio = []
@@ -445,22 +470,22 @@ def make_mcmc(plot, settings, outpath):
 
     mcmc_plot = CoffeaPlot(mc_stack, mc_over_mc_ratio, settings)
     log.info(f"Plotting MC v MC plots")
-    mcmc_plot.plot(outpath)
+    mcmc_plot.plot(outpath, writer=writer)
 
-def make_eff(plot, settings, outpath):
+def make_eff(plot, settings, outpath, writer=None):
     if plot.eff_stack is None:
         log.warning("No efficiency stack found")
         return
 
-    eff_stack = deepcopy(plot.eff_stack)
+    eff_stack = plot.eff_stack
     settings.main.ynorm = False
     eff_plot = CoffeaPlot(eff_stack, [], settings)
 
     log.info(f"Plotting Efficiency plots")
-    eff_plot.plot(outpath)
+    eff_plot.plot(outpath, writer=writer)
 
-def make_separation(plot, settings, outpath):
-    sep_stack = deepcopy(plot.sep_stack)
+def make_separation(plot, settings, outpath, writer=None):
+    sep_stack = copy(plot.sep_stack)
     sep_stack.stack = False
 
     if  settings.writesep:
@@ -475,65 +500,173 @@ def make_separation(plot, settings, outpath):
 
     sep_plot = CoffeaPlot(sep_stack, [], settings, add_auto_text = [[separation_str, settings.seploc]])
     log.info(f"Plotting Separation plots")
-    sep_plot.plot(outpath)
+    sep_plot.plot(outpath, writer=writer)
 
-def make_significance(plot, settings, outpath):
-    mc_stack = deepcopy(plot.mc_stack)
-    data_stack = deepcopy(plot.data_stack)
+def make_significance(plot, settings, outpath, writer=None):
+    mc_stack = plot.mc_stack
+    data_stack = plot.data_stack
     signif_ratios = plot.signif_ratios
 
     stack_with_signif = CoffeaPlot([mc_stack, data_stack], signif_ratios, settings)
     log.info(f"Plotting Significance plots")
-    stack_with_signif.plot(outpath)
+    stack_with_signif.plot(outpath, writer=writer)
 
-def make_piechart(plot, settings, outpath):
+def make_piechart(plot, settings, outpath, writer=None):
 
     if plot.pie_stack is None:
         log.warning("No pie stack found")
         return
 
-    pie_stack = deepcopy(plot.pie_stack)
+    pie_stack = plot.pie_stack
     piechart = CoffeaPlot([pie_stack], [], settings)
     log.info(f"Plotting Pie Charts")
-    piechart.plot(outpath, plot_type='PIE')
+    piechart.plot(outpath, plot_type='PIE', writer=writer)
 
-def make_heatmap(plot, settings, outpath):
-    mc_stack = deepcopy(plot.mc_stack)
+def make_heatmap(plot, settings, outpath, writer=None):
+    mc_stack = plot.mc_stack
     heatmap  = CoffeaPlot([mc_stack], [], settings)
-    heatmap.plot(outpath, plot_type='2D')
-
+    heatmap.plot(outpath, plot_type='2D', writer=writer)
+
+
+# Plot type -> (function making the plot, output directory, plot settings attribute
+#               of CoffeaPlotSettings, PlotterSettings attributes needed by the plot)
+PLOT_MAKERS = {
+    'DATAMC':     (make_datamc,       'datamcdir',       'datamc_plot_settings',       ['mc_stack', 'data_stack', 'data_over_mc_ratio']),
+    'MCMC':       (make_mcmc,         'mcmcdir',         'mcmc_plot_settings',         ['mc_stack', 'mc_over_mc_ratio']),
+    'SIGNIF':     (make_significance, 'significancedir', 'significance_plot_settings', ['mc_stack', 'data_stack', 'signif_ratios']),
+    'SEPARATION': (make_separation,   'separationdir',   'separation_plot_settings',   ['sep_stack']),
+    'EFF':        (make_eff,          'effdir',          'eff_plot_settings',          ['eff_stack']),
+    'PIECHART':   (make_piechart,     'piechartdir',     'piechart_plot_settings',     ['pie_stack']),
+    '2D':         (make_heatmap,      'heatdir',         'heatmap_plot_settings',      ['mc_stack']),
+}
+
+def plot_job(plot, plot_type, CoffeaPlotSettings, outpaths):
+    '''
+    Package everything needed to make one plot of type plot_type. The PlotterSettings
+    passed on only holds the stacks and ratio plots this plot type draws, so that a
+    plotting worker only receives the histograms it needs.
+    '''
+    make_fn, outdir, settings_attr, needs = PLOT_MAKERS[plot_type]
+
+    slim_plot = PlotterSettings(plot.variable, plot.region, plot.rescale, plot.sample)
+    for attr in needs:
+        setattr(slim_plot, attr, getattr(plot, attr))
+
+    return make_fn, slim_plot, CoffeaPlotSettings[settings_attr], outpaths[outdir]
+
+def run_plot_job(job, writer=None):
+    make_fn, plot, settings, outpath = job
+    make_fn(plot, settings, outpath, writer=writer)
+
+def run_pickled_plot_job(payload):
+    # Plot objects hold functors built from helper modules, which only cloudpickle can handle
+    run_plot_job(cloudpickle.loads(payload))
+
+def init_plot_worker():
+    '''
+    Runs once in each plotting worker, before it renders any plot. Importing this module
+    already imported matplotlib and mplhep, and the plot style is applied with the first
+    figure, so only the non-interactive backend needs to be chosen here. The pooled
+    figures are closed when the worker exits, once the pool has no more jobs for it.
+    '''
+    import matplotlib
+    from multiprocessing.util import Finalize
+    matplotlib.use('Agg')
+    # Workers exit without running atexit handlers, finalizers with a priority do run
+    Finalize(None, figure_pool.close, exitpriority=10)
+
+def run_plot_jobs(jobs, nworkers, writer=None):
+    '''
+    Render the plot jobs, one after the other if nworkers <= 1, otherwise on a pool
+    of nworkers processes. Jobs come as (job, on_done) pairs, where on_done is called
+    once the plot is saved. Jobs are consumed lazily and only a few are kept in flight
+    per worker, so that we don't hold pickled copies of all plots at once. A writer
+    collecting the plots lives in this process, so it forces rendering here too.
+    '''
+    if nworkers is None or nworkers <= 1 or writer is not None:
+        for job, on_done in jobs:
+            run_plot_job(job, writer)
+            on_done()
+        return
 
-def make_plots(plot_settings_list, CoffeaPlotSettings, outpaths):
-    makeplots = CoffeaPlotSettings.makeplots
+    log.info(f"Rendering plots on {nworkers} workers")
+    with ProcessPoolExecutor(max_workers=nworkers, initializer=init_plot_worker) as pool:
+        in_flight = {}
+        for job, on_done in jobs:
+            if len(in_flight) >= 2*nworkers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # Re-raise any exception from the workers
+                    future.result()
+                    in_flight.pop(future)()
+            in_flight[pool.submit(run_pickled_plot_job, cloudpickle.dumps(job))] = on_done
+
+        for future in wait(in_flight).done:
+            future.result()
+            in_flight[future]()
+
+def plot_jobs(plot_settings_list, plot_types, CoffeaPlotSettings, outpaths, cache = None):
+    '''
+    Generate the plot jobs for each plot type of each plot. If a cache is given, the
+    inputs of each job are hashed and jobs for plots that were already drawn from
+    the same inputs are skipped.
+    '''
     for plot in plot_settings_list:
-
         log.info(f"Making plots for {plot.variable.name} in {plot.region.name} with {plot.rescale.name} rescale")
+        for plot_type in plot_types:
+            job = plot_job(plot, plot_type, CoffeaPlotSettings, outpaths)
+            if cache is None:
+                yield job, lambda: None
+                continue
+
+            make_fn, slim_plot, settings, outpath = job
+            filename = PlotIdentifier(slim_plot).filename(plot_type)
+            key = fingerprint(plot_type, make_fn, slim_plot, settings)
+            files = [f'{filename}.{fmt}' for fmt in settings.output_formats()]
+            if cache.is_fresh(outpath, filename, key, files):
+                log.debug(f"Skipping {outpath}/{filename}, its inputs did not change")
+                continue
+            yield job, lambda outpath=outpath, filename=filename, key=key: cache.record(outpath, filename, key)
+
+def render_plots(plot_settings_list, plot_types, CoffeaPlotSettings, outpaths):
+    writer = None
+    if CoffeaPlotSettings.multipagepdf is not None:
+        # Pages are added to PDFs open in this process, and a multi-page PDF has to
+        # be written in full, so plots can't be skipped or rendered on workers
+        if CoffeaPlotSettings.plotworkers is not None and CoffeaPlotSettings.plotworkers > 1:
+            log.warning("Multi-page PDFs are written from the main process, ignoring PlotWorkers")
+        writer = MultiPagePDFWriter(CoffeaPlotSettings.multipagepdf)
+    elif CoffeaPlotSettings.writerthreads > 0:
+        # Workers save their own plots, background writing only helps serial rendering
+        if CoffeaPlotSettings.plotworkers is not None and CoffeaPlotSettings.plotworkers > 1:
+            log.debug("Plots are rendered on workers, not using background writer threads")
+        else:
+            writer = AsyncFigureWriter(CoffeaPlotSettings.writerthreads, CoffeaPlotSettings.writerqueue)
+
+    cache = PlotCache() if CoffeaPlotSettings.plotcache and not isinstance(writer, MultiPagePDFWriter) else None
+    jobs = plot_jobs(plot_settings_list, plot_types, CoffeaPlotSettings, outpaths, cache)
+    failed = []
+    try:
+        run_plot_jobs(jobs, CoffeaPlotSettings.plotworkers, writer)
+    finally:
+        # Wait for the files to be on disk before recording them in the cache. A plot
+        # whose file could not be written is missing, so it is re-drawn next time
+        if writer is not None:
+            failed = writer.close()
+        # Keep the hashes of the plots drawn so far, even if a later one failed
+        if cache is not None:
+            cache.save()
+        # Pooled figures stay registered with pyplot until they are closed
+        figure_pool.close()
+    if failed != []:
+        log.error(f"Could not write {len(failed)} plot files, see the warnings above")
+    if cache is not None and cache.skipped > 0:
+        log.info(f"Skipped {cache.skipped} plots whose inputs did not change since they were last drawn")
 
-        if 'DATAMC' in makeplots:
-            outpath = outpaths['datamcdir']
-            make_datamc(plot, CoffeaPlotSettings.datamc_plot_settings, outpath)
-        if 'MCMC' in makeplots:
-            outpath = outpaths['mcmcdir']
-            make_mcmc(plot, CoffeaPlotSettings.mcmc_plot_settings, outpath)
-        if 'SIGNIF' in makeplots:
-            outpath = outpaths['significancedir']
-            make_significance(plot, CoffeaPlotSettings.significance_plot_settings, outpath)
-        if 'SEPARATION' in makeplots:
-            outpath = outpaths['separationdir']
-            make_separation(plot, CoffeaPlotSettings.separation_plot_settings, outpath)
-        if 'EFF' in makeplots:
-            outpath = outpaths['effdir']
-            make_eff(plot, CoffeaPlotSettings.eff_plot_settings, outpath)
-        if 'PIECHART' in makeplots:
-            outpath = outpaths['piechartdir']
-            make_piechart(plot, CoffeaPlotSettings.piechart_plot_settings, outpath)
+def make_plots(plot_settings_list, CoffeaPlotSettings, outpaths):
+    plot_types = [plot_type for plot_type in PLOT_MAKERS if plot_type != '2D' and plot_type in CoffeaPlotSettings.makeplots]
+    render_plots(plot_settings_list, plot_types, CoffeaPlotSettings, outpaths)
 
 def make_2d_plots(plot_settings_list, CoffeaPlotSettings, outpaths):
-    makeplots = CoffeaPlotSettings.makeplots
-    if '2D' in makeplots:
-        outpath = outpaths['heatdir']
-        for plot in plot_settings_list:
-            make_heatmap(plot, CoffeaPlotSettings.heatmap_plot_settings, outpath)
-
-
-
+    if '2D' in CoffeaPlotSettings.makeplots:
+        render_plots(plot_settings_list, ['2D'], CoffeaPlotSettings, outpaths)
@@ -0,0 +1,117 @@
+
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import os
+import threading
+
+from matplotlib.backends.backend_pdf import PdfPages
+
+import logging
+log = logging.getLogger(__name__)
+
+class MultiPagePDFWriter(object):
+    '''
+    Collects the plots of each output directory (i.e. each tree and plot type) as pages
+    of one PDF, or of one PDF per region, instead of writing one file per plot. A
+    pages.json index in each directory maps every plot to its file and page number.
+    Other formats than PDF are still written as one file per plot, and draft mode
+    PNGs are written as usual.
+    '''
+    GROUPINGS = ['tree', 'region']
+
+    def __init__(self, group_by='tree'):
+        if group_by not in self.GROUPINGS:
+            raise ValueError(f"Invalid multi-page PDF grouping: {group_by}, allowed groupings are: {self.GROUPINGS}")
+        self.group_by = group_by
+        self.pdfs = {}
+        self.index = {}
+
+    def pdf(self, outpath, region):
+        # Files are named after the plot type directory, e.g. DataMC.pdf or DataMC__SR.pdf
+        name = os.path.basename(os.path.normpath(outpath))
+        if self.group_by == 'region':
+            name = f'{name}__{region}'
+        name = f'{name}.pdf'
+
+        if (outpath, name) not in self.pdfs:
+            log.debug(f"Opening multi-page PDF {outpath}/{name}")
+            self.pdfs[(outpath, name)] = PdfPages(f'{outpath}/{name}')
+        return name, self.pdfs[(outpath, name)]
+
+    def write(self, plot, fig, outpath, filename):
+
+        if plot.settings.draft:
+            plot.save(fig, outpath, filename)
+            return
+
+        formats = plot.settings.output_formats()
+        others  = [fmt for fmt in formats if fmt != 'pdf']
+        if others != []:
+            plot.save(fig, outpath, filename, formats=others)
+        if 'pdf' not in formats:
+            return
+
+        plotid = plot.stacks[0].plotid
+        name, pages = self.pdf(outpath, plotid.region)
+        for _, options in plot.save_options(fig, formats=['pdf']):
+            pages.savefig(fig, **options)
+
+        self.index.setdefault(outpath, []).append({
+            'plot':     filename,
+            'variable': plotid.variable,
+            'region':   plotid.region,
+            'rescale':  plotid.rescale,
+            'sample':   plotid.sample,
+            'file':     name,
+            'page':     pages.get_pagecount(),
+        })
+
+    def close(self):
+        for pages in self.pdfs.values():
+            pages.close()
+        for outpath, entries in self.index.items():
+            with open(f'{outpath}/pages.json', 'w') as f:
+                json.dump(entries, f, indent=1)
+        self.pdfs, self.index = {}, {}
+        return []
+
+class AsyncFigureWriter(object):
+    '''
+    Renders plots to in-memory buffers and leaves writing them to disk to a pool of
+    threads, so that the next plot is drawn while the previous files are written. This
+    pays off on slow (e.g. network) file systems. At most `queue` files wait to be
+    written at any time, rendering blocks until one of them is done beyond that.
+    Failed writes are collected and returned by close().
+    '''
+    def __init__(self, threads=2, queue=8):
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='plot-writer')
+        self.slots = threading.BoundedSemaphore(queue)
+        self.lock = threading.Lock()
+        self.failed = []
+
+    def write(self, plot, fig, outpath, filename):
+        # Figures are drawn here, matplotlib is not thread-safe
+        for fmt, options in plot.save_options(fig):
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format=fmt, **options)
+            self.slots.acquire()
+            future = self.pool.submit(self.flush, f'{outpath}/{filename}.{fmt}', buffer)
+            future.add_done_callback(lambda _: self.slots.release())
+
+    def flush(self, path, buffer):
+        try:
+            with open(path, 'wb') as f:
+                f.write(buffer.getbuffer())
+        except Exception as err:
+            with self.lock:
+                self.failed.append((path, err))
+            # Don't leave a truncated file that looks like a finished plot
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        for path, err in self.failed:
+            log.warning(f"Could not write {path}: {err}")
+        return [path for path, _ in self.failed]
@@ -0,0 +1,408 @@
+'''
+Dry run of the processor: counts the histograms a config will make, estimates
+how much memory they take and how long filling them takes, without reading any
+events. Only the number of entries and the branch names of each input file are
+read, and they are cached in the dump directory so that later plans are free.
+'''
+# ================ Pythonic Imports ================ #
+import json
+import math
+import os
+import time
+import types
+from collections import defaultdict
+from statistics import median
+import logging
+log = logging.getLogger(__name__)
+# ================ CoffeaPlot Imports ================ #
+from containers.samples import SuperSample
+from containers.variables import Eff
+
+METADATA = 'metadata.json'
+HISTORY  = 'history.json'
+
+# Bytes per bin for each storage type of hist
+STORAGE_BYTES = {'Double': 8, 'Int64': 8, 'AtomicInt64': 8, 'Weight': 16, 'Mean': 24, 'WeightedMean': 32}
+# The processor fills every histogram with weights
+STORAGE = 'Weight'
+# Python objects around each histogram (Histogram, hist.Hist, axes)
+HISTOGRAM_OVERHEAD = 1024
+# Number of runs used to estimate the throughput
+HISTORY_RUNS = 10
+
+# ================ Helpers ================ #
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        log.warning(f"Could not read {path}, starting from scratch")
+        return default
+
+def _write_json(path, content):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _size(nbytes):
+    for unit in ['B', 'kB', 'MB']:
+        if nbytes < 1024:
+            return f'{nbytes:.0f} {unit}'
+        nbytes /= 1024
+    return f'{nbytes:.1f} GB'
+
+def _duration(seconds):
+    if seconds < 60:
+        return f'{seconds:.0f} s'
+    if seconds < 3600:
+        return f'{seconds/60:.1f} min'
+    return f'{seconds/3600:.1f} h'
+
+def _histogram_bytes(binning, dim):
+    '''
+    Memory of one histogram of the processor, all axes have flow bins.
+    '''
+    edges = [binning] if dim == 1 else list(binning)
+    nbins = math.prod(len(axis_edges) + 1 for axis_edges in edges) # nbins + 2 flow bins
+    return nbins*STORAGE_BYTES[STORAGE] + 8*sum(len(axis_edges) for axis_edges in edges) + HISTOGRAM_OVERHEAD
+
+def _subsamples(sample):
+    return sample.subsamples if isinstance(sample, SuperSample) else [sample]
+
+def variable_regions(variable, regions_list):
+    '''
+    Regions a variable is filled in, following the matching done in the processor.
+    '''
+    return regions_list.select(variable.regions)
+
+# ================ Histogram counting ================ #
+def histogram_records(CoffeaPlotSettings):
+    '''
+    Every histogram the processor makes for one tree, as a list of
+    (variable, sample, region, rescale, bytes). The 'total' sample holds the
+    sum of all samples. Efficiencies and pie charts made in postprocess are included.
+    '''
+    records = []
+    regions_list  = CoffeaPlotSettings.regions_list
+    rescales_list = CoffeaPlotSettings.rescales_list
+
+    sample_names = [sample.name for sample in CoffeaPlotSettings.samples_list.unpacked()]
+    piechart = CoffeaPlotSettings.piechart_plot_settings
+    pie_samples = piechart.samples if piechart is not None and piechart.samples is not None else []
+
+    for variable in CoffeaPlotSettings.variables_list:
+        if variable.type == 'GHOST': continue
+
+        nbytes = _histogram_bytes(variable.binning, variable.dim)
+        for region in variable_regions(variable, regions_list):
+            for rescale in rescales_list:
+                for sample_name in sample_names + ['total']:
+                    records.append((variable.name, sample_name, region.name, rescale.name, nbytes))
+                    # One category holding the fraction of the sum sample
+                    if sample_name in pie_samples:
+                        records.append((f'{variable.name}:pie', sample_name, region.name, rescale.name, _histogram_bytes([0, 1], 1)))
+                    # The efficiency replaces the numerator and denominator, made once per pair
+                    if isinstance(variable, Eff) and variable.name.endswith(':Num'):
+                        records.append((variable.name.replace(':Num', ''), sample_name, region.name, rescale.name, nbytes))
+
+    return records
+
+def chunk_bytes(CoffeaPlotSettings, records):
+    '''
+    Largest accumulator returned by a single chunk: each chunk belongs to one
+    (super)sample and fills the histograms of its subsamples and of the total.
+    '''
+    by_sample = defaultdict(int)
+    for _, sample_name, _, _, nbytes in records:
+        by_sample[sample_name] += nbytes
+
+    return max((sum(by_sample[sample.name] for sample in _subsamples(fileset_sample)) + by_sample['total']
+                for fileset_sample in CoffeaPlotSettings.samples_list), default=0)
+
+# ================ Input files ================ #
+def sample_files(sample):
+    '''
+    Files of a sample, globbed here if the processor is not going to run.
+    '''
+    if sample.files:
+        return sample.files
+    try:
+        sample.create_fileset()
+    except AssertionError:
+        return []
+    return sample.files
+
+def file_metadata(files, tree, cache_path):
+    '''
+    Number of entries and branch names of a tree in each file. Files are only
+    opened if they are not in the cache, or if they changed since they were cached.
+    '''
+    cache = _read_json(cache_path, {})
+    metadata, updated = {}, False
+
+    for path in files:
+        stat = os.stat(path)
+        cached = cache.get(path)
+        if cached is None or cached['mtime'] != stat.st_mtime or cached['size'] != stat.st_size:
+            cached = {'mtime': stat.st_mtime, 'size': stat.st_size, 'trees': {}}
+            cache[path] = cached
+        if tree not in cached['trees']:
+            import uproot
+            with uproot.open(path) as f:
+                if tree in f:
+                    cached['trees'][tree] = {'entries': int(f[tree].num_entries), 'branches': sorted(f[tree].keys())}
+                else:
+                    cached['trees'][tree] = {'entries': 0, 'branches': None}
+            updated = True
+        metadata[path] = cached['trees'][tree]
+
+    if updated:
+        _write_json(cache_path, cache)
+    return metadata
+
+def count_chunks(entries, chunksize):
+    '''
+    Number of chunks coffea splits a file into, chunks are made of equal size
+    as close as possible to the requested size.
+    '''
+    if entries == 0:
+        return 0
+    return max(round(entries/chunksize), 1)
+
+def count_events(CoffeaPlotSettings, tree):
+    '''
+    Number of events the processor reads from a tree, from the metadata cache.
+    '''
+    cache_path = f'{CoffeaPlotSettings.tree_to_dir[tree]["datadir"]}/{METADATA}'
+    # Files shared by samples are read once for each of them
+    return sum(meta['entries'] for sample in CoffeaPlotSettings.samples_list
+               for meta in file_metadata(sample_files(sample), tree, cache_path).values())
+
+# ================ Run history ================ #
+def record_run(CoffeaPlotSettings, tree, seconds):
+    '''
+    Save the throughput of a processor run, to estimate the runtime of later runs.
+    '''
+    history_path = f'{CoffeaPlotSettings.tree_to_dir[tree]["datadir"]}/{HISTORY}'
+    try:
+        events = count_events(CoffeaPlotSettings, tree)
+    except Exception as err:
+        log.warning(f"Could not count the events of tree {tree} ({err}), the run is not saved in the history")
+        return
+
+    history = _read_json(history_path, [])
+    history.append({'tree': tree,
+                    'time': time.time(),
+                    'seconds': seconds,
+                    'events': events,
+                    'histograms': len(histogram_records(CoffeaPlotSettings)),
+                    'workers': max(CoffeaPlotSettings.nworkers, 1),
+                    'chunksize': CoffeaPlotSettings.chunksize})
+    _write_json(history_path, history)
+
+def estimate_runtime(history, tree, events, histograms, workers):
+    '''
+    Runtime from the median throughput of the last runs, in histogram fills
+    per event per second per worker. Runs of the same tree are preferred.
+    Returns None if there is no history.
+    '''
+    runs = [run for run in history if run['tree'] == tree] or history
+    rates = [run['events']*run['histograms']/(run['seconds']*run['workers'])
+             for run in runs[-HISTORY_RUNS:] if run['seconds'] > 0 and run['events'] > 0]
+    if not rates:
+        return None
+    return events*histograms/(median(rates)*workers)
+
+# ================ Checks ================ #
+def functor_key(functor):
+    '''
+    Two functors with the same key compute the same thing: same code, same
+    constants and globals, same closure and default values and same arguments.
+    '''
+    fn = functor.fn
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        return (repr(fn), tuple(functor.args))
+    consts = tuple(repr(c) for c in code.co_consts if not isinstance(c, types.CodeType))
+    closure = tuple(repr(cell.cell_contents) for cell in (fn.__closure__ or ()))
+    # Values bound as defaults, like the factors of constant rescales, are part of what is computed
+    defaults = (repr(fn.__defaults__), repr(fn.__kwdefaults__))
+    return (code.co_code, consts, code.co_names, closure, defaults, tuple(functor.args))
+
+def _functors(CoffeaPlotSettings):
+    '''
+    All functors evaluated by the processor, as (description, functor).
+    '''
+    functors = []
+    for fileset_sample in CoffeaPlotSettings.samples_list:
+        for sample in _subsamples(fileset_sample):
+            if sample.sel is not None:
+                functors.append((f'selection of sample {sample.name}', sample.sel))
+            functors.append((f'weight of sample {sample.name}', sample.weight))
+            functors.append((f'MC weight of sample {sample.name}', sample.mc_weight))
+    for region in CoffeaPlotSettings.regions_list:
+        functors.append((f'selection of region {region.name}', region.sel))
+    for variable in CoffeaPlotSettings.variables_list:
+        howtos = variable.howto if variable.dim == 2 else [variable.howto]
+        for howto in howtos:
+            functors.append((f'variable {variable.name}', howto))
+        if isinstance(variable, Eff):
+            functors.append((f'selection of efficiency {variable.name}', variable.numsel if ':Num' in variable.name else variable.denomsel))
+    for rescale in CoffeaPlotSettings.rescales_list:
+        functors.append((f'rescale {rescale.name}', rescale.method))
+    return functors
+
+def find_duplicates(CoffeaPlotSettings):
+    '''
+    Functors of variables, regions and rescales that compute the same thing,
+    and rescales that leave every sample as it is.
+    '''
+    warnings = []
+
+    # Sample weights and selections are evaluated once per sample, they are expected to repeat
+    groups = defaultdict(list)
+    for description, functor in _functors(CoffeaPlotSettings):
+        if 'of sample' in description: continue
+        groups[functor_key(functor)].append(description)
+    for descriptions in groups.values():
+        if len(descriptions) > 1:
+            warnings.append(f"Same functor evaluated for {', '.join(descriptions)}")
+
+    for rescale in CoffeaPlotSettings.rescales_list:
+        if not CoffeaPlotSettings.samples_list.select(rescale.affects, unpack = True):
+            warnings.append(f"Rescale {rescale.name} affects no sample, its histograms duplicate the nominal ones")
+
+    return warnings
+
+def repeated_evaluations(CoffeaPlotSettings):
+    '''
+    Number of variable evaluations per chunk and per sample, and how many of
+    them repeat the same variable in the same region for another rescale.
+    '''
+    evaluations, unique = 0, 0
+    for variable in CoffeaPlotSettings.variables_list:
+        if variable.type == 'GHOST':
+            evaluations += 1
+            unique += 1
+            continue
+        nregions = len(variable_regions(variable, CoffeaPlotSettings.regions_list))
+        evaluations += nregions*len(CoffeaPlotSettings.rescales_list)
+        unique += nregions
+    return evaluations, evaluations - unique
+
+def find_unfillable(CoffeaPlotSettings, inputs):
+    '''
+    Combinations the processor can never fill: variables without regions,
+    samples without files or events, and functors reading missing branches.
+
+    Parameters
+    ----------
+    inputs : dict
+        Sample name to its number of files, number of events, and set of
+        branches found in all its files (None if unknown)
+    '''
+    warnings = []
+    regions_list = CoffeaPlotSettings.regions_list
+
+    for variable in CoffeaPlotSettings.variables_list:
+        if variable.type == 'GHOST': continue
+        matched = variable_regions(variable, regions_list)
+        if matched == []:
+            warnings.append(f"Variable {variable.name} matches no region with {variable.regions}, it is never filled")
+        elif isinstance(variable, Eff) and len(matched) != len(regions_list):
+            warnings.append(f"Efficiency {variable.name} is not filled in all regions, postprocess looks for it in every region and will fail")
+
+    # Branches made by ghost variables and the weights are added to the events by the processor
+    produced = {'weights'} | {variable.name for variable in CoffeaPlotSettings.variables_list if variable.type == 'GHOST'}
+    functors = [(description, functor) for description, functor in _functors(CoffeaPlotSettings) if 'of sample' not in description]
+    missing_branches = defaultdict(list)
+
+    for fileset_sample in CoffeaPlotSettings.samples_list:
+        sample_input = inputs[fileset_sample.name]
+        if sample_input['files'] == 0:
+            warnings.append(f"Sample {fileset_sample.name} has no files, its histograms are never filled")
+            continue
+        if sample_input['events'] == 0:
+            warnings.append(f"Sample {fileset_sample.name} has no events in this tree, its histograms are never filled")
+            continue
+        available = sample_input['branches']
+        if available is None: continue
+
+        names = [sample.name for sample in _subsamples(fileset_sample)]
+        sample_functors = functors + [(description, functor) for description, functor in _functors(CoffeaPlotSettings)
+                                      if description.split(' of sample ')[-1] in names]
+        for description, functor in sample_functors:
+            missing = [arg for arg in functor.args if arg not in available and arg not in produced]
+            if missing:
+                missing_branches[(description, tuple(missing))].append(fileset_sample.name)
+
+    for (description, missing), sample_names in missing_branches.items():
+        warnings.append(f"Branches {list(missing)} used by {description} are not in the files of samples {', '.join(sample_names)}")
+
+    return warnings
+
+# ================ Report ================ #
+def _breakdown(records, index):
+    counts, nbytes = defaultdict(int), defaultdict(int)
+    for record in records:
+        counts[record[index]] += 1
+        nbytes[record[index]] += record[4]
+    width = max((len(name) for name in counts), default=0)
+    return [f'    {name:<{width}}  {counts[name]:>8}  {_size(nbytes[name]):>10}' for name in counts]
+
+def plan(CoffeaPlotSettings):
+    '''
+    Print what the processor would do for each tree, without reading any events.
+    '''
+    records = histogram_records(CoffeaPlotSettings)
+    output_bytes = sum(record[4] for record in records)
+    largest_chunk = chunk_bytes(CoffeaPlotSettings, records)
+    workers = max(CoffeaPlotSettings.nworkers, 1)
+    chunksize = CoffeaPlotSettings.chunksize
+    duplicates = find_duplicates(CoffeaPlotSettings)
+    evaluations, repeated = repeated_evaluations(CoffeaPlotSettings)
+
+    lines = []
+    for tree in CoffeaPlotSettings.trees:
+        datadir = CoffeaPlotSettings.tree_to_dir[tree]['datadir']
+
+        lines.append(f'==================== Plan for tree {tree} ====================')
+        lines.append(f'Histograms: {len(records)}, {_size(output_bytes)} in the output accumulator ({STORAGE} storage, {STORAGE_BYTES[STORAGE]} bytes per bin)')
+        for title, index in [('sample', 1), ('region', 2), ('rescale', 3), ('variable', 0)]:
+            lines.append(f'  By {title}:')
+            lines.extend(_breakdown(records, index))
+
+        # ====== Files, events and chunks ====== #
+        inputs, nchunks = {}, 0
+        for sample in CoffeaPlotSettings.samples_list:
+            files = sample_files(sample)
+            metadata = file_metadata(files, tree, f'{datadir}/{METADATA}')
+            known = [set(meta['branches']) for meta in metadata.values() if meta['branches'] is not None]
+            inputs[sample.name] = {'files': len(files),
+                                   'events': sum(meta['entries'] for meta in metadata.values()),
+                                   'branches': set.intersection(*known) if known else None}
+            nchunks += sum(count_chunks(meta['entries'], chunksize) for meta in metadata.values())
+        nfiles = sum(sample_input['files'] for sample_input in inputs.values())
+        events = sum(sample_input['events'] for sample_input in inputs.values())
+
+        lines.append(f'Input: {nfiles} files, {events} events, {nchunks} chunks of about {chunksize} events')
+        lines.append(f'Memory: {_size(largest_chunk)} per chunk accumulator, about {_size(output_bytes + workers*largest_chunk)} with {workers} workers')
+
+        runtime = estimate_runtime(_read_json(f'{datadir}/{HISTORY}', []), tree, events, len(records), workers)
+        if runtime is None:
+            lines.append('Runtime: unknown, no previous processor runs are recorded')
+        else:
+            lines.append(f'Runtime: about {_duration(runtime)} with {workers} workers, from previous runs')
+
+        # ====== Problems ====== #
+        lines.append(f'Variable evaluations per chunk and sample: {evaluations}, {repeated} of them repeat a variable in the same region for another rescale')
+        warnings = duplicates + find_unfillable(CoffeaPlotSettings, inputs)
+        for warning in warnings:
+            lines.append(f'WARNING: {warning}')
+        if not warnings:
+            lines.append('No duplicate functors or unfillable histograms found')
+
+    print('\n'.join(lines))
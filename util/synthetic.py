@@ -0,0 +1,221 @@
+'''
+Synthetic ntuples with the branches a config reads, so that the processor can
+be run on local files of any size without the real inputs. Values are random,
+only their shapes follow the config: branches of 'nonevent' variables are jet
+collections, branches read as weights get weight-like values, and branches
+that make a variable alone span its binning.
+'''
+# ================ Pythonic Imports ================ #
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+log = logging.getLogger(__name__)
+
+import awkward as ak
+import numpy as np
+# ================ CoffeaPlot Imports ================ #
+from containers.variables import Eff
+
+# Columns added by the processor, never read from the ntuples
+PROCESSOR_COLUMNS = ['weights']
+# Events generated and written to a tree at once
+WRITE_CHUNK = 500000
+# Fraction of the binning added on both sides, so that the flow bins are filled
+FLOW_FRACTION = 0.05
+WEIGHTS = ['unit', 'normal', 'negative']
+COMPRESSIONS = ['none', 'zlib', 'lz4']
+
+# ================ Branches ================ #
+def _is_branch_read(functor):
+    # Branches given by name in the config are read by an identity functor named after them
+    return functor.args == [functor.name]
+
+def _variable_functors(variable):
+    '''
+    (functor, is jagged, binning) of the functors of a variable
+    '''
+    if variable.dim == 2:
+        idxs = variable.idx if isinstance(variable.idx, list) else [variable.idx]*2
+        functors = [(howto, idx == 'nonevent', binning) for howto, idx, binning in zip(variable.howto, idxs, variable.binning)]
+    else:
+        functors = [(variable.howto, variable.idx == 'nonevent', variable.binning)]
+    if isinstance(variable, Eff):
+        functors += [(selection, variable.idx == 'nonevent', None) for selection in [variable.numsel, variable.denomsel]]
+    return functors
+
+def config_branches(CoffeaPlotSettings, jagged = None):
+    '''
+    Branches read by the functors of a config.
+
+    Returns a dictionary of branch name to {'kind': kind, 'range': (low, high)}
+    where kind is 'jagged' for the branches of 'nonevent' variables and for
+    branches matching one of the jagged regexes (helpers may read collections
+    to compute event variables), 'weight' for branches read by sample weights,
+    'mask' for branches read directly as a selection and 'flat' for everything else.
+    '''
+    branches = {}
+    # Ghost variables are computed by the processor and read by later functors
+    computed = set(PROCESSOR_COLUMNS) | {variable.name for variable in CoffeaPlotSettings.variables_list if variable.type == 'GHOST'}
+
+    def add(functor, kind, binning = None):
+        for arg in functor.args:
+            if arg in computed: continue
+            branch = branches.setdefault(arg, {'kind': kind, 'range': (0., 1.)})
+            # A jet collection can not be read as anything else, weights are only flat
+            if branch['kind'] != 'jagged' and (kind == 'jagged' or branch['kind'] == 'mask'):
+                branch['kind'] = kind
+            # Branches that make a variable alone are spread over its binning
+            if binning is not None and len(functor.args) == 1:
+                low, high = float(binning[0]), float(binning[-1])
+                branch['range'] = (low - FLOW_FRACTION*(high - low), high + FLOW_FRACTION*(high - low))
+
+    for fileset_sample in CoffeaPlotSettings.samples_list:
+        for sample in (fileset_sample.subsamples if fileset_sample.is_super else [fileset_sample]):
+            for functor in [sample.mc_weight, sample.weight]:
+                if functor is not None:
+                    add(functor, 'weight')
+            if sample.sel is not None:
+                add(sample.sel, 'mask' if _is_branch_read(sample.sel) else 'flat')
+    for region in CoffeaPlotSettings.regions_list:
+        add(region.sel, 'mask' if _is_branch_read(region.sel) else 'flat')
+    for variable in CoffeaPlotSettings.variables_list:
+        for functor, nonevent, binning in _variable_functors(variable):
+            if nonevent:
+                add(functor, 'jagged', binning)
+            elif binning is None and _is_branch_read(functor):
+                add(functor, 'mask')
+            else:
+                add(functor, 'flat', binning)
+    for rescale in CoffeaPlotSettings.rescales_list:
+        add(rescale.method, 'weight')
+
+    for name, branch in branches.items():
+        if any(re.fullmatch(pattern, name) for pattern in (jagged or [])):
+            branch['kind'] = 'jagged'
+    return branches
+
+def _uniform(rng, low, high, size):
+    # Drawing float32 directly is about twice as fast as drawing doubles
+    return rng.random(size, dtype=np.float32)*np.float32(high - low) + np.float32(low)
+
+def make_events(branches, events, rng, njets = 5., weights = 'normal', maxjets = None):
+    '''
+    Random values for the branches returned by config_branches. All jet
+    collections of an event have the same, poisson distributed, multiplicity.
+
+    Parameters
+    ----------
+    branches : dict
+        Branches returned by config_branches
+    events : int
+        Number of events
+    rng : numpy.random.Generator
+        Source of the random values
+    njets : float
+        Mean number of jets per event
+    weights : str
+        Distribution of the weights, 'unit' (all 1), 'normal' (around 1) or
+        'negative' (around 1, with a tenth of them negative like NLO generators)
+    maxjets : int or None
+        Largest number of jets in an event
+
+    Returns
+    -------
+    arrays : dict
+        Branch name to numpy or awkward array
+    '''
+    counts = rng.poisson(njets, events)
+    if maxjets is not None:
+        counts = np.minimum(counts, maxjets)
+    arrays = {}
+    for name, branch in sorted(branches.items()):
+        low, high = branch['range']
+        if branch['kind'] == 'jagged':
+            arrays[name] = ak.unflatten(_uniform(rng, low, high, counts.sum()), counts)
+        elif branch['kind'] == 'mask':
+            arrays[name] = rng.random(events) < 0.5
+        elif branch['kind'] == 'weight':
+            if weights == 'unit':
+                arrays[name] = np.ones(events, dtype=np.float32)
+            else:
+                values = np.abs(rng.normal(1., 0.2, events))
+                if weights == 'negative':
+                    values[rng.random(events) < 0.1] *= -1
+                arrays[name] = values.astype(np.float32)
+        else:
+            arrays[name] = _uniform(rng, low, high, events)
+    return arrays
+
+# ================ Files ================ #
+def glob_filename(pattern, tag):
+    '''
+    A file name matched by a NtuplesRgxs pattern (a glob, see Sample.create_fileset),
+    with the tag in place of the first '*'.
+    '''
+    name = pattern.replace('*', tag, 1).replace('*', '')
+    name = name.replace('?', '0')
+    # Character classes are replaced by their first character
+    return re.sub(r'\[!?(.)[^\]]*\]', r'\1', name)
+
+def synthetic_files(CoffeaPlotSettings, nfiles):
+    '''
+    Files to write so that each sample finds nfiles of them, in the first of
+    its directories and named after its first pattern. Samples that share a
+    pattern share the files, as they do with real ntuples.
+    '''
+    files = []
+    for sample in CoffeaPlotSettings.samples_list:
+        if not sample.regexes or not sample.direcs:
+            log.warning(f"Sample {sample.name} has no ntuples patterns or directories, no files are written for it")
+            continue
+        pattern = sample.regexes[0]
+        # Without a wildcard, only one file can match the pattern
+        tags = [f'{i:04d}' for i in range(nfiles)] if '*' in pattern else ['']
+        for tag in tags:
+            path = os.path.join(sample.direcs[0], f'{glob_filename(pattern, tag)}.root')
+            if path not in files:
+                files.append(path)
+    return files
+
+def _compression(name):
+    import uproot
+    return {'none': None, 'zlib': uproot.ZLIB(1), 'lz4': uproot.LZ4(1)}[name]
+
+def write_ntuple(path, trees, branches, events, seed, njets = 5., weights = 'normal', maxjets = None, compression = 'zlib'):
+    '''
+    Write a ROOT file with the same branches in each tree, in chunks of
+    WRITE_CHUNK events. The same seed gives the same file.
+    '''
+    import uproot
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rng = np.random.default_rng(seed)
+    with uproot.recreate(path, compression=_compression(compression)) as f:
+        for tree in trees:
+            for start in range(0, events, WRITE_CHUNK):
+                arrays = make_events(branches, min(WRITE_CHUNK, events - start), rng, njets, weights, maxjets)
+                if start == 0:
+                    f[tree] = arrays
+                else:
+                    f[tree].extend(arrays)
+    return path
+
+def write_ntuples(paths, trees, branches, events, seed = 0, workers = 1, skip_existing = False, **options):
+    '''
+    Write the files on a pool of workers, each file with its own seed derived
+    from the seed and its position, so skipped files do not change the others.
+    Options are passed on to write_ntuple. Returns the number of bytes written.
+    '''
+    jobs = [(path, trees, branches, events, [seed, i]) for i, path in enumerate(paths)
+            if not (skip_existing and os.path.exists(path))]
+    if workers <= 1:
+        for job in jobs:
+            log.info(f"Writing {events} events to {job[0]}")
+            write_ntuple(*job, **options)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(write_ntuple, *job, **options) for job in jobs]
+            for future in as_completed(futures):
+                log.info(f"Wrote {events} events to {future.result()}")
+    return sum(os.path.getsize(job[0]) for job in jobs)